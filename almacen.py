@@ -0,0 +1,212 @@
+"""
+Almacén direccionado por contenido para las entradas de las versiones.
+
+Cada tabla (viviendas, capítulos, planificación) y cada conjunto de
+parámetros se guarda una sola vez como blob, con su huella SHA-256 como
+nombre, en <carpeta>/<2 primeros caracteres>/<huella>.<ext>. Una versión es
+un manifiesto JSON pequeño que apunta a esos blobs, de modo que guardar una
+variante que solo cambia un parámetro escribe un blob de parámetros y un
+manifiesto, y duplicar una versión es copiar el manifiesto.
+
+Los blobs son inmutables: se escriben en un temporal, se llevan a disco y se
+renombran, y su lectura se memoriza en el proceso.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+import tablas as formato
+
+# Versión del formato de manifiesto
+FORMATO = 2
+
+_EXT_TABLA = ".npz"
+_EXT_PARAMETROS = ".json"
+_CLAVE_META = "__meta__"
+_PREFIJO = "t"
+
+
+def _ruta_blob(carpeta: str, huella: str, extension: str) -> str:
+    return os.path.join(carpeta, huella[:2], f"{huella}{extension}")
+
+
+def _sincronizar_carpeta(carpeta: str) -> None:
+    """
+    Lleva a disco la entrada de la carpeta (el renombrado). En Windows no se
+    puede abrir una carpeta y no se hace.
+    """
+    try:
+        fd = os.open(carpeta, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def escribir_atomico(ruta: str, escribir) -> None:
+    """
+    Escribe en un temporal de la misma carpeta, lo lleva a disco (fsync) y lo
+    renombra a 'ruta': tras un corte 'ruta' tiene el contenido anterior o el
+    nuevo completo, nunca uno a medias.
+    """
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            escribir(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+        _sincronizar_carpeta(carpeta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def huella_tabla(descripcion: dict, arrays: dict) -> str:
+    """
+    Huella SHA-256 del contenido de una tabla (columnas, tipos y datos), no
+    del archivo comprimido, que no es byte a byte reproducible.
+    """
+    h = hashlib.sha256(json.dumps(descripcion, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    for clave in sorted(arrays):
+        valores = np.ascontiguousarray(arrays[clave])
+        h.update(f"{clave}|{valores.dtype.str}|{valores.shape}".encode("utf-8"))
+        h.update(valores.tobytes())
+    return h.hexdigest()
+
+
+def guardar_tabla(carpeta: str, df) -> str:
+    """
+    Guarda una tabla si no existe ya en el almacén y devuelve su huella.
+    """
+    descripcion, arrays = formato.tabla_a_arrays(df, _PREFIJO)
+    huella = huella_tabla(descripcion, arrays)
+    ruta = _ruta_blob(carpeta, huella, _EXT_TABLA)
+    if not os.path.isfile(ruta):
+        arrays[_CLAVE_META] = np.array(json.dumps(descripcion, ensure_ascii=False))
+        escribir_atomico(ruta, lambda f: np.savez_compressed(f, **arrays))
+    return huella
+
+
+@lru_cache(maxsize=256)
+def _leer_tabla(ruta: str):
+    with np.load(ruta, allow_pickle=False) as datos:
+        descripcion = json.loads(str(datos[_CLAVE_META]))
+        return formato.arrays_a_tabla(descripcion, datos, _PREFIJO)
+
+
+def cargar_tabla(carpeta: str, huella: str):
+    ruta = _ruta_blob(carpeta, huella, _EXT_TABLA)
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError(f"Falta la tabla {huella} en el almacén.")
+    # Copia: la tabla memorizada no debe modificarse desde fuera
+    return _leer_tabla(ruta).copy()
+
+
+def guardar_parametros(carpeta: str, parametros: dict) -> str:
+    """
+    Guarda un conjunto de parámetros (ya serializable en JSON) si no existe y
+    devuelve su huella.
+    """
+    contenido = json.dumps(parametros, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    huella = hashlib.sha256(contenido).hexdigest()
+    ruta = _ruta_blob(carpeta, huella, _EXT_PARAMETROS)
+    if not os.path.isfile(ruta):
+        escribir_atomico(ruta, lambda f: f.write(contenido))
+    return huella
+
+
+@lru_cache(maxsize=256)
+def _leer_parametros(ruta: str) -> str:
+    with open(ruta, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def cargar_parametros(carpeta: str, huella: str) -> dict:
+    ruta = _ruta_blob(carpeta, huella, _EXT_PARAMETROS)
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError(f"Faltan los parámetros {huella} en el almacén.")
+    return json.loads(_leer_parametros(ruta))
+
+
+def guardar_manifiesto(ruta: str, carpeta: str, fecha: str, parametros: dict, tablas: dict) -> dict:
+    """
+    Guarda parámetros y tablas en el almacén (solo los blobs nuevos) y escribe
+    en 'ruta' el manifiesto de la versión. Las tablas None se omiten.
+    """
+    manifiesto = {
+        "formato": FORMATO,
+        "fecha": fecha,
+        "parametros": guardar_parametros(carpeta, formato.parametros_a_json(parametros)),
+        "tablas": {
+            nombre: guardar_tabla(carpeta, df)
+            for nombre, df in tablas.items()
+            if df is not None
+        },
+    }
+    escribir_manifiesto(ruta, manifiesto)
+    return manifiesto
+
+
+def escribir_manifiesto(ruta: str, manifiesto: dict) -> None:
+    contenido = json.dumps(manifiesto, ensure_ascii=False, indent=1).encode("utf-8")
+    escribir_atomico(ruta, lambda f: f.write(contenido))
+
+
+def leer_manifiesto(ruta: str) -> dict:
+    with open(ruta, "r", encoding="utf-8") as f:
+        manifiesto = json.load(f)
+    if manifiesto.get("formato", 0) > FORMATO:
+        raise ValueError(f"Formato de versión {manifiesto['formato']} no soportado.")
+    return manifiesto
+
+
+def cargar_manifiesto(ruta: str, carpeta: str):
+    """
+    Devuelve (manifiesto, parametros, tablas) de una versión. Los parámetros
+    quedan tal como están en el JSON (las fechas como texto ISO).
+    """
+    manifiesto = leer_manifiesto(ruta)
+    parametros = cargar_parametros(carpeta, manifiesto["parametros"])
+    tablas = {nombre: cargar_tabla(carpeta, huella) for nombre, huella in manifiesto["tablas"].items()}
+    return manifiesto, parametros, tablas
+
+
+def huellas(manifiesto: dict) -> set:
+    return {manifiesto["parametros"], *manifiesto["tablas"].values()}
+
+
+def limpiar(carpeta: str, rutas_manifiestos) -> int:
+    """
+    Elimina los blobs que no referencia ninguno de los manifiestos indicados
+    (que deben ser todos los del almacén). Devuelve el número de blobs
+    eliminados. Quien llama debe impedir guardados simultáneos (ver
+    versionado.limpiar_almacen).
+    """
+    referenciadas = set()
+    for ruta in rutas_manifiestos:
+        referenciadas |= huellas(leer_manifiesto(ruta))
+    eliminados = 0
+    if not os.path.isdir(carpeta):
+        return 0
+    for subcarpeta in os.listdir(carpeta):
+        ruta_sub = os.path.join(carpeta, subcarpeta)
+        if not os.path.isdir(ruta_sub):
+            continue
+        for archivo in os.listdir(ruta_sub):
+            huella, extension = os.path.splitext(archivo)
+            if extension in (_EXT_TABLA, _EXT_PARAMETROS) and huella not in referenciadas:
+                os.remove(os.path.join(ruta_sub, archivo))
+                eliminados += 1
+    return eliminados
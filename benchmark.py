@@ -0,0 +1,378 @@
+"""
+Banco de pruebas de rendimiento de cada etapa del cálculo.
+
+Genera proyectos sintéticos de varios tamaños (número de viviendas, de
+capítulos y meses de obra) y mide cada etapa por separado: lectura de la
+tabla de viviendas pegada, ingresos y comisiones, cronograma de ejecución,
+otros costes y su consolidación, flujo de caja, saldo de la cuenta especial,
+necesidades de financiación, libro de movimientos, actualización incremental
+de una vivienda y guardado y carga de una versión. Cada medida se repite
+hasta 'repeticiones' veces (menos si una etapa agota SEGUNDOS_MAXIMOS) y se
+anotan el mínimo y la mediana.
+
+Los resultados se escriben en un JSON con el entorno (versiones de Python,
+NumPy y pandas, numba, CPU) para compararlos entre ejecuciones: con
+--comparar se enfrentan a un JSON anterior y el programa termina con código
+1 si alguna etapa es más lenta que la anterior más la tolerancia.
+
+Uso:
+    python benchmark.py [--viviendas 20 1000 100000 1000000] [--capitulos 17 5000]
+                        [--meses 18 120] [--etapas ...] [--repeticiones 3]
+                        [--salida benchmark.json] [--comparar ANTERIOR.json]
+                        [--tolerancia 0.25]
+
+Los tamaños por defecto incluyen un millón de viviendas: la ejecución
+completa tarda varios minutos y necesita unos GB de memoria.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+import motor
+
+VIVIENDAS = (20, 1_000, 100_000, 1_000_000)
+# 17 = los capítulos de motor.PESOS_DEFECTO
+CAPITULOS = (17, 5_000)
+MESES = (18, 120)
+
+REPETICIONES = 3
+# Una etapa no se repite más cuando sus medidas ya suman este tiempo
+SEGUNDOS_MAXIMOS = 10.0
+TOLERANCIA = 0.25
+
+FECHA_INICIO_OBRA = date(2025, 1, 1)
+FECHA_INICIO_COMERCIALIZACION = date(2024, 10, 1)
+SEMILLA = 12345
+
+
+# ---------------------------------------------------------------------------
+# Proyectos sintéticos
+# ---------------------------------------------------------------------------
+
+def generar_parametros(num_viviendas: int, meses: int) -> motor.ParametrosProyecto:
+    """
+    Parámetros de un proyecto de num_viviendas viviendas de 100 m² con
+    'meses' meses de obra.
+    """
+    return motor.ParametrosProyecto(
+        num_viviendas=num_viviendas,
+        superficie_total=100.0 * num_viviendas,
+        fecha_inicio_obra=FECHA_INICIO_OBRA,
+        fecha_inicio_comercializacion=FECHA_INICIO_COMERCIALIZACION,
+        plazo_obra_meses=meses,
+    )
+
+
+def generar_texto_viviendas(num_viviendas: int, meses: int, semilla: int = SEMILLA) -> str:
+    """
+    Tabla de viviendas como texto pegado desde Excel (tabuladores, precios
+    y fechas en formato español): ventas repartidas desde el inicio de la
+    comercialización hasta la entrega, una de cada diez sin vender y una de
+    cada cuatro con fecha de escrituración.
+    """
+    rng = np.random.default_rng(semilla)
+    parametros = generar_parametros(num_viviendas, meses)
+    inicio = np.datetime64(FECHA_INICIO_COMERCIALIZACION, "D")
+    dias = (np.datetime64(parametros.fecha_entrega_viviendas, "D") - inicio).astype(np.int64)
+
+    codigos = pd.Series(np.arange(num_viviendas)).map("V{:07d}".format)
+    precios = pd.Series(np.round(rng.uniform(150_000, 600_000, num_viviendas), 2))
+    precios = precios.map("{:,.2f}".format).str.replace(",", "_").str.replace(".", ",").str.replace("_", ".")
+    ventas = pd.Series(inicio + rng.integers(0, dias, num_viviendas)).dt.strftime("%d/%m/%Y")
+    ventas = ventas.where(rng.random(num_viviendas) >= 0.1, "")
+    escrituras = pd.Series(np.datetime64(parametros.fecha_entrega_viviendas, "D") + rng.integers(0, 90, num_viviendas))
+    escrituras = escrituras.dt.strftime("%d/%m/%Y").where(rng.random(num_viviendas) < 0.25, "")
+
+    filas = codigos + "\t" + precios + "\t" + ventas + "\t" + escrituras
+    return "Código\tPrecio\tFecha venta\tFecha escrituración\n" + "\n".join(filas.tolist())
+
+
+def generar_capitulos(num_capitulos: int, coste_total_ejecucion: float, semilla: int = SEMILLA) -> pd.DataFrame:
+    """
+    Capítulos con sus pesos: los de por defecto si num_capitulos es su
+    número; si no, partidas con pesos aleatorios que suman 100.
+    """
+    if num_capitulos == len(motor.PESOS_DEFECTO):
+        return motor.capitulos_por_defecto(coste_total_ejecucion)
+    rng = np.random.default_rng(semilla)
+    pesos = rng.random(num_capitulos)
+    df_capitulos = pd.DataFrame({
+        "Capítulo": [f"Partida {i:05d}" for i in range(num_capitulos)],
+        "Peso (%)": pesos / pesos.sum() * 100,
+    })
+    df_capitulos["Coste ejecución ajustado (€)"] = -round(df_capitulos["Peso (%)"] * coste_total_ejecucion / 100, 2)
+    return df_capitulos
+
+
+def generar_planificacion(df_capitulos: pd.DataFrame, meses: int, semilla: int = SEMILLA) -> pd.DataFrame:
+    """
+    Planificación de los capítulos dentro de los 'meses' de obra: la de por
+    defecto para los capítulos por defecto; si no, inicios y duraciones
+    aleatorios.
+    """
+    if set(df_capitulos["Capítulo"]) <= set(motor.PESOS_DEFECTO):
+        return motor.planificacion_por_defecto(df_capitulos, FECHA_INICIO_OBRA)
+    rng = np.random.default_rng(semilla)
+    n = len(df_capitulos)
+    duraciones = rng.integers(1, min(12, meses) + 1, n)
+    desplazamientos = rng.integers(0, meses - duraciones + 1)
+    inicios = pd.Series(np.datetime64(FECHA_INICIO_OBRA, "M") + desplazamientos).dt.date
+    return pd.DataFrame({"Capítulo": df_capitulos["Capítulo"], "Inicio": inicios, "Duración (meses)": duraciones})
+
+
+# ---------------------------------------------------------------------------
+# Medida
+# ---------------------------------------------------------------------------
+
+def medir(funcion, repeticiones: int = REPETICIONES, segundos_maximos: float = SEGUNDOS_MAXIMOS) -> list:
+    """
+    Tiempos en segundos de hasta 'repeticiones' llamadas a funcion(); deja
+    de repetir cuando la suma supera segundos_maximos (al menos una).
+    """
+    tiempos = []
+    while len(tiempos) < max(repeticiones, 1):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+        if sum(tiempos) >= segundos_maximos:
+            break
+    return tiempos
+
+
+def _etapas(num_viviendas: int, num_capitulos: int, meses: int, carpeta: str):
+    """
+    Prepara un proyecto sintético y devuelve una lista de (etapa, filas,
+    funcion) con las entradas de cada etapa ya calculadas, en el orden del
+    modelo.
+    """
+    import almacen
+    import incremental
+    import ingesta
+    import movimientos
+    import versionado
+
+    p = generar_parametros(num_viviendas, meses)
+    texto = generar_texto_viviendas(num_viviendas, meses)
+    df_viviendas = ingesta.leer_texto(texto, p.fecha_entrega_viviendas).viviendas
+    df_capitulos = generar_capitulos(num_capitulos, p.coste_total_ejecucion)
+    df_planificacion = generar_planificacion(df_capitulos, meses)
+
+    def ingresos():
+        return motor.calcular_ingresos(
+            df_viviendas, p.fecha_entrega_viviendas, p.reserva_fija, p.pct_contrato, p.pct_aplazado,
+            p.iva_venta, p.comisiones_venta, p.iva_otros,
+        )
+
+    def cronograma():
+        return motor.calcular_cronograma(df_planificacion, df_capitulos, p.coste_total_ejecucion)
+
+    def otros_costes():
+        return motor.calcular_otros_costes(
+            df_viviendas, p.fecha_inicio_obra, p.fecha_inicio_comercializacion, p.plazo_obra_meses, p.coste_suelo,
+            p.coste_total_ejecucion, p.porcentaje_honorarios, p.porcentaje_admin, p.gastos_financieros,
+        )
+
+    df_ingresos, df_cronograma, df_otros = ingresos(), cronograma(), otros_costes()["total"]
+    df_flujo = motor.calcular_flujo_caja(df_ingresos, df_cronograma, df_otros)
+    flujo_cuenta = df_flujo["Flujo cuenta especial (€)"].to_numpy(dtype=np.float64)
+
+    modelo = incremental.FlujoIncremental(p, df_viviendas, df_planificacion, df_capitulos)
+    fechas_venta = [pd.Timestamp(FECHA_INICIO_COMERCIALIZACION), pd.Timestamp(FECHA_INICIO_OBRA)]
+
+    def cambiar_vivienda():
+        # Alterna la fecha de venta de la vivienda central
+        fechas_venta.reverse()
+        modelo.cambiar_viviendas(pd.DataFrame({"Fecha venta": fechas_venta[:1]}, index=[num_viviendas // 2]))
+
+    # Versiones en carpetas base nuevas (<carpeta>/<n>/proyecto/versión.json)
+    # para medir el guardado con el almacén vacío y la carga sin las tablas
+    # memorizadas por almacen.py
+    parametros = p.como_dict()
+    tablas = {"df_viviendas": df_viviendas, "df_capitulos": df_capitulos[["Capítulo", "Peso (%)"]], "df_planificacion": df_planificacion}
+    guardadas = []
+
+    def guardar_version():
+        ruta = os.path.join(carpeta, str(len(os.listdir(carpeta))), "proyecto", f"versión{versionado.EXTENSION}")
+        os.makedirs(os.path.dirname(ruta))
+        versionado._escribir_version(ruta, datetime.now(), parametros, tablas)
+        guardadas.append(ruta)
+
+    def cargar_version():
+        almacen._leer_tabla.cache_clear()
+        almacen._leer_parametros.cache_clear()
+        return versionado._leer_version(guardadas[0])
+
+    guardar_version()
+
+    return [
+        ("lectura_viviendas", num_viviendas, lambda: ingesta.leer_texto(texto, p.fecha_entrega_viviendas)),
+        ("ingresos", num_viviendas, ingresos),
+        ("cronograma", num_capitulos, cronograma),
+        ("otros_costes", num_viviendas, otros_costes),
+        ("flujo_caja", len(df_flujo), lambda: motor.calcular_flujo_caja(df_ingresos, df_cronograma, df_otros)),
+        ("cuenta_especial", len(flujo_cuenta), lambda: motor.saldo_cuenta_especial(flujo_cuenta)),
+        ("necesidades", len(df_flujo), lambda: motor.calcular_necesidades(df_flujo)),
+        ("movimientos", num_viviendas, lambda: movimientos.construir(p, df_viviendas, df_planificacion, df_capitulos)),
+        ("incremental_vivienda", 1, cambiar_vivienda),
+        ("guardar_version", num_viviendas, guardar_version),
+        ("cargar_version", num_viviendas, cargar_version),
+    ]
+
+
+ETAPAS = (
+    "lectura_viviendas",
+    "ingresos",
+    "cronograma",
+    "otros_costes",
+    "flujo_caja",
+    "cuenta_especial",
+    "necesidades",
+    "movimientos",
+    "incremental_vivienda",
+    "guardar_version",
+    "cargar_version",
+)
+
+
+def ejecutar(
+    viviendas=VIVIENDAS,
+    capitulos=CAPITULOS,
+    meses=MESES,
+    etapas=ETAPAS,
+    repeticiones: int = REPETICIONES,
+    al_medir=None,
+) -> list:
+    """
+    Mide las etapas pedidas en cada combinación de tamaños. Devuelve una
+    lista de diccionarios con 'etapa', 'viviendas', 'capitulos', 'meses',
+    'filas', 'repeticiones', 'segundos_min' y 'segundos_mediana';
+    al_medir(resultado) se llama tras cada medida.
+    """
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as carpeta:
+        for num_viviendas in viviendas:
+            for num_capitulos in capitulos:
+                for num_meses in meses:
+                    for etapa, filas, funcion in _etapas(num_viviendas, num_capitulos, num_meses, carpeta):
+                        if etapa not in etapas:
+                            continue
+                        tiempos = medir(funcion, repeticiones)
+                        resultado = {
+                            "etapa": etapa,
+                            "viviendas": num_viviendas,
+                            "capitulos": num_capitulos,
+                            "meses": num_meses,
+                            "filas": int(filas),
+                            "repeticiones": len(tiempos),
+                            "segundos_min": min(tiempos),
+                            "segundos_mediana": statistics.median(tiempos),
+                        }
+                        resultados.append(resultado)
+                        if al_medir:
+                            al_medir(resultado)
+    return resultados
+
+
+def entorno() -> dict:
+    """
+    Versiones y máquina de la ejecución, para interpretar las comparaciones.
+    """
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "numba": motor.njit is not None,
+        "plataforma": platform.platform(),
+        "procesador": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _clave(resultado: dict) -> tuple:
+    return resultado["etapa"], resultado["viviendas"], resultado["capitulos"], resultado["meses"]
+
+
+def comparar(resultados: list, anteriores: list, tolerancia: float = TOLERANCIA) -> list:
+    """
+    Enfrenta cada medida a la misma (etapa y tamaños) de una ejecución
+    anterior por su tiempo mínimo. Devuelve una lista de diccionarios con la
+    clave, ambos tiempos, el cociente y 'regresion' (más lenta que la
+    anterior por más de 'tolerancia').
+    """
+    por_clave = {_clave(r): r for r in anteriores}
+    comparaciones = []
+    for resultado in resultados:
+        anterior = por_clave.get(_clave(resultado))
+        if anterior is None:
+            continue
+        cociente = resultado["segundos_min"] / anterior["segundos_min"] if anterior["segundos_min"] else float("inf")
+        comparaciones.append({
+            **{k: resultado[k] for k in ("etapa", "viviendas", "capitulos", "meses")},
+            "segundos_antes": anterior["segundos_min"],
+            "segundos_ahora": resultado["segundos_min"],
+            "cociente": cociente,
+            "regresion": cociente > 1 + tolerancia,
+        })
+    return comparaciones
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Mide cada etapa del cálculo sobre proyectos sintéticos de varios tamaños.")
+    parser.add_argument("--viviendas", nargs="+", type=int, default=list(VIVIENDAS), help="Números de viviendas")
+    parser.add_argument("--capitulos", nargs="+", type=int, default=list(CAPITULOS), help="Números de capítulos (17: los de por defecto)")
+    parser.add_argument("--meses", nargs="+", type=int, default=list(MESES), help="Meses de obra")
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=list(ETAPAS), help="Etapas a medir (por defecto: todas)")
+    parser.add_argument("--repeticiones", type=int, default=REPETICIONES, help=f"Repeticiones de cada medida (por defecto: {REPETICIONES})")
+    parser.add_argument("--salida", default="benchmark.json", help="JSON de resultados (por defecto: ./benchmark.json)")
+    parser.add_argument("--comparar", metavar="ANTERIOR.json", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA, help=f"Lentitud admitida al comparar (por defecto: {TOLERANCIA:.0%})")
+    args = parser.parse_args(argv)
+
+    def informar(r):
+        print(
+            f"{r['etapa']:<22} viviendas={r['viviendas']:<9,} capítulos={r['capitulos']:<6,} meses={r['meses']:<4} "
+            f"{r['segundos_min'] * 1000:>10.2f} ms (mediana {r['segundos_mediana'] * 1000:.2f} ms, {r['repeticiones']} rep.)",
+            flush=True,
+        )
+
+    inicio = time.perf_counter()
+    resultados = ejecutar(args.viviendas, args.capitulos, args.meses, args.etapas, args.repeticiones, al_medir=informar)
+    informe = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "entorno": entorno(),
+        "segundos_totales": time.perf_counter() - inicio,
+        "resultados": resultados,
+    }
+
+    regresiones = 0
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anteriores = json.load(f)["resultados"]
+        informe["comparacion"] = comparar(resultados, anteriores, args.tolerancia)
+        for c in informe["comparacion"]:
+            if c["regresion"]:
+                regresiones += 1
+                print(
+                    f"❌ {c['etapa']} ({c['viviendas']:,} viviendas, {c['capitulos']:,} capítulos, {c['meses']} meses): "
+                    f"{c['segundos_antes'] * 1000:.2f} → {c['segundos_ahora'] * 1000:.2f} ms (x{c['cociente']:.2f})",
+                    file=sys.stderr,
+                )
+        print(f"{len(informe['comparacion']) - regresiones}/{len(informe['comparacion'])} medidas sin regresión frente a {args.comparar}")
+
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    print(f"{len(resultados)} medidas en {informe['segundos_totales']:.1f} s → {args.salida}")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Bloqueos de archivo por proyecto para leer y escribir versiones.
+
+Guardar, duplicar y eliminar una versión toman el bloqueo exclusivo de la
+carpeta del proyecto; cargarla, el compartido. Así dos usuarios que guardan
+a la vez en un mismo proyecto escriben uno detrás de otro, y una carga nunca
+ve una versión a medio escribir (el manifiesto se renombra al final, pero el
+que sustituye a una versión anterior en otro formato la borra después).
+
+El almacén de blobs compartido por los proyectos se bloquea igual: los
+guardados lo toman compartido y la limpieza de blobs sin referencias en
+exclusiva, para no borrar los de un guardado cuyo manifiesto aún no existe.
+
+El bloqueo es un flock sobre <carpeta del proyecto>/.bloqueo, de modo que
+ordena también varios procesos del servidor (o varios servidores sobre la
+misma carpeta compartida). Donde no hay fcntl (Windows) solo se ordenan los
+hilos del proceso, sin distinguir lecturas de escrituras.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+ARCHIVO_BLOQUEO = ".bloqueo"
+
+_bloqueos_proceso = {}
+_bloqueo = threading.Lock()
+
+
+def _bloqueo_proceso(carpeta: str) -> threading.Lock:
+    with _bloqueo:
+        return _bloqueos_proceso.setdefault(os.path.abspath(carpeta), threading.Lock())
+
+
+@contextmanager
+def bloquear(carpeta: str, compartido: bool = False):
+    """
+    Bloquea la carpeta de un proyecto mientras dura el bloque 'with': en
+    exclusiva para escribir o compartido (compartido=True) para leer. Una
+    carpeta que no existe no se bloquea (ni se crea).
+    """
+    if not os.path.isdir(carpeta):
+        yield
+        return
+    if fcntl is None:
+        with _bloqueo_proceso(carpeta):
+            yield
+        return
+    with open(os.path.join(carpeta, ARCHIVO_BLOQUEO), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if compartido else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,146 @@
+"""
+Caché en disco de las tablas leídas de pegados y archivos subidos.
+
+La clave de cada lectura es la huella SHA-256 del contenido (texto pegado o
+bytes del archivo) más las opciones que cambian el resultado (hoja, mapeo de
+columnas, fecha de entrega...), de modo que el mismo libro o el mismo pegado
+se parsea una sola vez por servidor aunque cambien otros widgets, se
+reinicie la app o lo suba otra sesión.
+
+Cada entrada es un .npz sin comprimir con sus tablas en el formato columnar
+de tablas.py y un JSON de metadatos, escrito en un temporal y renombrado.
+El tamaño total de la carpeta está acotado (TAM_MAXIMO_BYTES): al superarlo
+se borran las entradas usadas hace más tiempo (cada lectura actualiza la
+fecha de modificación del archivo). Una entrada que no se puede leer se
+trata como ausente.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import tablas as formato
+from almacen import escribir_atomico
+
+CARPETA_CACHE = os.path.join(os.getcwd(), ".cache_lecturas")
+TAM_MAXIMO_BYTES = 512 * 1024 * 1024
+# Entra en todas las claves: se sube al cambiar cómo se interpreta una
+# lectura, para no servir tablas parseadas con las reglas anteriores
+VERSION_LECTURA = 2
+
+_EXT = ".npz"
+_CLAVE_META = "__meta__"
+
+
+def clave(tipo: str, contenido, **opciones) -> str:
+    """
+    Huella de una lectura: tipo de lectura, contenido (str o bytes) y
+    opciones (serializables en JSON; las fechas, como texto).
+    """
+    if isinstance(contenido, str):
+        contenido = contenido.encode("utf-8")
+    h = hashlib.sha256(f"{tipo}:{VERSION_LECTURA}".encode("utf-8"))
+    h.update(json.dumps(opciones, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"))
+    h.update(contenido)
+    return h.hexdigest()
+
+
+def _ruta(carpeta: str, huella: str) -> str:
+    return os.path.join(carpeta, f"{huella}{_EXT}")
+
+
+def leer(huella: str, carpeta: str = None):
+    """
+    Devuelve (metadatos, {nombre: DataFrame}) de una entrada o None si no
+    está en la caché.
+    """
+    ruta = _ruta(carpeta or CARPETA_CACHE, huella)
+    try:
+        with np.load(ruta, allow_pickle=False) as datos:
+            meta = json.loads(str(datos[_CLAVE_META]))
+            tablas = {
+                nombre: formato.arrays_a_tabla(descripcion, datos, nombre)
+                for nombre, descripcion in meta.pop("tablas").items()
+            }
+        os.utime(ruta)
+    except (OSError, ValueError, KeyError):
+        # Ausente, expulsada mientras se leía o escrita por otra versión
+        return None
+    return meta, tablas
+
+
+def guardar(huella: str, tablas: dict, metadatos: dict = None, carpeta: str = None, tam_maximo: int = None) -> None:
+    """
+    Guarda las tablas ({nombre: DataFrame}) y metadatos (JSON) de una lectura
+    y expulsa entradas antiguas si la caché supera tam_maximo bytes.
+    """
+    carpeta = carpeta or CARPETA_CACHE
+    meta = dict(metadatos or {})
+    meta["tablas"] = {}
+    arrays = {}
+    for nombre, df in tablas.items():
+        descripcion, arrays_tabla = formato.tabla_a_arrays(df, nombre)
+        meta["tablas"][nombre] = descripcion
+        arrays.update(arrays_tabla)
+    arrays[_CLAVE_META] = np.array(json.dumps(meta, ensure_ascii=False))
+    escribir_atomico(_ruta(carpeta, huella), lambda f: np.savez(f, **arrays))
+    expulsar(carpeta, TAM_MAXIMO_BYTES if tam_maximo is None else tam_maximo)
+
+
+def _entradas(carpeta: str) -> list:
+    entradas = []
+    try:
+        nombres = os.listdir(carpeta)
+    except FileNotFoundError:
+        return entradas
+    for nombre in nombres:
+        if not nombre.endswith(_EXT):
+            continue
+        try:
+            estado = os.stat(os.path.join(carpeta, nombre))
+        except FileNotFoundError:
+            continue
+        entradas.append((estado.st_mtime, estado.st_size, nombre))
+    return entradas
+
+
+def tamaño(carpeta: str = None) -> int:
+    """
+    Bytes ocupados por las entradas de la caché.
+    """
+    return sum(tam for _, tam, _ in _entradas(carpeta or CARPETA_CACHE))
+
+
+def expulsar(carpeta: str = None, tam_maximo: int = TAM_MAXIMO_BYTES) -> int:
+    """
+    Borra las entradas usadas hace más tiempo hasta que la caché ocupe como
+    mucho tam_maximo bytes. Devuelve el número de entradas borradas.
+    """
+    carpeta = carpeta or CARPETA_CACHE
+    entradas = sorted(_entradas(carpeta))
+    total = sum(tam for _, tam, _ in entradas)
+    borradas = 0
+    for _, tam, nombre in entradas:
+        if total <= tam_maximo:
+            break
+        try:
+            os.remove(os.path.join(carpeta, nombre))
+        except FileNotFoundError:
+            pass
+        total -= tam
+        borradas += 1
+    return borradas
+
+
+def memorizar(huella: str, calcular, carpeta: str = None):
+    """
+    Devuelve (metadatos, tablas) de la entrada 'huella' o, si no existe, los
+    obtiene con calcular() -> (tablas, metadatos), los guarda y los devuelve.
+    """
+    encontrado = leer(huella, carpeta)
+    if encontrado is not None:
+        return encontrado
+    tablas, metadatos = calcular()
+    guardar(huella, tablas, metadatos, carpeta)
+    return dict(metadatos or {}), tablas
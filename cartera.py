@@ -0,0 +1,259 @@
+"""
+Cartera: flujo de caja y necesidades de financiación consolidados de todos
+los proyectos.
+
+Cada proyecto activo entra con su versión elegida en el catálogo (por
+defecto, la más reciente). Los proyectos se evalúan con el motor completo en
+un pool de procesos; cada uno devuelve solo sus series mensuales como arrays
+y su primer mes, y aquí se colocan en una matriz proyectos x meses sobre un
+eje común de índices de mes (motor.indice_mes). El consolidado es la suma por
+columnas y los acumulados, su suma acumulada.
+
+Los resultados de cada versión se memorizan en el proceso por (proyecto,
+versión, fecha de guardado): al volver a consolidar solo se evalúan los
+proyectos que han cambiado. La memoria está acotada a MAX_RESULTADOS
+versiones; se olvidan las usadas hace más tiempo.
+
+Uso por lotes:
+    python cartera.py [--salida salida_cartera] [--procesos N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import motor
+
+# Series mensuales que se consolidan (columnas de motor.evaluar_proyecto)
+SERIES = {
+    "Ingresos netos (€)": "flujo",
+    "Coste ejecución (€)": "flujo",
+    "Total otros costes (€)": "flujo",
+    "Flujo mensual total (€)": "flujo",
+    "Déficit cuenta especial (€)": "flujo",
+    "Total necesidades financiación (€)": "necesidades",
+}
+
+# Acumulados que se derivan de las series consolidadas
+ACUMULADOS = {
+    "Flujo acumulado (€)": "Flujo mensual total (€)",
+    "Necesidades acumuladas (€)": "Total necesidades financiación (€)",
+}
+
+# Proyectos que se muestran por separado en los gráficos apilados
+MAX_PROYECTOS_GRAFICO = 15
+
+# Resultados de versiones ya evaluadas, del menos al más usado
+MAX_RESULTADOS = 1024
+_resultados = {}
+
+
+@dataclass
+class ResultadoCartera:
+    """
+    consolidado: 'Mes', las SERIES sumadas y los ACUMULADOS.
+    por_proyecto: {serie: tabla 'Mes' x proyecto} para las SERIES y ACUMULADOS.
+    proyectos: una fila por proyecto con versión, margen, pico de
+    financiación, segundos de cálculo y error (si no se pudo evaluar).
+    """
+    consolidado: pd.DataFrame
+    por_proyecto: dict
+    proyectos: pd.DataFrame
+
+
+def _evaluar_version(proyecto: str, version: str) -> dict:
+    """
+    Evalúa una versión guardada y devuelve sus series mensuales como arrays
+    desde su primer mes.
+    """
+    from versionado import leer_entradas
+
+    inicio = time.perf_counter()
+    resultado = {"proyecto": proyecto, "version": version, "error": None}
+    try:
+        parametros, tablas = leer_entradas(version, proyecto)
+        resultados = motor.evaluar_proyecto(
+            motor.ParametrosProyecto(**parametros),
+            tablas.get("df_viviendas"),
+            tablas.get("df_planificacion"),
+            tablas.get("df_capitulos"),
+        )
+        if resultados["flujo"] is None:
+            raise ValueError("La versión no tiene viviendas: no hay flujo de caja.")
+        resultado["primer_mes"] = motor.rango_tabla(resultados["flujo"])[0]
+        resultado["series"] = {
+            serie: resultados[tabla][serie].to_numpy(dtype=np.float64)
+            for serie, tabla in SERIES.items()
+        }
+        resultado.update(motor.indicadores(resultados))
+    except Exception as e:
+        resultado["error"] = str(e)
+    resultado["segundos"] = time.perf_counter() - inicio
+    return resultado
+
+
+def _evaluar_trabajo(trabajo: tuple) -> dict:
+    return _evaluar_version(*trabajo)
+
+
+def evaluar_versiones(seleccion: list, procesos: int = None, al_avanzar=None) -> list:
+    """
+    Evalúa las versiones de 'seleccion' (diccionarios con 'proyecto',
+    'version' y 'fecha', como catalogo.versiones_cartera) y devuelve sus
+    resultados en el mismo orden. Las ya evaluadas con la misma fecha se toman
+    de memoria; el resto se reparte en un pool de procesos (por defecto, uno
+    por núcleo). al_avanzar(hechos, total) se llama tras cada proyecto.
+    """
+    claves = [(s["proyecto"], s["version"], s["fecha"]) for s in seleccion]
+    obtenidos = {}
+    for clave in dict.fromkeys(claves):
+        if clave in _resultados:
+            obtenidos[clave] = _memorizar(clave, _resultados.pop(clave))
+    pendientes = [clave for clave in dict.fromkeys(claves) if clave not in obtenidos]
+    total = len(claves)
+    hechos = total - len(pendientes)
+    if al_avanzar:
+        al_avanzar(hechos, total)
+
+    procesos = min(procesos or os.cpu_count() or 1, max(len(pendientes), 1))
+    if procesos == 1:
+        for clave in pendientes:
+            obtenidos[clave] = _memorizar(clave, _evaluar_version(clave[0], clave[1]))
+            hechos += 1
+            if al_avanzar:
+                al_avanzar(hechos, total)
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = {pool.submit(_evaluar_trabajo, clave[:2]): clave for clave in pendientes}
+            for futuro in as_completed(futuros):
+                clave = futuros[futuro]
+                obtenidos[clave] = _memorizar(clave, futuro.result())
+                hechos += 1
+                if al_avanzar:
+                    al_avanzar(hechos, total)
+    return [obtenidos[clave] for clave in claves]
+
+
+def _memorizar(clave: tuple, resultado: dict) -> dict:
+    """
+    Guarda un resultado como el más reciente y olvida los más antiguos al
+    pasar de MAX_RESULTADOS.
+    """
+    _resultados[clave] = resultado
+    while len(_resultados) > MAX_RESULTADOS:
+        del _resultados[next(iter(_resultados))]
+    return resultado
+
+
+def consolidar_resultados(resultados: list) -> ResultadoCartera:
+    """
+    Alinea las series de cada proyecto en un eje de meses común y las suma.
+    """
+    correctos = [r for r in resultados if r["error"] is None]
+    if correctos:
+        primer_mes = min(r["primer_mes"] for r in correctos)
+        fin = max(r["primer_mes"] + len(r["series"]["Flujo mensual total (€)"]) for r in correctos)
+    else:
+        primer_mes, fin = 0, 0
+    num_meses = fin - primer_mes
+    meses = motor.etiquetas_mes(primer_mes, num_meses)
+    nombres = [r["proyecto"] for r in correctos]
+
+    matrices = {}
+    for serie in SERIES:
+        matriz = np.zeros((len(correctos), num_meses), dtype=np.float64)
+        for i, r in enumerate(correctos):
+            valores = r["series"][serie]
+            inicio = r["primer_mes"] - primer_mes
+            matriz[i, inicio:inicio + len(valores)] = valores
+        matrices[serie] = matriz
+    for acumulado, serie in ACUMULADOS.items():
+        matrices[acumulado] = np.cumsum(matrices[serie], axis=1)
+
+    consolidado = pd.DataFrame({"Mes": meses})
+    por_proyecto = {}
+    for serie, matriz in matrices.items():
+        consolidado[serie] = matriz.sum(axis=0)
+        df_serie = pd.DataFrame(matriz.T, columns=nombres)
+        df_serie.insert(0, "Mes", meses)
+        por_proyecto[serie] = df_serie
+
+    proyectos = pd.DataFrame(
+        [
+            {
+                "Proyecto": r["proyecto"],
+                "Versión": r["version"],
+                "Margen (€)": r.get("margen"),
+                "Pico de financiación (€)": r.get("pico_financiacion"),
+                "Segundos": r["segundos"],
+                "Error": r["error"],
+            }
+            for r in resultados
+        ],
+        columns=["Proyecto", "Versión", "Margen (€)", "Pico de financiación (€)", "Segundos", "Error"],
+    )
+    return ResultadoCartera(consolidado, por_proyecto, proyectos)
+
+
+def consolidar(seleccion: list = None, procesos: int = None, al_avanzar=None) -> ResultadoCartera:
+    """
+    Consolida la cartera: por defecto, los proyectos activos del catálogo con
+    su versión elegida.
+    """
+    if seleccion is None:
+        import catalogo
+
+        catalogo.asegurar()
+        seleccion = catalogo.versiones_cartera()
+    return consolidar_resultados(evaluar_versiones(seleccion, procesos, al_avanzar))
+
+
+def agrupar_resto(df_por_proyecto: pd.DataFrame, max_proyectos: int = MAX_PROYECTOS_GRAFICO) -> pd.DataFrame:
+    """
+    Deja las max_proyectos columnas de mayor importe absoluto y suma el resto
+    en 'Otros', para que los gráficos apilados sigan siendo legibles con
+    cientos de proyectos.
+    """
+    columnas = [c for c in df_por_proyecto.columns if c != "Mes"]
+    if len(columnas) <= max_proyectos:
+        return df_por_proyecto
+    orden = df_por_proyecto[columnas].abs().sum().sort_values(ascending=False).index
+    principales = list(orden[:max_proyectos])
+    resto = list(orden[max_proyectos:])
+    df = df_por_proyecto[["Mes"] + principales].copy()
+    df["Otros"] = df_por_proyecto[resto].sum(axis=1)
+    return df
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Consolida el flujo de caja de todos los proyectos activos.")
+    parser.add_argument("--salida", default="salida_cartera", help="Carpeta donde se escriben los CSV (por defecto: ./salida_cartera)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto: uno por núcleo)")
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    resultado = consolidar(procesos=args.procesos)
+    os.makedirs(args.salida, exist_ok=True)
+    resultado.consolidado.to_csv(os.path.join(args.salida, "consolidado.csv"), index=False)
+    resultado.proyectos.to_csv(os.path.join(args.salida, "proyectos.csv"), index=False)
+    for serie, df in resultado.por_proyecto.items():
+        nombre = serie.replace(" (€)", "").replace(" ", "_").lower()
+        df.to_csv(os.path.join(args.salida, f"por_proyecto_{nombre}.csv"), index=False)
+
+    errores = resultado.proyectos[resultado.proyectos["Error"].notna()]
+    for _, fila in errores.iterrows():
+        print(f"❌ {fila['Proyecto']} / {fila['Versión']}: {fila['Error']}", file=sys.stderr)
+    print(
+        f"✅ {len(resultado.proyectos) - len(errores)} proyectos consolidados en "
+        f"{time.perf_counter() - inicio:.1f} s → {args.salida}"
+    )
+    return 1 if len(errores) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
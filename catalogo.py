@@ -0,0 +1,320 @@
+"""
+Catálogo local (SQLite) de proyectos y versiones.
+
+Guarda el nombre de cada proyecto y, por versión, su fecha y sus indicadores
+principales (margen y pico de financiación). También guarda qué proyectos
+entran en la cartera consolidada y con qué versión (ver cartera.py). Lo actualizan guardar_version,
+duplicar_version y eliminar_version, y los selectores de la app lo consultan
+con búsqueda y paginación en lugar de recorrer la carpeta de versiones en
+cada ejecución.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+
+from versionado import CARPETA_BASE
+
+# El catálogo vive junto a la carpeta de versiones
+RUTA_CATALOGO = os.path.join(os.path.dirname(CARPETA_BASE), "catalogo_versiones.sqlite")
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS proyectos (
+    nombre TEXT PRIMARY KEY,
+    actualizado REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versiones (
+    proyecto TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    fecha REAL NOT NULL,
+    margen REAL,
+    pico_financiacion REAL,
+    PRIMARY KEY (proyecto, nombre)
+);
+CREATE TABLE IF NOT EXISTS cartera (
+    proyecto TEXT PRIMARY KEY,
+    version TEXT,
+    activo INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_versiones_fecha ON versiones (proyecto, fecha DESC);
+CREATE INDEX IF NOT EXISTS idx_proyectos_actualizado ON proyectos (actualizado DESC);
+"""
+
+
+# Rutas cuyo esquema ya se ha creado en este proceso
+_preparados = set()
+_bloqueo = threading.Lock()
+
+
+def _preparado(ruta: str) -> bool:
+    # Si el archivo se ha borrado con el servidor en marcha, hay que recrearlo
+    return ruta in _preparados and os.path.isfile(ruta)
+
+
+def _preparar(ruta: str, forzar: bool = False) -> None:
+    """
+    Activa WAL y crea las tablas que falten, una sola vez por ruta y proceso
+    mientras el archivo exista (executescript confirma además cualquier
+    transacción abierta).
+    """
+    with _bloqueo:
+        if not forzar and _preparado(ruta):
+            return
+        with closing(sqlite3.connect(ruta, timeout=30)) as conexion:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.executescript(_ESQUEMA)
+        _preparados.add(ruta)
+
+
+def conectar(ruta: str = None) -> sqlite3.Connection:
+    """
+    Abre el catálogo (el esquema se crea en la primera conexión a cada ruta
+    o si el archivo ya no existe).
+    """
+    ruta = os.path.abspath(ruta or RUTA_CATALOGO)
+    if not _preparado(ruta):
+        _preparar(ruta)
+    conexion = sqlite3.connect(ruta, timeout=30)
+    conexion.row_factory = sqlite3.Row
+    return conexion
+
+
+def existe(ruta: str = None) -> bool:
+    return os.path.isfile(ruta or RUTA_CATALOGO)
+
+
+def registrar_proyecto(nombre_proyecto: str, ruta: str = None) -> None:
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute(
+            "INSERT INTO proyectos (nombre, actualizado) VALUES (?, ?) "
+            "ON CONFLICT (nombre) DO UPDATE SET actualizado = excluded.actualizado",
+            (nombre_proyecto, datetime.now().timestamp()),
+        )
+
+
+def registrar_version(
+    nombre_proyecto: str,
+    nombre_version: str,
+    fecha: datetime,
+    margen: float = None,
+    pico_financiacion: float = None,
+    ruta: str = None,
+) -> None:
+    """
+    Inserta o actualiza una versión (y su proyecto) en el catálogo.
+    """
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute(
+            "INSERT INTO proyectos (nombre, actualizado) VALUES (?, ?) "
+            "ON CONFLICT (nombre) DO UPDATE SET actualizado = MAX(actualizado, excluded.actualizado)",
+            (nombre_proyecto, fecha.timestamp()),
+        )
+        conexion.execute(
+            "INSERT OR REPLACE INTO versiones (proyecto, nombre, fecha, margen, pico_financiacion) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (nombre_proyecto, nombre_version, fecha.timestamp(), margen, pico_financiacion),
+        )
+
+
+def eliminar_version(nombre_proyecto: str, nombre_version: str, ruta: str = None) -> None:
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute(
+            "DELETE FROM versiones WHERE proyecto = ? AND nombre = ?",
+            (nombre_proyecto, nombre_version),
+        )
+
+
+def obtener_version(nombre_proyecto: str, nombre_version: str, ruta: str = None):
+    """
+    Devuelve la fila de una versión como diccionario, o None.
+    """
+    with closing(conectar(ruta)) as conexion:
+        fila = conexion.execute(
+            "SELECT * FROM versiones WHERE proyecto = ? AND nombre = ?",
+            (nombre_proyecto, nombre_version),
+        ).fetchone()
+    return _version_desde_fila(fila) if fila else None
+
+
+def _patron(texto: str) -> str:
+    texto = (texto or "").strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{texto}%"
+
+
+def _version_desde_fila(fila) -> dict:
+    return {
+        "proyecto": fila["proyecto"],
+        "nombre": fila["nombre"],
+        "fecha": datetime.fromtimestamp(fila["fecha"]),
+        "margen": fila["margen"],
+        "pico_financiacion": fila["pico_financiacion"],
+    }
+
+
+def buscar_proyectos(texto: str = "", limite: int = 20, desplazamiento: int = 0, ruta: str = None):
+    """
+    Proyectos cuyo nombre contiene 'texto', del más reciente al más antiguo.
+    Devuelve (nombres de la página, total de coincidencias).
+    """
+    with closing(conectar(ruta)) as conexion:
+        total = conexion.execute(
+            "SELECT COUNT(*) FROM proyectos WHERE nombre LIKE ? ESCAPE '\\'",
+            (_patron(texto),),
+        ).fetchone()[0]
+        filas = conexion.execute(
+            "SELECT nombre FROM proyectos WHERE nombre LIKE ? ESCAPE '\\' "
+            "ORDER BY actualizado DESC, nombre LIMIT ? OFFSET ?",
+            (_patron(texto), limite, desplazamiento),
+        ).fetchall()
+    return [fila["nombre"] for fila in filas], total
+
+
+def buscar_versiones(
+    nombre_proyecto: str,
+    texto: str = "",
+    limite: int = 20,
+    desplazamiento: int = 0,
+    ruta: str = None,
+):
+    """
+    Versiones del proyecto cuyo nombre contiene 'texto', de la más reciente a
+    la más antigua. Devuelve (lista de diccionarios con 'nombre', 'fecha',
+    'margen' y 'pico_financiacion', total de coincidencias).
+    """
+    with closing(conectar(ruta)) as conexion:
+        total = conexion.execute(
+            "SELECT COUNT(*) FROM versiones WHERE proyecto = ? AND nombre LIKE ? ESCAPE '\\'",
+            (nombre_proyecto, _patron(texto)),
+        ).fetchone()[0]
+        filas = conexion.execute(
+            "SELECT * FROM versiones WHERE proyecto = ? AND nombre LIKE ? ESCAPE '\\' "
+            "ORDER BY fecha DESC, nombre LIMIT ? OFFSET ?",
+            (nombre_proyecto, _patron(texto), limite, desplazamiento),
+        ).fetchall()
+    return [_version_desde_fila(fila) for fila in filas], total
+
+
+def reconstruir(ruta: str = None) -> int:
+    """
+    Vuelve a generar el catálogo recorriendo la carpeta de versiones (una sola
+    vez, no en cada ejecución de la app). Devuelve el número de versiones
+    indexadas.
+    """
+    from versionado import indicadores_version, listar_proyectos, listar_versiones
+
+    os.makedirs(CARPETA_BASE, exist_ok=True)
+    proyectos = listar_proyectos()
+    filas_proyectos = []
+    filas_versiones = []
+    for proyecto in proyectos:
+        versiones = listar_versiones(proyecto)
+        if versiones:
+            actualizado = versiones[0]["fecha"]
+        else:
+            actualizado = datetime.fromtimestamp(os.path.getmtime(os.path.join(CARPETA_BASE, proyecto)))
+        filas_proyectos.append((proyecto, actualizado.timestamp()))
+        for v in versiones:
+            kpis = indicadores_version(v["nombre"], proyecto)
+            filas_versiones.append(
+                (proyecto, v["nombre"], v["fecha"].timestamp(), kpis.get("margen"), kpis.get("pico_financiacion"))
+            )
+
+    _preparar(os.path.abspath(ruta or RUTA_CATALOGO), forzar=True)
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute("DELETE FROM versiones")
+        conexion.execute("DELETE FROM proyectos")
+        conexion.executemany("INSERT INTO proyectos (nombre, actualizado) VALUES (?, ?)", filas_proyectos)
+        conexion.executemany(
+            "INSERT INTO versiones (proyecto, nombre, fecha, margen, pico_financiacion) VALUES (?, ?, ?, ?, ?)",
+            filas_versiones,
+        )
+    return len(filas_versiones)
+
+
+def asegurar(ruta: str = None) -> None:
+    """
+    Crea el catálogo a partir de la carpeta de versiones si todavía no existe.
+    """
+    if not existe(ruta):
+        reconstruir(ruta)
+    else:
+        _preparar(os.path.abspath(ruta or RUTA_CATALOGO))
+
+
+def fijar_cartera(nombre_proyecto: str, nombre_version: str = None, activo: bool = True, ruta: str = None) -> None:
+    """
+    Elige la versión con la que un proyecto entra en la cartera (None: la más
+    reciente) o lo excluye (activo=False).
+    """
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute(
+            "INSERT OR REPLACE INTO cartera (proyecto, version, activo) VALUES (?, ?, ?)",
+            (nombre_proyecto, nombre_version, int(activo)),
+        )
+
+
+def activar_cartera(nombre_proyecto: str, activo: bool, ruta: str = None) -> None:
+    """
+    Incluye o excluye un proyecto de la cartera conservando su versión elegida.
+    """
+    with closing(conectar(ruta)) as conexion, conexion:
+        conexion.execute(
+            "INSERT INTO cartera (proyecto, version, activo) VALUES (?, NULL, ?) "
+            "ON CONFLICT (proyecto) DO UPDATE SET activo = excluded.activo",
+            (nombre_proyecto, int(activo)),
+        )
+
+
+def versiones_recientes(ruta: str = None) -> list:
+    """
+    Versión más reciente de cada proyecto, por orden alfabético, con
+    'proyecto', 'version' y 'fecha'. Se omiten los proyectos sin versiones.
+    """
+    with closing(conectar(ruta)) as conexion:
+        filas = conexion.execute(
+            """
+            SELECT p.nombre AS proyecto, v.nombre AS version, v.fecha AS fecha
+            FROM proyectos p
+            JOIN versiones v ON v.proyecto = p.nombre AND v.nombre = (
+                SELECT u.nombre FROM versiones u WHERE u.proyecto = p.nombre ORDER BY u.fecha DESC, u.nombre LIMIT 1
+            )
+            ORDER BY p.nombre
+            """
+        ).fetchall()
+    return [
+        {"proyecto": fila["proyecto"], "version": fila["version"], "fecha": datetime.fromtimestamp(fila["fecha"])}
+        for fila in filas
+    ]
+
+
+def versiones_cartera(incluir_inactivos: bool = False, ruta: str = None) -> list:
+    """
+    Proyectos de la cartera por orden alfabético, cada uno con 'proyecto',
+    'version' (la elegida o, si no hay o ya no existe, la más reciente),
+    'fecha' de esa versión y 'activo'. Se omiten los proyectos sin versiones.
+    """
+    with closing(conectar(ruta)) as conexion:
+        filas = conexion.execute(
+            """
+            SELECT p.nombre AS proyecto, v.nombre AS version, v.fecha AS fecha, COALESCE(c.activo, 1) AS activo
+            FROM proyectos p
+            LEFT JOIN cartera c ON c.proyecto = p.nombre
+            JOIN versiones v ON v.proyecto = p.nombre AND v.nombre = COALESCE(
+                (SELECT e.nombre FROM versiones e WHERE e.proyecto = p.nombre AND e.nombre = c.version),
+                (SELECT u.nombre FROM versiones u WHERE u.proyecto = p.nombre ORDER BY u.fecha DESC, u.nombre LIMIT 1)
+            )
+            WHERE ? OR COALESCE(c.activo, 1) = 1
+            ORDER BY p.nombre
+            """,
+            (int(incluir_inactivos),),
+        ).fetchall()
+    return [
+        {
+            "proyecto": fila["proyecto"],
+            "version": fila["version"],
+            "fecha": datetime.fromtimestamp(fila["fecha"]),
+            "activo": bool(fila["activo"]),
+        }
+        for fila in filas
+    ]
@@ -0,0 +1,429 @@
+"""
+Evaluación vectorizada de muchos escenarios del modelo.
+
+ModeloEscenarios prepara una sola vez las entradas de un proyecto (viviendas,
+capítulos y planificación como arrays de meses enteros) y después evalúa
+lotes de escenarios con operaciones sobre matrices escenarios x meses, sin
+DataFrames ni bucles por escenario.
+
+Cada escenario se describe con cambios respecto a los parámetros base: los
+campos numéricos de motor.ParametrosProyecto y las variables adicionales de
+este módulo. Significan lo mismo que en entradas_escenario, que construye las
+tablas equivalentes para motor.evaluar_proyecto:
+
+- precio_medio_venta escala en la misma proporción el precio de cada vivienda.
+- descuento_precio_pct rebaja el precio de las viviendas, por escenario o por
+  vivienda.
+- desplazamiento_ventas_meses retrasa (o adelanta) las fechas de venta, por
+  escenario o por vivienda.
+- retraso_inicio_obra_meses retrasa el inicio de obra y, con él, toda la
+  planificación de capítulos.
+- retraso_comercializacion_meses retrasa el inicio de comercialización.
+- Las escrituras sin fecha o fijadas en la fecha de entrega base se mueven con
+  la entrega de cada escenario; las demás conservan su fecha.
+
+Las variables por vivienda se refieren a las viviendas con fecha de venta, en
+el orden de la tabla.
+"""
+from dataclasses import fields, replace
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+import motor
+
+DESPLAZAMIENTO_VENTAS = "desplazamiento_ventas_meses"
+RETRASO_INICIO_OBRA = "retraso_inicio_obra_meses"
+RETRASO_COMERCIALIZACION = "retraso_comercializacion_meses"
+DESCUENTO_PRECIO = "descuento_precio_pct"
+
+# Variables que admite un escenario y su etiqueta en la interfaz
+VARIABLES = {
+    "precio_medio_venta": "Precio medio de venta (€)",
+    "coste_ejecucion_m2": "Coste ejecución por m² (€)",
+    "superficie_total": "Superficie construida total (m²)",
+    "coste_suelo": "Coste del suelo (€)",
+    "plazo_obra_meses": "Plazo de ejecución (meses)",
+    "pct_contrato": "Contrato (%)",
+    "pct_aplazado": "Aplazado (%)",
+    "reserva_fija": "Reserva (€ por vivienda)",
+    "comisiones_venta": "Comisiones (%)",
+    "porcentaje_honorarios": "Honorarios técnicos (%)",
+    "porcentaje_admin": "Gastos administración (%)",
+    "gastos_financieros": "Gastos financieros por vivienda (€)",
+    "iva_venta": "IVA en ventas (%)",
+    "iva_otros": "IVA en otros gastos (%)",
+    "num_viviendas": "Nº de viviendas",
+    DESPLAZAMIENTO_VENTAS: "Desplazamiento de ventas (meses)",
+    RETRASO_INICIO_OBRA: "Retraso del inicio de obra (meses)",
+    RETRASO_COMERCIALIZACION: "Retraso de la comercialización (meses)",
+    DESCUENTO_PRECIO: "Descuento sobre precio (%)",
+}
+
+VARIABLES_ENTERAS = {
+    "plazo_obra_meses",
+    "num_viviendas",
+    DESPLAZAMIENTO_VENTAS,
+    RETRASO_INICIO_OBRA,
+    RETRASO_COMERCIALIZACION,
+}
+
+VARIABLES_POR_VIVIENDA = {DESPLAZAMIENTO_VENTAS, DESCUENTO_PRECIO}
+
+# Indicadores que devuelve la evaluación (ver motor.indicadores)
+METRICAS = {
+    "margen": "Margen (€)",
+    "pico_financiacion": "Pico de financiación (€)",
+    "deficit_max_cuenta_especial": "Déficit máximo cuenta especial (€)",
+    "total_necesidades": "Total necesidades financiación (€)",
+}
+
+# Escenarios por lote: acota la memoria de las matrices escenarios x viviendas
+TAM_LOTE = 512
+
+_MES_EPOCA = 1970 * 12
+
+
+def valor_base(parametros: motor.ParametrosProyecto, variable: str):
+    """
+    Valor de una variable en el escenario base (0 para las variables de
+    desplazamiento, retraso y descuento).
+    """
+    if variable not in VARIABLES:
+        raise ValueError(f"Variable de escenario desconocida: {variable}")
+    return getattr(parametros, variable, 0)
+
+
+def dias_mes(meses) -> np.ndarray:
+    """
+    Número de días de cada mes (índices de motor.indice_mes).
+    """
+    meses = np.asarray(meses, dtype=np.int64) - _MES_EPOCA
+    inicio = meses.astype("datetime64[M]").astype("datetime64[D]")
+    fin = (meses + 1).astype("datetime64[M]").astype("datetime64[D]")
+    return (fin - inicio).astype(np.int64)
+
+
+def _sumar_meses(meses, dias, n):
+    """
+    (mes, día) + n meses con el día ajustado a fin de mes, como relativedelta.
+    """
+    meses = meses + n
+    return meses, np.minimum(dias, dias_mes(meses))
+
+
+def _acumular(meses, importes, primer_mes: int, num_meses: int) -> np.ndarray:
+    """
+    Suma importes en una matriz escenarios x num_meses según su mes. meses es
+    un array escenarios x eventos; importes se difunde a la misma forma.
+    """
+    num_escenarios = meses.shape[0]
+    posiciones = np.arange(num_escenarios)[:, None] * num_meses + (meses - primer_mes)
+    pesos = np.broadcast_to(importes, meses.shape)
+    return np.bincount(
+        posiciones.ravel(), weights=pesos.ravel(), minlength=num_escenarios * num_meses
+    ).reshape(num_escenarios, num_meses)
+
+
+def _redondear_centimos(valores: np.ndarray) -> np.ndarray:
+    # round() de Python, como motor.cronograma_ejecucion
+    return np.array([round(v, 2) for v in valores.tolist()], dtype=np.float64)
+
+
+class ModeloEscenarios:
+    """
+    Modelo preparado para evaluar escenarios por lotes. Las tablas tienen el
+    mismo formato que en motor.evaluar_proyecto; sin capítulos o planificación
+    se usan los de por defecto. Lanza ValueError si no hay viviendas vendidas.
+    """
+
+    def __init__(
+        self,
+        parametros: motor.ParametrosProyecto,
+        df_viviendas: pd.DataFrame,
+        df_planificacion: pd.DataFrame = None,
+        df_capitulos: pd.DataFrame = None,
+    ):
+        p = parametros
+        self.parametros = p
+        if df_viviendas is None or df_viviendas.empty:
+            raise ValueError("Se necesita la tabla de viviendas para evaluar escenarios.")
+        if df_capitulos is None:
+            df_capitulos = motor.capitulos_por_defecto(p.coste_total_ejecucion)
+        if df_planificacion is None:
+            df_planificacion = motor.planificacion_por_defecto(df_capitulos, p.fecha_inicio_obra)
+
+        # Viviendas con fecha de venta: precio, mes y día de venta y escritura
+        fechas_venta = motor.como_fechas(df_viviendas["Fecha venta"]).to_numpy(dtype="datetime64[D]")
+        fechas_escritura = motor.como_fechas(df_viviendas["Fecha escrituración"]).to_numpy(dtype="datetime64[D]")
+        con_venta = ~np.isnat(fechas_venta)
+        if not con_venta.any():
+            raise ValueError("Ninguna vivienda tiene fecha de venta.")
+        fechas_venta = fechas_venta[con_venta]
+        fechas_escritura = fechas_escritura[con_venta]
+        entrega = np.datetime64(p.fecha_entrega_viviendas, "D")
+
+        self.precios = df_viviendas["Precio"].to_numpy(dtype=np.float64)[con_venta]
+        self.mes_venta = motor.indices_mes(fechas_venta)
+        self.dia_venta = (fechas_venta - fechas_venta.astype("datetime64[M]")).astype(np.int64) + 1
+        self.escritura_en_entrega = np.isnat(fechas_escritura) | (fechas_escritura == entrega)
+        self.mes_escritura = motor.indices_mes(np.where(np.isnat(fechas_escritura), entrega, fechas_escritura))
+
+        self.mes_inicio_obra = motor.indice_mes(p.fecha_inicio_obra)
+        self.dia_inicio_obra = p.fecha_inicio_obra.day
+        self.mes_comercializacion = motor.indice_mes(p.fecha_inicio_comercializacion)
+
+        # Capítulos con peso y duración (como en motor.cronograma_ejecucion)
+        df_merge = pd.merge(df_planificacion, df_capitulos[["Capítulo", "Peso (%)"]], on="Capítulo", how="left")
+        df_merge = df_merge.dropna(subset=["Capítulo", "Inicio", "Duración (meses)", "Peso (%)"])
+        duraciones = df_merge["Duración (meses)"].to_numpy().astype(np.int64)
+        con_duracion = duraciones > 0
+        self.pesos = df_merge["Peso (%)"].to_numpy(dtype=np.float64)[con_duracion]
+        self.duraciones = duraciones[con_duracion]
+        inicios = pd.to_datetime(df_merge["Inicio"]).to_numpy(dtype="datetime64[D]")[con_duracion]
+        self.mes_inicio_capitulo = motor.indices_mes(inicios)
+
+    @property
+    def num_viviendas_vendidas(self) -> int:
+        return len(self.precios)
+
+    def _columna(self, cambios: dict, variable: str, num: int) -> np.ndarray:
+        if variable in cambios:
+            valor = np.asarray(cambios[variable], dtype=np.float64)
+        else:
+            valor = np.asarray(valor_base(self.parametros, variable), dtype=np.float64)
+        if valor.ndim == 2:
+            raise ValueError(f"'{variable}' no admite valores por vivienda.")
+        return np.broadcast_to(valor, (num,))
+
+    def _por_vivienda(self, cambios: dict, variable: str, num: int) -> np.ndarray:
+        valor = np.asarray(cambios.get(variable, 0), dtype=np.float64)
+        if valor.ndim == 1:
+            valor = valor[:, None]
+        return np.broadcast_to(valor, (num, self.num_viviendas_vendidas))
+
+    def evaluar(self, cambios: dict, tam_lote: int = TAM_LOTE) -> dict:
+        """
+        Evalúa los escenarios descritos en 'cambios' ({variable: valores}, con
+        un valor por escenario o un escalar común; las variables por vivienda
+        admiten una matriz escenarios x viviendas vendidas). Devuelve
+        {métrica: array con un valor por escenario} para las claves de METRICAS.
+        """
+        num = _num_escenarios(cambios)
+        partes = [
+            self._evaluar_lote(_trocear(cambios, num, inicio, min(inicio + tam_lote, num)), min(tam_lote, num - inicio))
+            for inicio in range(0, num, tam_lote)
+        ]
+        return {m: np.concatenate([parte[m] for parte in partes]) for m in METRICAS}
+
+    def evaluar_series(self, cambios: dict) -> dict:
+        """
+        Como evaluar, en un solo lote, añadiendo las series mensuales sobre un
+        eje común: 'primer_mes' (índice de motor.indice_mes) y las matrices
+        escenarios x meses 'flujo_acumulado', 'acumulado_cuenta_especial' y
+        'necesidades' (total mensual de necesidades de financiación).
+        """
+        return self._evaluar_lote(cambios, _num_escenarios(cambios), series=True)
+
+    def _evaluar_lote(self, cambios: dict, num: int, series: bool = False) -> dict:
+        desconocidas = set(cambios) - set(VARIABLES)
+        if desconocidas:
+            raise ValueError(f"Variables de escenario desconocidas: {', '.join(sorted(desconocidas))}")
+
+        def v(variable):
+            return self._columna(cambios, variable, num)
+
+        # Calendario de cada escenario
+        plazo = v("plazo_obra_meses").astype(np.int64)
+        if (plazo < 1).any():
+            raise ValueError("El plazo de obra debe ser de al menos un mes.")
+        retraso_obra = v(RETRASO_INICIO_OBRA).astype(np.int64)
+        mes_inicio_obra, dia_inicio_obra = _sumar_meses(self.mes_inicio_obra, self.dia_inicio_obra, retraso_obra)
+        mes_fin_obra, dia_fin_obra = _sumar_meses(mes_inicio_obra, dia_inicio_obra, plazo)
+        mes_entrega, dia_entrega = _sumar_meses(mes_fin_obra, dia_fin_obra, 3)
+        mes_comercializacion = self.mes_comercializacion + v(RETRASO_COMERCIALIZACION).astype(np.int64)
+
+        # Meses de cada fase de pago (escenarios x viviendas)
+        mes_venta = self.mes_venta + self._por_vivienda(cambios, DESPLAZAMIENTO_VENTAS, num).astype(np.int64)
+        dia_venta = np.minimum(self.dia_venta, dias_mes(mes_venta))
+        entrega = mes_entrega[:, None]
+        terminada = (mes_venta > entrega) | ((mes_venta == entrega) & (dia_venta >= dia_entrega[:, None]))
+        mes_contrato = mes_venta + 1
+        mes_aplazado = mes_contrato + 3
+        mes_escritura = np.where(self.escritura_en_entrega, entrega, self.mes_escritura)
+        mes_escritura = np.where(terminada, np.maximum(entrega, mes_contrato), mes_escritura)
+
+        # Importes de cada fase
+        iva_venta = v("iva_venta")
+        precio_base = self.parametros.precio_medio_venta
+        factor_precio = v("precio_medio_venta") / precio_base if precio_base else np.ones(num)
+        descuento = self._por_vivienda(cambios, DESCUENTO_PRECIO, num)
+        precios = self.precios * factor_precio[:, None] * (1 - descuento / 100)
+        precio_con_iva = precios * (1 + iva_venta[:, None] / 100)
+        reserva = np.broadcast_to(v("reserva_fija")[:, None], precio_con_iva.shape)
+        restante = precio_con_iva - reserva
+        contrato = precio_con_iva * v("pct_contrato")[:, None] / 100
+        aplazado = precio_con_iva * v("pct_aplazado")[:, None] / 100
+        escritura = restante - contrato - aplazado
+
+        # Eje de meses común al lote
+        coste_total_ejecucion = v("superficie_total") * v("coste_ejecucion_m2")
+        inicio_capitulo = self.mes_inicio_capitulo + retraso_obra[:, None]
+        fin_capitulo = inicio_capitulo + self.duraciones
+        primeros = [mes_venta.min(), mes_escritura.min(), mes_inicio_obra.min(), mes_comercializacion.min()]
+        ultimos = [mes_aplazado.max(), mes_escritura.max(), (mes_fin_obra + 3).max(), mes_comercializacion.max()]
+        if inicio_capitulo.size:
+            primeros.append(inicio_capitulo.min())
+            ultimos.append(fin_capitulo.max() - 1)
+        primer_mes = int(min(primeros))
+        num_meses = int(max(ultimos)) - primer_mes + 1
+
+        def acumular(meses, importes, columnas=num_meses):
+            return _acumular(meses, importes, primer_mes, columnas)
+
+        # Ingresos y comisiones
+        ingreso_pre = acumular(mes_venta, reserva) + acumular(mes_contrato, contrato) + acumular(mes_aplazado, aplazado)
+        total_ingresos = ingreso_pre + acumular(mes_escritura, escritura)
+        total_sin_iva = total_ingresos / (1 + iva_venta[:, None] / 100)
+        comisiones = -(total_sin_iva * (v("comisiones_venta")[:, None] / 100) * (1 + v("iva_otros")[:, None] / 100))
+        ingresos_netos = total_ingresos + comisiones
+        comisiones_pre = comisiones * (ingreso_pre / np.where(total_ingresos == 0, 1, total_ingresos))
+
+        # Coste de ejecución: cada capítulo reparte su coste entre sus meses
+        # (suma de diferencias en el inicio y el fin y acumulado por meses)
+        costes_unicos, posicion = np.unique(coste_total_ejecucion, return_inverse=True)
+        coste_capitulo = -np.round(self.pesos / 100 * costes_unicos[:, None], 2)
+        coste_mensual = _redondear_centimos((coste_capitulo / self.duraciones).ravel()).reshape(coste_capitulo.shape)
+        coste_mensual = coste_mensual[posicion.ravel()]
+        diferencias = acumular(inicio_capitulo, coste_mensual, num_meses + 1) - acumular(fin_capitulo, coste_mensual, num_meses + 1)
+        coste_ejecucion = np.cumsum(diferencias, axis=1)[:, :num_meses]
+
+        # Otros costes: suelo, honorarios, administración y financieros
+        suelo = acumular(mes_comercializacion[:, None], -v("coste_suelo")[:, None])
+        total_honorarios = -(v("porcentaje_honorarios") / 100 * coste_total_ejecucion)
+        mensual_honorarios = (total_honorarios * 0.20) / plazo
+        meses_obra = np.stack([mes_inicio_obra, mes_fin_obra], axis=1)
+        honorarios = np.cumsum(
+            acumular(meses_obra, np.stack([mensual_honorarios, -mensual_honorarios], axis=1), num_meses + 1), axis=1
+        )[:, :num_meses]
+        honorarios += acumular(meses_obra, np.stack([total_honorarios * 0.50, total_honorarios * 0.30], axis=1))
+        total_admin = -(v("porcentaje_admin") / 100 * coste_total_ejecucion)
+        admin = acumular(np.stack([mes_inicio_obra, mes_fin_obra + 3], axis=1), (total_admin * 0.5)[:, None])
+        financieros = acumular(mes_contrato, -v("gastos_financieros")[:, None])
+        otros_costes = suelo + honorarios + admin + financieros
+
+        # Flujo de caja, cuenta especial y necesidades de financiación
+        flujo_acumulado = np.cumsum(ingresos_netos + coste_ejecucion + otros_costes, axis=1)
+        acumulado_cuenta, deficits = motor.saldo_cuenta_especial(ingreso_pre + coste_ejecucion)
+        necesidades = otros_costes + comisiones_pre + deficits
+
+        # Cuenta de resultados (como motor.calcular_cuenta_resultados)
+        num_viviendas = v("num_viviendas")
+        precio_medio = v("precio_medio_venta")
+        if np.any(descuento):
+            precio_medio = precio_medio * (precios.sum(axis=1) / (self.precios * factor_precio[:, None]).sum(axis=1))
+        ingresos_por_venta = precio_medio * num_viviendas
+        ingresos_netos_venta = ingresos_por_venta - ingresos_por_venta * v("comisiones_venta") / 100
+        coste_ejecucion_total = v("coste_ejecucion_m2") * v("superficie_total")
+        costes_no_ejecutivos = (
+            coste_ejecucion_total * v("porcentaje_honorarios") / 100
+            + coste_ejecucion_total * v("porcentaje_admin") / 100
+            + v("gastos_financieros") * num_viviendas
+        )
+        margen = ingresos_netos_venta - (v("coste_suelo") + coste_ejecucion_total + costes_no_ejecutivos)
+
+        resultado = {
+            "margen": margen,
+            "pico_financiacion": np.maximum(0.0, -flujo_acumulado.min(axis=1)),
+            "deficit_max_cuenta_especial": np.maximum(0.0, -deficits.min(axis=1)),
+            "total_necesidades": -necesidades.sum(axis=1),
+        }
+        if series:
+            resultado.update({
+                "primer_mes": primer_mes,
+                "flujo_acumulado": flujo_acumulado,
+                "acumulado_cuenta_especial": acumulado_cuenta,
+                "necesidades": necesidades,
+            })
+        return resultado
+
+
+def _num_escenarios(cambios: dict) -> int:
+    tamanos = {np.shape(valor)[0] for valor in cambios.values() if np.ndim(valor) >= 1}
+    if len(tamanos) > 1:
+        raise ValueError("Todas las variables deben tener el mismo número de escenarios.")
+    return tamanos.pop() if tamanos else 1
+
+
+def _trocear(cambios: dict, num: int, inicio: int, fin: int) -> dict:
+    return {
+        variable: valor[inicio:fin] if np.ndim(valor) >= 1 and np.shape(valor)[0] == num else valor
+        for variable, valor in cambios.items()
+    }
+
+
+def entradas_escenario(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+    cambios: dict = None,
+):
+    """
+    Construye las entradas de motor.evaluar_proyecto para un único escenario
+    (cambios con valores escalares, o arrays por vivienda vendida en las
+    variables por vivienda). Devuelve (parametros, df_viviendas,
+    df_planificacion, df_capitulos); sirve para ver en detalle un escenario
+    de un barrido.
+    """
+    cambios = dict(cambios or {})
+    desconocidas = set(cambios) - set(VARIABLES)
+    if desconocidas:
+        raise ValueError(f"Variables de escenario desconocidas: {', '.join(sorted(desconocidas))}")
+    p = parametros
+    retraso_obra = int(cambios.pop(RETRASO_INICIO_OBRA, 0))
+    retraso_comercializacion = int(cambios.pop(RETRASO_COMERCIALIZACION, 0))
+    desplazamiento = cambios.pop(DESPLAZAMIENTO_VENTAS, 0)
+    descuento = cambios.pop(DESCUENTO_PRECIO, 0.0)
+
+    tipos = {f.name: f.type for f in fields(motor.ParametrosProyecto)}
+    nuevos = replace(
+        p,
+        **{variable: tipos[variable](valor) for variable, valor in cambios.items()},
+        fecha_inicio_obra=p.fecha_inicio_obra + relativedelta(months=retraso_obra),
+        fecha_inicio_comercializacion=p.fecha_inicio_comercializacion + relativedelta(months=retraso_comercializacion),
+    )
+
+    df = df_viviendas.copy()
+    fechas_venta = motor.como_fechas(df["Fecha venta"])
+    fechas_escritura = motor.como_fechas(df["Fecha escrituración"])
+    con_venta = fechas_venta.notna().to_numpy()
+    desplazamientos = np.broadcast_to(np.asarray(desplazamiento, dtype=np.int64), (int(con_venta.sum()),))
+    descuentos = np.broadcast_to(np.asarray(descuento, dtype=np.float64), (int(con_venta.sum()),))
+
+    nuevas_ventas = fechas_venta.copy()
+    nuevas_ventas[con_venta] = [
+        fecha + relativedelta(months=int(d)) for fecha, d in zip(fechas_venta[con_venta], desplazamientos)
+    ]
+    df["Fecha venta"] = pd.to_datetime(nuevas_ventas)
+
+    en_entrega = fechas_escritura.isna() | (fechas_escritura == pd.Timestamp(p.fecha_entrega_viviendas))
+    df["Fecha escrituración"] = fechas_escritura.mask(en_entrega, pd.Timestamp(nuevos.fecha_entrega_viviendas))
+
+    factor_precio = nuevos.precio_medio_venta / p.precio_medio_venta if p.precio_medio_venta else 1.0
+    precios = df["Precio"].to_numpy(dtype=np.float64)
+    precios_vendidas = precios[con_venta] * factor_precio
+    con_descuento = precios_vendidas * (1 - descuentos / 100)
+    precios[con_venta] = con_descuento
+    df["Precio"] = precios
+    if np.any(descuentos):
+        nuevos = replace(nuevos, precio_medio_venta=nuevos.precio_medio_venta * (con_descuento.sum() / precios_vendidas.sum()))
+
+    if df_planificacion is not None and retraso_obra:
+        df_planificacion = df_planificacion.copy()
+        df_planificacion["Inicio"] = [
+            inicio + relativedelta(months=retraso_obra) if pd.notna(inicio) else inicio
+            for inicio in df_planificacion["Inicio"]
+        ]
+    return nuevos, df, df_planificacion, df_capitulos
@@ -0,0 +1,320 @@
+"""
+Etapas de cálculo de la app con memoización compartida.
+
+Cada etapa del motor (lectura de viviendas, ingresos, cronograma de ejecución,
+otros costes, consolidación del flujo y necesidades de financiación) se
+envuelve con st.cache_data, cuya clave es el hash de los argumentos de esa
+etapa únicamente. Así, cambiar un widget solo recalcula las etapas que
+dependen de él; el resto se resuelve con una búsqueda en caché.
+
+La caché de st.cache_data es única para todo el servidor: dos sesiones que
+abren la misma versión de un proyecto comparten los resultados. Está acotada
+por número de entradas (se expulsan las menos usadas) y por tiempo de vida.
+
+Las lecturas de pegados y archivos subidos, además, se guardan en disco
+(cache_lecturas.py) con el hash del contenido como clave, de modo que
+sobreviven a la expulsión de st.cache_data y a los reinicios del servidor.
+"""
+from datetime import date
+
+import pandas as pd
+import streamlit as st
+
+import cache_lecturas
+import ingesta
+import motor
+
+# Límites de la caché compartida de cada etapa
+CACHE_MAX_ENTRADAS = 256
+CACHE_TTL_SEGUNDOS = 60 * 60
+
+
+# Separador de los CSV de capítulos ya leídos, por nombre de archivo (solo
+# una pista: se comprueba al leer). Se olvidan los más antiguos al pasar del
+# máximo.
+MAX_SEPARADORES = 256
+_separadores = {}
+
+
+def _cache(funcion):
+    return st.cache_data(max_entries=CACHE_MAX_ENTRADAS, ttl=CACHE_TTL_SEGUNDOS, show_spinner=False)(funcion)
+
+
+def _ingesta_memorizada(huella: str, leer) -> ingesta.ResultadoIngesta:
+    """
+    Resultado de ingesta desde la caché en disco o, si no está, leyéndolo
+    con leer() y guardándolo.
+    """
+    def calcular():
+        resultado = leer()
+        return {"viviendas": resultado.viviendas, "errores": resultado.errores}, {"filas_leidas": resultado.filas_leidas}
+
+    meta, tablas = cache_lecturas.memorizar(huella, calcular)
+    return ingesta.ResultadoIngesta(tablas["viviendas"], tablas["errores"], meta["filas_leidas"])
+
+
+@_cache
+def leer_viviendas(texto_pegado: str, fecha_entrega_viviendas: date) -> ingesta.ResultadoIngesta:
+    """
+    Convierte la tabla pegada desde Excel (separada por tabuladores) en la
+    tabla de viviendas normalizada y el informe de filas erróneas. Lanza
+    ValueError si faltan columnas.
+    """
+    huella = cache_lecturas.clave("viviendas_texto", texto_pegado, fecha_entrega=fecha_entrega_viviendas)
+    return _ingesta_memorizada(huella, lambda: ingesta.leer_texto(texto_pegado, fecha_entrega_viviendas))
+
+
+@_cache
+def hojas_xlsx(contenido: bytes) -> list:
+    meta, _ = cache_lecturas.memorizar(
+        cache_lecturas.clave("hojas_xlsx", contenido),
+        lambda: ({}, {"hojas": ingesta.hojas_xlsx(contenido)}),
+    )
+    return meta["hojas"]
+
+
+@_cache
+def cabecera_xlsx(contenido: bytes, hoja: str) -> list:
+    meta, _ = cache_lecturas.memorizar(
+        cache_lecturas.clave("cabecera_xlsx", contenido, hoja=hoja),
+        lambda: ({}, {"columnas": ingesta.cabecera_xlsx(contenido, hoja)}),
+    )
+    return meta["columnas"]
+
+
+@_cache
+def leer_viviendas_xlsx(contenido: bytes, fecha_entrega_viviendas: date, hoja: str, mapeo: dict) -> ingesta.ResultadoIngesta:
+    """
+    Lee la tabla de viviendas de una hoja .xlsx (ver ingesta.leer_xlsx).
+    """
+    huella = cache_lecturas.clave("viviendas_xlsx", contenido, fecha_entrega=fecha_entrega_viviendas, hoja=hoja, mapeo=mapeo)
+    return _ingesta_memorizada(huella, lambda: ingesta.leer_xlsx(contenido, fecha_entrega_viviendas, hoja, mapeo))
+
+
+@_cache
+def leer_capitulos_xlsx(
+    contenido: bytes,
+    coste_total_ejecucion: float,
+    hoja: str,
+    columna_capitulo: str,
+    columna_importe: str,
+) -> pd.DataFrame:
+    """
+    Lee capítulos e importes de una hoja .xlsx y los convierte en pesos y
+    coste ajustado.
+    """
+    huella = cache_lecturas.clave("capitulos_xlsx", contenido, hoja=hoja, capitulo=columna_capitulo, importe=columna_importe)
+    _, tablas = cache_lecturas.memorizar(
+        huella,
+        lambda: ({"capitulos": ingesta.leer_capitulos_xlsx(contenido, hoja, columna_capitulo, columna_importe)}, {}),
+    )
+    return motor.capitulos_desde_importes(tablas["capitulos"], coste_total_ejecucion)
+
+
+@_cache
+def leer_capitulos_csv(contenido: bytes, coste_total_ejecucion: float, nombre_archivo: str = None) -> pd.DataFrame:
+    """
+    Lee un CSV de capítulos e importes y lo convierte en pesos y coste ajustado.
+    El separador detectado se recuerda por nombre de archivo: si se vuelve a
+    subir una versión editada del mismo archivo se prueba directamente con
+    él, y si no da al menos dos columnas se olvida y se vuelve a detectar.
+    """
+    def calcular():
+        recordado = _separadores.pop(nombre_archivo, None) if nombre_archivo else None
+        df_csv = sep = None
+        if recordado is not None:
+            try:
+                df_csv, sep = ingesta.leer_capitulos_csv(contenido, recordado)
+            except (ValueError, pd.errors.ParserError):
+                df_csv = None
+            if df_csv is not None and len(df_csv.columns) < 2:
+                df_csv = None
+        if df_csv is None:
+            df_csv, sep = ingesta.leer_capitulos_csv(contenido)
+        if sep is not None and nombre_archivo:
+            _separadores[nombre_archivo] = sep
+            while len(_separadores) > MAX_SEPARADORES:
+                del _separadores[next(iter(_separadores))]
+        return {"capitulos": df_csv}, {"separador": sep}
+
+    _, tablas = cache_lecturas.memorizar(cache_lecturas.clave("capitulos_csv", contenido), calcular)
+    return motor.capitulos_desde_importes(tablas["capitulos"], coste_total_ejecucion)
+
+
+@_cache
+def ingresos(
+    df_viviendas: pd.DataFrame,
+    fecha_entrega_viviendas: date,
+    reserva_fija: float,
+    pct_contrato: float,
+    pct_aplazado: float,
+    iva_venta: float,
+    comisiones_venta: float,
+    iva_otros: float,
+) -> pd.DataFrame:
+    return motor.calcular_ingresos(
+        df_viviendas,
+        fecha_entrega_viviendas,
+        reserva_fija,
+        pct_contrato,
+        pct_aplazado,
+        iva_venta,
+        comisiones_venta,
+        iva_otros,
+    )
+
+
+@_cache
+def cronograma(
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+    coste_total_ejecucion: float,
+) -> pd.DataFrame:
+    return motor.calcular_cronograma(df_planificacion, df_capitulos, coste_total_ejecucion)
+
+
+@_cache
+def otros_costes(
+    df_viviendas,
+    fecha_inicio_obra: date,
+    fecha_inicio_comercializacion: date,
+    plazo_obra_meses: int,
+    coste_suelo: float,
+    coste_total_ejecucion: float,
+    porcentaje_honorarios: float,
+    porcentaje_admin: float,
+    gastos_financieros: float,
+) -> dict:
+    return motor.calcular_otros_costes(
+        df_viviendas,
+        fecha_inicio_obra,
+        fecha_inicio_comercializacion,
+        plazo_obra_meses,
+        coste_suelo,
+        coste_total_ejecucion,
+        porcentaje_honorarios,
+        porcentaje_admin,
+        gastos_financieros,
+    )
+
+
+@_cache
+def flujo_caja(
+    df_ingresos: pd.DataFrame,
+    df_cronograma: pd.DataFrame,
+    df_otros_costes: pd.DataFrame,
+) -> pd.DataFrame:
+    return motor.calcular_flujo_caja(df_ingresos, df_cronograma, df_otros_costes)
+
+
+@_cache
+def necesidades(df_flujo: pd.DataFrame) -> pd.DataFrame:
+    return motor.calcular_necesidades(df_flujo)
+
+
+@_cache
+def sensibilidad(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    extremos: dict,
+    valores: dict,
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+) -> dict:
+    """
+    Tornado entre los extremos de cada variable y barrido de la rejilla
+    completa de valores ('tornado', 'base' y 'barrido').
+    """
+    import sensibilidad as analisis
+
+    df_tornado, base = analisis.tornado(parametros, df_viviendas, extremos, df_planificacion, df_capitulos)
+    df_barrido = analisis.evaluar_rejilla(
+        parametros, df_viviendas, analisis.rejilla(valores), df_planificacion, df_capitulos
+    )
+    return {"tornado": df_tornado, "base": base, "barrido": df_barrido}
+
+
+@_cache
+def objetivo(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    variable: str,
+    metrica: str,
+    valor: float,
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+    opciones: dict,
+):
+    """
+    Búsqueda de objetivo sobre las entradas del proyecto (ver
+    objetivos.resolver_entradas).
+    """
+    import objetivos
+
+    return objetivos.resolver_entradas(
+        parametros, df_viviendas, variable, metrica, valor, df_planificacion, df_capitulos, **opciones
+    )
+
+
+@_cache
+def objetivo_proyectos(seleccion: list, variable: str, metrica: str, valor: float, opciones: dict) -> pd.DataFrame:
+    """
+    Búsqueda de objetivo para una selección de versiones (ver
+    objetivos.resolver_proyectos).
+    """
+    import objetivos
+
+    return objetivos.resolver_proyectos(variable, metrica, valor, seleccion, **opciones)
+
+
+@_cache
+def montecarlo(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    num_escenarios: int,
+    semilla: int,
+    supuestos,
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+):
+    """
+    Simulación Monte Carlo (ver montecarlo.simular). Las bandas y los
+    percentiles quedan en la caché; las trayectorias, en la carpeta común de
+    simulaciones mientras no se expulsen.
+    """
+    import montecarlo as simulacion
+
+    return simulacion.simular(
+        parametros,
+        df_viviendas,
+        num_escenarios,
+        semilla=semilla,
+        supuestos=supuestos,
+        df_planificacion=df_planificacion,
+        df_capitulos=df_capitulos,
+    )
+
+
+@_cache
+def consolidar_cartera(seleccion: list):
+    """
+    Cartera consolidada de una selección de versiones (ver cartera.consolidar).
+    """
+    import cartera
+
+    return cartera.consolidar(seleccion)
+
+
+@_cache
+def movimientos(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+):
+    """
+    Libro de movimientos del proyecto (ver movimientos.construir).
+    """
+    import movimientos as libro
+
+    return libro.construir(parametros, df_viviendas, df_planificacion, df_capitulos)
@@ -0,0 +1,207 @@
+"""
+Gráficos Plotly de la app.
+
+Plotly se importa dentro de cada función, no al cargar el módulo, para que
+las pantallas sin gráficos (bienvenida, selector de proyecto) no paguen su
+importación.
+"""
+import pandas as pd
+
+
+def linea(df: pd.DataFrame, x: str, y: str, titulo: str, yaxis_title: str = None, markers: bool = True):
+    """
+    Gráfico de línea simple (p. ej. acumulados por mes).
+    """
+    import plotly.express as px
+
+    fig = px.line(df, x=x, y=y, markers=markers, title=titulo)
+    if yaxis_title:
+        fig.update_layout(yaxis_title=yaxis_title)
+    return fig
+
+
+def gantt(df_planificacion: pd.DataFrame, orden_capitulos: list):
+    """
+    Gantt de ejecución por capítulo. df_planificacion debe tener las columnas
+    'Capítulo', 'Inicio' y 'Fin'.
+    """
+    import plotly.express as px
+
+    fig = px.timeline(
+        df_planificacion,
+        x_start="Inicio",
+        x_end="Fin",
+        y="Capítulo",
+        color="Capítulo",
+        title="Planificación de ejecución por capítulo"
+    )
+    fig.update_yaxes(autorange="reversed", categoryorder="array", categoryarray=list(orden_capitulos))
+    return fig
+
+
+def coste_acumulado_ejecucion(df_cronograma: pd.DataFrame):
+    """
+    Evolución acumulada del coste de ejecución a partir del cronograma mensual.
+    """
+    import plotly.express as px
+
+    df_cronograma_acumulado = df_cronograma.copy()
+    df_cronograma_acumulado["Total acumulado (€)"] = df_cronograma_acumulado["Total mensual (€)"].cumsum()
+    fig = px.line(
+        df_cronograma_acumulado.reset_index(),
+        x="Mes",
+        y="Total acumulado (€)",
+        title="Coste acumulado de ejecución"
+    )
+    fig.update_layout(xaxis_tickangle=-45)
+    return fig
+
+
+def otros_costes(df_total_costes: pd.DataFrame):
+    """
+    Otros costes: barra mensual y línea acumulada.
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+
+    # Barra: costes mensuales
+    fig.add_bar(
+        x=df_total_costes["Mes"],
+        y=df_total_costes["Total otros costes (€)"],
+        name="Coste mensual",
+        marker_color="steelblue"
+    )
+
+    # Línea: costes acumulados
+    fig.add_trace(
+        go.Scatter(
+            x=df_total_costes["Mes"],
+            y=df_total_costes["Total otros costes acumulado (€)"],
+            name="Acumulado",
+            mode="lines+markers",
+            line=dict(color="firebrick", width=3)
+        )
+    )
+
+    # Ajustes estéticos
+    fig.update_layout(
+        title="Otros costes: mensual y acumulado",
+        xaxis_title="Mes",
+        yaxis_title="€",
+        xaxis_tickangle=-45,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+
+def tornado(df_tornado: pd.DataFrame, metrica: str, valor_base: float, titulo: str, etiquetas: dict = None):
+    """
+    Tornado de sensibilidad: para cada variable, barras desde el valor base de
+    la métrica hasta su valor con la variable en el extremo bajo y en el alto
+    (ver sensibilidad.tornado). Las variables se ordenan por amplitud.
+    """
+    import plotly.graph_objects as go
+
+    etiquetas = etiquetas or {}
+    df = df_tornado.copy()
+    df["Amplitud"] = (df[f"{metrica} alto"] - df[f"{metrica} bajo"]).abs()
+    df = df.sort_values("Amplitud")
+    nombres = [etiquetas.get(v, v) for v in df["Variable"]]
+
+    fig = go.Figure()
+    for extremo, color in (("bajo", "steelblue"), ("alto", "firebrick")):
+        fig.add_bar(
+            y=nombres,
+            x=df[f"{metrica} {extremo}"] - valor_base,
+            base=valor_base,
+            orientation="h",
+            name=f"Valor {extremo}",
+            marker_color=color,
+            customdata=df[f"Valor {extremo}"],
+            hovertemplate="%{y}: %{customdata}<br>%{x:,.0f} €<extra></extra>",
+        )
+    fig.add_vline(x=valor_base, line_dash="dash", line_color="grey")
+    fig.update_layout(
+        title=titulo,
+        barmode="overlay",
+        xaxis_title="€",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+
+def mapa_calor(df_pivot: pd.DataFrame, titulo: str, x_titulo: str = None, y_titulo: str = None):
+    """
+    Mapa de calor de una métrica sobre dos variables (ver sensibilidad.mapa_calor).
+    """
+    import plotly.express as px
+
+    fig = px.imshow(
+        df_pivot,
+        aspect="auto",
+        color_continuous_scale="RdYlGn",
+        labels=dict(x=x_titulo or df_pivot.columns.name, y=y_titulo or df_pivot.index.name, color="€"),
+        title=titulo,
+    )
+    fig.update_yaxes(type="category")
+    fig.update_xaxes(type="category")
+    return fig
+
+
+def bandas(df_bandas: pd.DataFrame, serie: str, titulo: str, percentiles=(10, 50, 90)):
+    """
+    Banda de percentiles de una serie mensual simulada: la mediana como línea
+    y el intervalo entre el percentil más bajo y el más alto sombreado.
+    Las columnas son '<serie> P<n>' (ver montecarlo.bandas).
+    """
+    import plotly.graph_objects as go
+
+    bajo, medio, alto = (f"{serie} P{p}" for p in percentiles)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=df_bandas["Mes"], y=df_bandas[alto], mode="lines", line=dict(width=0), showlegend=False, name=alto))
+    fig.add_trace(
+        go.Scatter(
+            x=df_bandas["Mes"],
+            y=df_bandas[bajo],
+            mode="lines",
+            line=dict(width=0),
+            fill="tonexty",
+            fillcolor="rgba(70, 130, 180, 0.25)",
+            name=f"P{percentiles[0]}–P{percentiles[-1]}"
+        )
+    )
+    fig.add_trace(go.Scatter(x=df_bandas["Mes"], y=df_bandas[medio], mode="lines+markers", line=dict(color="steelblue", width=3), name=f"P{percentiles[1]}"))
+    fig.update_layout(
+        title=titulo,
+        xaxis_title="Mes",
+        yaxis_title="€",
+        xaxis_tickangle=-45,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig
+
+
+def apilado(df_ancho: pd.DataFrame, titulo: str, barras: bool = False):
+    """
+    Series apiladas por mes: una traza por columna de df_ancho (además de
+    'Mes'), como áreas o como barras.
+    """
+    import plotly.graph_objects as go
+
+    fig = go.Figure()
+    for columna in df_ancho.columns:
+        if columna == "Mes":
+            continue
+        if barras:
+            fig.add_trace(go.Bar(x=df_ancho["Mes"], y=df_ancho[columna], name=columna))
+        else:
+            fig.add_trace(go.Scatter(x=df_ancho["Mes"], y=df_ancho[columna], name=columna, mode="lines", stackgroup="proyectos"))
+    fig.update_layout(
+        title=titulo,
+        barmode="relative",
+        xaxis_title="Mes",
+        yaxis_title="€",
+        xaxis_tickangle=-45,
+    )
+    return fig
@@ -0,0 +1,464 @@
+"""
+Recálculo incremental del flujo de caja cuando cambian unas pocas viviendas o
+capítulos.
+
+FlujoIncremental evalúa el proyecto una vez con el motor y guarda, además de
+las columnas del flujo de caja como arrays sobre el calendario del proyecto,
+los pagos de cada vivienda y el cronograma de cada capítulo. Al cambiar el
+precio o las fechas de unas viviendas, o la planificación de unos capítulos,
+resta sus aportaciones anteriores de los meses afectados, suma las nuevas,
+rehace las columnas derivadas solo en esos meses y recalcula los acumulados
+y el saldo de la cuenta especial desde el primer mes tocado. El coste de
+cada cambio es proporcional al número de viviendas o capítulos cambiados y
+a los meses que quedan desde el primero tocado, no al tamaño del proyecto.
+
+El calendario se recalcula tras cada cambio igual que en el motor (horizonte
+de ingresos, cronograma y otros costes; ver _calendario), de modo que crece o
+se recorta y tiene siempre los mismos meses que una evaluación completa. El
+resultado coincide con motor.calcular_flujo_caja sobre las entradas nuevas
+salvo en el redondeo de las sumas de ingresos por mes (se resta y se suma en
+lugar de volver a sumar todas las viviendas). reconstruir() vuelve a evaluar
+todo.
+"""
+import numpy as np
+import pandas as pd
+
+import motor
+
+_COLUMNAS_VIVIENDAS = ["Precio", "Fecha venta", "Fecha escrituración"]
+_COLUMNAS_PLANIFICACION = ["Capítulo", "Inicio", "Duración (meses)"]
+
+
+class FlujoIncremental:
+    """
+    Flujo de caja de un proyecto que se actualiza por cambios. Las tablas
+    tienen el mismo formato que en motor.evaluar_proyecto; sin capítulos o
+    planificación se usan los de por defecto. Lanza ValueError si no hay
+    viviendas.
+    """
+
+    def __init__(
+        self,
+        parametros: motor.ParametrosProyecto,
+        df_viviendas: pd.DataFrame,
+        df_planificacion: pd.DataFrame = None,
+        df_capitulos: pd.DataFrame = None,
+    ):
+        p = parametros
+        if df_viviendas is None or df_viviendas.empty:
+            raise ValueError("Se necesita la tabla de viviendas para calcular el flujo de caja.")
+        if df_capitulos is None:
+            df_capitulos = motor.capitulos_por_defecto(p.coste_total_ejecucion)
+        if df_planificacion is None:
+            df_planificacion = motor.planificacion_por_defecto(df_capitulos, p.fecha_inicio_obra)
+        self.parametros = p
+        self.df_capitulos = df_capitulos
+        self.reconstruir(df_viviendas, df_planificacion)
+
+    # -- Evaluación completa --------------------------------------------------
+
+    def reconstruir(self, df_viviendas: pd.DataFrame = None, df_planificacion: pd.DataFrame = None) -> None:
+        """
+        Vuelve a evaluar todo con el motor (por defecto, con las viviendas y
+        la planificación actuales).
+        """
+        p = self.parametros
+        if df_viviendas is None:
+            df_viviendas = self.viviendas()
+        if df_planificacion is None:
+            df_planificacion = self.planificacion
+        self._viviendas = df_viviendas[_COLUMNAS_VIVIENDAS].reset_index(drop=True).copy()
+        self.planificacion = df_planificacion[_COLUMNAS_PLANIFICACION].reset_index(drop=True).copy()
+
+        df_ingresos = motor.calcular_ingresos(
+            self._viviendas,
+            p.fecha_entrega_viviendas,
+            p.reserva_fija,
+            p.pct_contrato,
+            p.pct_aplazado,
+            p.iva_venta,
+            p.comisiones_venta,
+            p.iva_otros,
+        )
+        df_cronograma = motor.calcular_cronograma(self.planificacion, self.df_capitulos, p.coste_total_ejecucion)
+        otros_costes = motor.calcular_otros_costes(
+            self._viviendas,
+            p.fecha_inicio_obra,
+            p.fecha_inicio_comercializacion,
+            p.plazo_obra_meses,
+            p.coste_suelo,
+            p.coste_total_ejecucion,
+            p.porcentaje_honorarios,
+            p.porcentaje_admin,
+            p.gastos_financieros,
+        )
+        df_flujo = motor.calcular_flujo_caja(df_ingresos, df_cronograma, otros_costes["total"])
+        self.primer_mes, num_meses = motor.rango_tabla(df_flujo)
+        self.columnas = {c: df_flujo[c].to_numpy(dtype=np.float64).copy() for c in df_flujo.columns if c != "Mes"}
+
+        # Cronograma de cada capítulo y otros costes sobre el calendario
+        primer_mes_cronograma, self._capitulos, matriz = motor.cronograma_ejecucion(
+            self.planificacion, self.df_capitulos, p.coste_total_ejecucion
+        )
+        self._ejecucion = np.zeros((len(self._capitulos), num_meses), dtype=np.float64)
+        for fila, serie in enumerate(matriz):
+            self._ejecucion[fila] = motor.alinear(serie, primer_mes_cronograma, self.primer_mes, num_meses)
+        primer_mes_otros, _ = motor.rango_tabla(otros_costes["total"])
+        self._rango_cronograma = motor.rango_tabla(df_cronograma)
+        meses_fijos = np.concatenate([meses for meses, _, _ in motor.pagos_otros_costes(
+            None,
+            p.fecha_inicio_obra,
+            p.fecha_inicio_comercializacion,
+            p.plazo_obra_meses,
+            p.coste_suelo,
+            p.coste_total_ejecucion,
+            p.porcentaje_honorarios,
+            p.porcentaje_admin,
+            p.gastos_financieros,
+        )])
+        # Meses de los otros costes que no dependen de las viviendas
+        self._rango_otros_fijos = (int(meses_fijos.min()), int(meses_fijos.max()) - int(meses_fijos.min()) + 1)
+        self._otros = np.array([
+            motor.alinear(otros_costes["total"][c].to_numpy(dtype=np.float64), primer_mes_otros, self.primer_mes, num_meses)
+            for c in motor.COLUMNAS_OTROS_COSTES
+        ])
+
+        # Pagos de cada vivienda (las no vendidas, con importe cero)
+        self._meses, self._importes, self._vendida = self._pagos(self._viviendas)
+
+        # Recuentos de las fechas y meses que fijan el calendario (ver
+        # _calendario), para no recorrer todas las viviendas en cada cambio
+        dias_venta, dias_fin = self._dias(self._viviendas)
+        self._recuento_ventas = _Recuento(dias_venta)
+        self._recuento_fin = _Recuento(dias_fin)
+        self._recuento_pagos = _Recuento(self._meses[:, self._vendida].ravel())
+        self._recuento_contratos = _Recuento(self._meses[1, self._vendida])
+
+    @property
+    def num_meses(self) -> int:
+        return len(self.columnas["Flujo mensual total (€)"])
+
+    def viviendas(self) -> pd.DataFrame:
+        """
+        Precio y fechas actuales de las viviendas.
+        """
+        return self._viviendas.copy()
+
+    def tabla(self) -> pd.DataFrame:
+        """
+        Tabla de flujo de caja con las columnas de motor.calcular_flujo_caja.
+        """
+        df = pd.DataFrame({"Mes": motor.etiquetas_mes(self.primer_mes, self.num_meses)})
+        for columna, valores in self.columnas.items():
+            df[columna] = valores.copy()
+        return df
+
+    # -- Cambios ---------------------------------------------------------------
+
+    def cambiar_viviendas(self, cambios: pd.DataFrame) -> int:
+        """
+        Aplica cambios de 'Precio', 'Fecha venta' y/o 'Fecha escrituración'
+        (las columnas presentes; NaT quita la fecha) a las viviendas cuyas
+        posiciones en la tabla original son el índice de 'cambios'. Devuelve
+        el primer mes tocado (índice de motor.indice_mes) o None si no cambia
+        ningún pago.
+        """
+        filas = cambios.index.to_numpy(dtype=np.int64)
+        if len(filas) == 0:
+            return None
+        if filas.min() < 0 or filas.max() >= len(self._viviendas):
+            raise ValueError("Hay cambios de viviendas fuera de la tabla.")
+        desconocidas = set(cambios.columns) - set(_COLUMNAS_VIVIENDAS)
+        if desconocidas:
+            raise ValueError(f"Columnas de vivienda desconocidas: {', '.join(sorted(desconocidas))}")
+
+        meses_antes = self._meses[:, filas]
+        importes_antes = self._importes[:, filas]
+        vendida_antes = self._vendida[filas]
+        dias_venta_antes, dias_fin_antes = self._dias(self._viviendas.iloc[filas])
+
+        for columna in cambios.columns:
+            columna_actual = self._viviendas.columns.get_loc(columna)
+            self._viviendas.iloc[filas, columna_actual] = cambios[columna].to_numpy()
+        meses, importes, vendida = self._pagos(self._viviendas.iloc[filas])
+        self._meses[:, filas] = meses
+        self._importes[:, filas] = importes
+        self._vendida[filas] = vendida
+
+        dias_venta, dias_fin = self._dias(self._viviendas.iloc[filas])
+        self._recuento_ventas.cambiar(dias_venta_antes, dias_venta)
+        self._recuento_fin.cambiar(dias_fin_antes, dias_fin)
+        self._recuento_pagos.cambiar(meses_antes[:, vendida_antes].ravel(), meses[:, vendida].ravel())
+        self._recuento_contratos.cambiar(meses_antes[1, vendida_antes], meses[1, vendida])
+
+        # El calendario puede cambiar aunque no cambie ningún pago (p. ej. la
+        # escrituración de una vivienda sin vender alarga el horizonte)
+        primer_mes, num_meses = self._calendario()
+        self._ampliar(primer_mes, primer_mes + num_meses - 1)
+        tocados = np.concatenate([meses_antes[:, vendida_antes].ravel(), meses[:, vendida].ravel()])
+        if len(tocados) == 0:
+            self._recortar(primer_mes, num_meses)
+            return None
+
+        # Fases de pago: restar lo anterior y sumar lo nuevo
+        for fila, columna in enumerate(motor.COLUMNAS_INGRESOS):
+            np.subtract.at(self.columnas[columna], meses_antes[fila, vendida_antes] - self.primer_mes, importes_antes[fila, vendida_antes])
+            np.add.at(self.columnas[columna], meses[fila, vendida] - self.primer_mes, importes[fila, vendida])
+
+        # Costes financieros: uno por vivienda vendida en el mes del contrato
+        gastos = -self.parametros.gastos_financieros
+        np.subtract.at(self._otros[3], meses_antes[1, vendida_antes] - self.primer_mes, gastos)
+        np.add.at(self._otros[3], meses[1, vendida] - self.primer_mes, gastos)
+
+        self._derivar(np.unique(tocados) - self.primer_mes)
+        self._recortar(primer_mes, num_meses)
+        return int(tocados.min())
+
+    def cambiar_planificacion(self, df_planificacion: pd.DataFrame) -> int:
+        """
+        Sustituye la planificación por 'df_planificacion' y rehace solo el
+        cronograma de los capítulos cuyas filas han cambiado (o son nuevos o
+        han desaparecido). Devuelve el primer mes tocado o None si ningún
+        capítulo cambia.
+        """
+        nueva = df_planificacion[_COLUMNAS_PLANIFICACION].reset_index(drop=True).copy()
+        cambiados = [
+            capitulo
+            for capitulo in pd.unique(pd.concat([self.planificacion["Capítulo"], nueva["Capítulo"]]).dropna())
+            if not _filas_capitulo(self.planificacion, capitulo).equals(_filas_capitulo(nueva, capitulo))
+        ]
+        self.planificacion = nueva
+        if not cambiados:
+            return None
+        self._rango_cronograma = _rango_planificacion(nueva)
+        primer_mes_calendario, num_meses_calendario = self._calendario()
+        self._ampliar(primer_mes_calendario, primer_mes_calendario + num_meses_calendario - 1)
+
+        coste_total = self.parametros.coste_total_ejecucion
+        primer_mes_nuevo, capitulos, matriz = motor.cronograma_ejecucion(
+            nueva[nueva["Capítulo"].isin(cambiados)], self.df_capitulos, coste_total
+        )
+
+        tocados = np.zeros(self.num_meses, dtype=bool)
+        for capitulo in cambiados:
+            if capitulo not in self._capitulos:
+                self._capitulos.append(capitulo)
+                self._ejecucion = np.vstack([self._ejecucion, np.zeros((1, self.num_meses))])
+            fila = self._capitulos.index(capitulo)
+            anterior = self._ejecucion[fila].copy()
+            if capitulo in capitulos:
+                serie = matriz[capitulos.index(capitulo)]
+                self._ejecucion[fila] = motor.alinear(serie, primer_mes_nuevo, self.primer_mes, self.num_meses)
+            else:
+                self._ejecucion[fila] = 0.0
+            tocados |= (anterior != 0) | (self._ejecucion[fila] != 0)
+
+        meses = np.flatnonzero(tocados)
+        if len(meses) == 0:
+            self._recortar(primer_mes_calendario, num_meses_calendario)
+            return None
+        primer_tocado = self.primer_mes + int(meses[0])
+        self.columnas["Coste ejecución (€)"][meses] = self._ejecucion[:, meses].sum(axis=0)
+        self._derivar(meses)
+        self._recortar(primer_mes_calendario, num_meses_calendario)
+        return primer_tocado
+
+    # -- Internos --------------------------------------------------------------
+
+    def _pagos(self, df_viviendas: pd.DataFrame):
+        """
+        (meses, importes, vendida) de cada fila de df_viviendas: matrices
+        4 x filas con los pagos de COLUMNAS_INGRESOS y la máscara de filas con
+        fecha de venta (las demás, con mes y pago cero).
+        """
+        p = self.parametros
+        n = len(df_viviendas)
+        meses = np.zeros((len(motor.COLUMNAS_INGRESOS), n), dtype=np.int64)
+        importes = np.zeros((len(motor.COLUMNAS_INGRESOS), n), dtype=np.float64)
+        vendida = np.zeros(n, dtype=bool)
+        pagos = motor.pagos_ingresos(
+            df_viviendas, p.fecha_entrega_viviendas, p.reserva_fija, p.pct_contrato, p.pct_aplazado, p.iva_venta
+        )
+        meses[:, pagos["filas"]] = pagos["meses"]
+        importes[:, pagos["filas"]] = pagos["importes"]
+        vendida[pagos["filas"]] = True
+        return meses, importes, vendida
+
+    def _calendario(self) -> tuple:
+        """
+        (primer_mes, num_meses) que tendría motor.calcular_flujo_caja con las
+        viviendas y la planificación actuales: el de motor.calendario sobre
+        el horizonte de ingresos (como motor.pagos_ingresos), el cronograma y
+        los otros costes (los fijos más un coste financiero por contrato).
+        Solo consulta los recuentos, no recorre las viviendas.
+        """
+        ventas = self._recuento_ventas.rango()
+        fechas_venta = np.array([ventas[0] if ventas else "NaT"], dtype="datetime64[D]").astype("datetime64[ns]")
+        fechas_fin = np.array([self._recuento_fin.rango()[1]], dtype="datetime64[D]").astype("datetime64[ns]")
+        primer_ingresos, num_ingresos = motor.horizonte_ingresos(
+            fechas_venta, fechas_fin, self.parametros.fecha_entrega_viviendas
+        )
+        primer_otros, num_otros = self._rango_otros_fijos
+        pagos = self._recuento_pagos.rango()
+        if pagos:
+            ultimo_ingresos = max(primer_ingresos + num_ingresos - 1, pagos[1])
+            primer_ingresos = min(primer_ingresos, pagos[0])
+            num_ingresos = ultimo_ingresos - primer_ingresos + 1
+            contratos = self._recuento_contratos.rango()
+            ultimo_otros = max(primer_otros + num_otros - 1, contratos[1])
+            primer_otros = min(primer_otros, contratos[0])
+            num_otros = ultimo_otros - primer_otros + 1
+        return motor.calendario((primer_ingresos, num_ingresos), self._rango_cronograma, (primer_otros, num_otros))
+
+    def _recortar(self, primer_mes: int, num_meses: int) -> None:
+        """
+        Quita los meses del calendario fuera de [primer_mes, primer_mes +
+        num_meses), que ya no tienen flujos: los acumulados de los que quedan
+        no cambian.
+        """
+        inicio = primer_mes - self.primer_mes
+        fin = inicio + num_meses
+        if inicio <= 0 and fin >= self.num_meses:
+            return
+        inicio = max(inicio, 0)
+        for columna, valores in self.columnas.items():
+            self.columnas[columna] = valores[inicio:fin].copy()
+        self._ejecucion = self._ejecucion[:, inicio:fin].copy()
+        self._otros = self._otros[:, inicio:fin].copy()
+        self.primer_mes += inicio
+
+    def _dias(self, df_viviendas: pd.DataFrame):
+        """
+        Días (desde 1970) de las fechas de venta de las filas vendidas y de la
+        escrituración (o la entrega, si no la hay) de todas las filas.
+        """
+        fechas_venta = motor.como_fechas(df_viviendas["Fecha venta"]).to_numpy(dtype="datetime64[ns]")
+        fechas_escritura = motor.como_fechas(df_viviendas["Fecha escrituración"]).to_numpy(dtype="datetime64[ns]")
+        entrega = np.datetime64(self.parametros.fecha_entrega_viviendas, "ns")
+        fechas_fin = np.where(np.isnat(fechas_escritura), entrega, fechas_escritura)
+        dias_venta = fechas_venta[~np.isnat(fechas_venta)].astype("datetime64[D]").astype(np.int64)
+        return dias_venta, fechas_fin.astype("datetime64[D]").astype(np.int64)
+
+    def _ampliar(self, primer_mes: int, ultimo_mes: int) -> None:
+        """
+        Amplía el calendario para que contenga [primer_mes, ultimo_mes]; los
+        meses nuevos empiezan a cero.
+        """
+        antes = max(self.primer_mes - primer_mes, 0)
+        despues = max(ultimo_mes - (self.primer_mes + self.num_meses - 1), 0)
+        if not antes and not despues:
+            return
+        num_meses = self.num_meses
+        for columna, valores in self.columnas.items():
+            self.columnas[columna] = np.pad(valores, (antes, despues))
+        self._ejecucion = np.pad(self._ejecucion, ((0, 0), (antes, despues)))
+        self._otros = np.pad(self._otros, ((0, 0), (antes, despues)))
+        self.primer_mes -= antes
+        if despues:
+            # Los meses nuevos del principio no tienen flujos (sus acumulados
+            # son cero); los del final arrastran el último acumulado
+            self._propagar(antes + num_meses)
+
+    def _derivar(self, meses: np.ndarray) -> None:
+        """
+        Rehace las columnas mensuales derivadas en 'meses' (posiciones en el
+        calendario) y propaga acumulados y cuenta especial desde el primero.
+        """
+        p = self.parametros
+        c = self.columnas
+        reserva, contrato, aplazado, escritura = (c[columna][meses] for columna in motor.COLUMNAS_INGRESOS)
+
+        # Mismas operaciones, en el mismo orden, que motor.calcular_ingresos y
+        # motor.calcular_flujo_caja
+        total_con_iva = reserva + contrato + aplazado + escritura
+        comisiones = -(total_con_iva / (1 + p.iva_venta / 100) * (p.comisiones_venta / 100) * (1 + p.iva_otros / 100))
+        c["Total ingresos (€)"][meses] = total_con_iva
+        c["Comisiones (€)"][meses] = comisiones
+        c["Ingresos netos (€)"][meses] = total_con_iva + comisiones
+        for fila, columna in enumerate(motor.COLUMNAS_OTROS_COSTES):
+            c[columna][meses] = self._otros[fila, meses]
+        c["Total otros costes (€)"][meses] = self._otros[:, meses].sum(axis=0)
+        c["Flujo mensual total (€)"][meses] = c["Ingresos netos (€)"][meses] + c["Coste ejecución (€)"][meses] + c["Total otros costes (€)"][meses]
+        c["Ingreso cuenta especial (€)"][meses] = reserva + contrato + aplazado
+        c["Gasto cuenta especial (€)"][meses] = c["Coste ejecución (€)"][meses]
+        c["Flujo cuenta especial (€)"][meses] = c["Ingreso cuenta especial (€)"][meses] + c["Gasto cuenta especial (€)"][meses]
+        self._propagar(int(meses.min()))
+
+    def _propagar(self, desde: int) -> None:
+        """
+        Recalcula acumulados y saldo de la cuenta especial desde la posición
+        'desde', partiendo de los valores del mes anterior.
+        """
+        c = self.columnas
+        for acumulado, mensual in (
+            ("Acumulado", "Total ingresos (€)"),
+            ("Total otros costes acumulado (€)", "Total otros costes (€)"),
+            ("Flujo acumulado (€)", "Flujo mensual total (€)"),
+        ):
+            c[acumulado][desde:] = _acumular_desde(c[mensual], c[acumulado], desde)
+
+        # El saldo del mes anterior (nunca negativo) entra como primer flujo
+        saldo_anterior = c["Acumulado cuenta especial (€)"][desde - 1] if desde else 0.0
+        saldo, deficits = motor.saldo_cuenta_especial(np.concatenate([[saldo_anterior], c["Flujo cuenta especial (€)"][desde:]]))
+        c["Acumulado cuenta especial (€)"][desde:] = saldo[1:]
+        c["Déficit cuenta especial (€)"][desde:] = deficits[1:]
+
+
+class _Recuento:
+    """
+    Cuántas veces aparece cada valor entero (días o índices de mes) en un
+    eje denso, para conocer el mínimo y el máximo tras cambiar unos pocos
+    valores sin recorrerlos todos.
+    """
+
+    def __init__(self, valores: np.ndarray):
+        valores = np.asarray(valores, dtype=np.int64)
+        self.inicio = int(valores.min()) if len(valores) else 0
+        self.cuentas = np.bincount(valores - self.inicio) if len(valores) else np.zeros(0, dtype=np.int64)
+
+    def cambiar(self, quitar: np.ndarray, poner: np.ndarray) -> None:
+        quitar = np.asarray(quitar, dtype=np.int64)
+        poner = np.asarray(poner, dtype=np.int64)
+        if len(poner):
+            antes = max(self.inicio - int(poner.min()), 0)
+            despues = max(int(poner.max()) - (self.inicio + len(self.cuentas) - 1), 0)
+            if antes or despues:
+                self.cuentas = np.pad(self.cuentas, (antes, despues))
+                self.inicio -= antes
+        np.subtract.at(self.cuentas, quitar - self.inicio, 1)
+        np.add.at(self.cuentas, poner - self.inicio, 1)
+
+    def rango(self):
+        """
+        (mínimo, máximo) de los valores presentes, o None si no hay ninguno.
+        """
+        presentes = np.flatnonzero(self.cuentas)
+        if len(presentes) == 0:
+            return None
+        return self.inicio + int(presentes[0]), self.inicio + int(presentes[-1])
+
+
+def _acumular_desde(mensual: np.ndarray, acumulado: np.ndarray, desde: int) -> np.ndarray:
+    # Suma secuencial desde el acumulado del mes anterior, como un cumsum completo
+    anterior = acumulado[desde - 1] if desde else 0.0
+    return np.cumsum(np.concatenate([[anterior], mensual[desde:]]))[1:]
+
+
+def _rango_planificacion(df_planificacion: pd.DataFrame) -> tuple:
+    """
+    (primer_mes, num_meses) del cronograma de una planificación, como en
+    motor.cronograma_ejecucion: del primer inicio al último mes con coste.
+    """
+    filas = df_planificacion.dropna(subset=_COLUMNAS_PLANIFICACION)
+    if filas.empty:
+        return 0, 0
+    inicios = motor.indices_mes(pd.to_datetime(filas["Inicio"]).to_numpy(dtype="datetime64[D]"))
+    duraciones = filas["Duración (meses)"].to_numpy().astype(np.int64)
+    primer_mes = int(inicios.min())
+    return primer_mes, max(int((inicios + duraciones).max()) - primer_mes, 0)
+
+
+def _filas_capitulo(df_planificacion: pd.DataFrame, capitulo) -> pd.DataFrame:
+    filas = df_planificacion[df_planificacion["Capítulo"] == capitulo].reset_index(drop=True)
+    filas["Inicio"] = pd.to_datetime(filas["Inicio"])
+    return filas
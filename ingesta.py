@@ -0,0 +1,416 @@
+"""
+Ingesta de la tabla de viviendas.
+
+Convierte una tabla leída de un pegado de Excel, un CSV o una hoja .xlsx en la
+tabla normalizada que usa el motor (Código, Precio, Fecha venta, Fecha
+escrituración) con operaciones por columna completa:
+
+- Las fechas se parsean de una vez por columna: el formato se infiere con una
+  muestra y solo los valores que no encajan pasan por el parser flexible. Se
+  guardan como datetime64 (el motor necesita el día para comparar con la
+  entrega; los índices de mes se obtienen de ellas con motor.indices_mes).
+- Los precios admiten formato español ("300.000 €", "300.000,50 €"): un
+  punto seguido de grupos de tres cifras es separador de miles. Las columnas
+  de precio de textos y CSV se leen como texto para que pandas no convierta
+  antes "300.000" en 300.0.
+- Los códigos se guardan como categoría.
+- La validación se hace en bloque y devuelve un informe con las filas
+  erróneas; las filas sin un precio válido se descartan.
+
+Los textos grandes se leen por trozos (TAM_TROZO filas): cada trozo se
+normaliza y solo se conservan sus columnas ya tipadas. Los .xlsx se leen con
+openpyxl en modo de solo lectura, que recorre la hoja fila a fila sin cargar
+el libro entero, y se normalizan por los mismos trozos; la hoja y las
+columnas de origen se pueden elegir.
+
+Los CSV de capítulos se leen con el motor C de pandas tras detectar el
+separador con una muestra del comienzo del archivo.
+"""
+import csv
+import warnings
+from dataclasses import dataclass
+from datetime import date
+from io import BytesIO, StringIO
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS = ["Código", "Precio", "Fecha venta", "Fecha escrituración"]
+
+# Formatos de fecha que se prueban sobre la muestra, en orden de preferencia
+FORMATOS_FECHA = (
+    "%d/%m/%Y",
+    "%d/%m/%y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S",
+    "%Y/%m/%d",
+)
+
+TAM_MUESTRA = 500
+TAM_TROZO = 200_000
+# Las filas de un .xlsx llegan como objetos Python: trozos más pequeños
+TAM_TROZO_XLSX = 50_000
+
+# Separadores que se prueban al detectar el de un CSV y bytes de la muestra
+SEPARADORES = ";,\t|"
+TAM_MUESTRA_CSV = 64 * 1024
+
+# Números de serie de fecha de Excel admitidos (1954-2119)
+_SERIE_EXCEL_MIN = 20000
+_SERIE_EXCEL_MAX = 80000
+
+# Cifras agrupadas de tres en tres con punto, con decimales opcionales tras la coma
+_MILES_CON_PUNTO = r"^[-+]?\d{1,3}(?:\.\d{3})+(?:,\d*)?$"
+
+_COLUMNAS_ERRORES = ["Fila", "Código", "Columna", "Problema", "Valor", "Descartada"]
+
+
+@dataclass
+class ResultadoIngesta:
+    """
+    viviendas: tabla normalizada. errores: una fila por problema detectado
+    ('Fila' es la fila de la tabla de origen contando la cabecera como 1).
+    """
+    viviendas: pd.DataFrame
+    errores: pd.DataFrame
+    filas_leidas: int
+
+
+def detectar_columnas(columnas) -> dict:
+    """
+    Asocia las columnas de origen a Código, Precio, Fecha venta y Fecha
+    escrituración (flexible a variaciones en la cabecera). Devuelve
+    {columna de origen: columna normalizada}. Lanza ValueError si faltan
+    columnas obligatorias.
+    """
+    normalizadas = {c: str(c).strip().lower() for c in columnas}
+    col_codigo = next((c for c, n in normalizadas.items() if "código" in n or "codigo" in n or n == "id"), None)
+    col_precio = next((c for c, n in normalizadas.items() if "precio" in n), None)
+    col_venta = next((c for c, n in normalizadas.items() if "venta" in n), None)
+    col_escritura = next((c for c, n in normalizadas.items() if "escritu" in n), None)
+    if not col_codigo or not col_precio or not col_venta:
+        raise ValueError("La tabla debe tener al menos las columnas: Código, Precio y Fecha venta.")
+    mapeo = {col_codigo: "Código", col_precio: "Precio", col_venta: "Fecha venta"}
+    if col_escritura:
+        mapeo[col_escritura] = "Fecha escrituración"
+    return mapeo
+
+
+def inferir_formato_fecha(textos: pd.Series):
+    """
+    Formato de FORMATOS_FECHA que reconoce más valores de una muestra de
+    textos, o None si no reconoce ninguno.
+    """
+    muestra = textos.dropna()
+    muestra = muestra[muestra != ""].drop_duplicates().head(TAM_MUESTRA)
+    if muestra.empty:
+        return None
+    mejor, aciertos_mejor = None, 0
+    for formato in FORMATOS_FECHA:
+        aciertos = int(pd.to_datetime(muestra, format=formato, errors="coerce").notna().sum())
+        if aciertos > aciertos_mejor:
+            mejor, aciertos_mejor = formato, aciertos
+            if aciertos == len(muestra):
+                break
+    return mejor
+
+
+def _textos(serie: pd.Series) -> pd.Series:
+    textos = serie.astype("string").str.strip()
+    return textos.mask(textos == "")
+
+
+def parsear_fechas(serie: pd.Series, formato: str = None):
+    """
+    Convierte una columna a datetime64[ns] de una vez. Acepta fechas ya
+    convertidas, objetos date, números de serie de Excel y textos (día
+    primero). Devuelve (fechas, formato inferido); los valores no
+    reconocidos quedan como NaT.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.astype("datetime64[ns]"), formato
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        numeros = serie.astype(np.float64).where((serie >= _SERIE_EXCEL_MIN) & (serie <= _SERIE_EXCEL_MAX))
+        return pd.to_datetime(numeros, unit="D", origin="1899-12-30"), formato
+
+    tipo = pd.api.types.infer_dtype(serie, skipna=True)
+    if tipo in ("date", "datetime", "datetime64"):
+        return pd.to_datetime(serie, errors="coerce").astype("datetime64[ns]"), formato
+    if tipo == "mixed":
+        # Celdas de tipos distintos (p. ej. de una hoja de cálculo): primero
+        # las que ya son fechas, después el resto como texto
+        es_fecha = serie.map(lambda v: isinstance(v, date)).to_numpy(dtype=bool)
+        fechas = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+        fechas[es_fecha] = pd.to_datetime(serie[es_fecha]).astype("datetime64[ns]")
+        resto, formato = parsear_fechas(serie[~es_fecha].astype("string"), formato)
+        fechas[~es_fecha] = resto
+        return fechas, formato
+
+    textos = _textos(serie)
+    formato = formato or inferir_formato_fecha(textos)
+    if formato:
+        fechas = pd.to_datetime(textos, format=formato, errors="coerce")
+    else:
+        fechas = pd.Series(pd.NaT, index=serie.index, dtype="datetime64[ns]")
+    pendientes = fechas.isna() & textos.notna()
+    if pendientes.any():
+        fechas[pendientes] = pd.to_datetime(textos[pendientes], dayfirst=True, errors="coerce", format="mixed")
+    return fechas.astype("datetime64[ns]"), formato
+
+
+def parsear_importes(serie: pd.Series) -> pd.Series:
+    """
+    Convierte una columna de importes a float64. Los textos admiten símbolo
+    de euro, espacios y formato español: con coma decimal los puntos son de
+    miles ("1.250,50"), y sin ella también lo son si agrupan cifras de tres
+    en tres ("300.000", "1.250.000"); "300.5" sigue siendo 300,5.
+    """
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype(np.float64)
+    textos = _textos(serie).str.replace(r"[€\s ]", "", regex=True)
+    formato_es = textos.str.contains(",", regex=False, na=False) | textos.str.match(_MILES_CON_PUNTO, na=False)
+    textos = textos.where(~formato_es, textos.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(textos, errors="coerce").astype(np.float64)
+
+
+def _normalizar_trozo(df: pd.DataFrame, mapeo: dict, formatos: dict, desplazamiento: int):
+    """
+    Normaliza un trozo ya con sus columnas de origen. Devuelve (tabla, lista
+    de tablas de errores). formatos guarda el formato de fecha inferido en el
+    primer trozo para reutilizarlo en los siguientes.
+    """
+    df = df[list(mapeo)].rename(columns=mapeo)
+    filas = np.arange(len(df)) + desplazamiento + 2
+    codigos = _textos(df["Código"])
+    precios = parsear_importes(df["Precio"])
+
+    salida = pd.DataFrame({"Código": codigos.to_numpy(dtype=object), "Precio": precios.to_numpy()})
+    errores = []
+
+    def anotar(mascara, columna, problema, valores, descartada):
+        if mascara.any():
+            errores.append(pd.DataFrame({
+                "Fila": filas[mascara],
+                "Código": codigos.to_numpy(dtype=object)[mascara],
+                "Columna": columna,
+                "Problema": problema,
+                "Valor": pd.Series(valores).astype("string").to_numpy(dtype=object)[mascara],
+                "Descartada": descartada,
+            }))
+
+    for columna in ("Fecha venta", "Fecha escrituración"):
+        if columna in df.columns:
+            fechas, formatos[columna] = parsear_fechas(df[columna], formatos.get(columna))
+            # Solo se revisan las celdas sin fecha: vacías o no reconocidas
+            sin_fecha = fechas.isna().to_numpy() & df[columna].notna().to_numpy()
+            if sin_fecha.any():
+                sin_fecha[sin_fecha] = _textos(df[columna][sin_fecha]).notna().to_numpy()
+            anotar(sin_fecha, columna, "Fecha no reconocida", df[columna].to_numpy(), False)
+            salida[columna] = fechas.to_numpy()
+        else:
+            salida[columna] = pd.Series(pd.NaT, index=salida.index, dtype="datetime64[ns]")
+
+    anotar(codigos.isna().to_numpy(), "Código", "Código vacío", df["Código"].to_numpy(), False)
+    sin_precio = ~np.isfinite(precios.to_numpy()) | (precios.to_numpy() <= 0)
+    anotar(sin_precio, "Precio", "Precio no válido", df["Precio"].to_numpy(), True)
+    if "Fecha escrituración" in df.columns:
+        venta = salida["Fecha venta"].to_numpy()
+        escritura = salida["Fecha escrituración"].to_numpy()
+        anotar(
+            ~np.isnat(venta) & ~np.isnat(escritura) & (escritura < venta),
+            "Fecha escrituración", "Escrituración anterior a la venta", df["Fecha escrituración"].to_numpy(), False,
+        )
+    return salida[~sin_precio], errores
+
+
+def normalizar_viviendas(df_origen: pd.DataFrame, fecha_entrega_viviendas: date, tam_trozo: int = TAM_TROZO) -> ResultadoIngesta:
+    """
+    Normaliza una tabla de viviendas ya cargada (ver el docstring del
+    módulo). Las viviendas sin escrituración se escrituran en la entrega.
+    """
+    return _normalizar(iter([df_origen]) if len(df_origen) <= tam_trozo else _trocear(df_origen, tam_trozo), fecha_entrega_viviendas)
+
+
+def _trocear(df: pd.DataFrame, tam_trozo: int):
+    for inicio in range(0, len(df), tam_trozo):
+        yield df.iloc[inicio:inicio + tam_trozo]
+
+
+def _normalizar(trozos, fecha_entrega_viviendas: date, mapeo: dict = None) -> ResultadoIngesta:
+    partes, errores = [], []
+    formatos = {}
+    filas = 0
+    for trozo in trozos:
+        if mapeo is None:
+            mapeo = detectar_columnas(trozo.columns)
+        parte, errores_trozo = _normalizar_trozo(trozo, mapeo, formatos, filas)
+        partes.append(parte)
+        errores.extend(errores_trozo)
+        filas += len(trozo)
+    if mapeo is None:
+        raise ValueError("La tabla debe tener al menos las columnas: Código, Precio y Fecha venta.")
+
+    df = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0].reset_index(drop=True)
+    df["Código"] = df["Código"].astype("category")
+    df["Fecha escrituración"] = df["Fecha escrituración"].fillna(pd.Timestamp(fecha_entrega_viviendas))
+    df_errores = (
+        pd.concat(errores, ignore_index=True).sort_values("Fila", kind="stable", ignore_index=True)
+        if errores else pd.DataFrame(columns=_COLUMNAS_ERRORES)
+    )
+    return ResultadoIngesta(df[COLUMNAS], df_errores, filas)
+
+
+def leer_texto(texto: str, fecha_entrega_viviendas: date, sep: str = "\t", tam_trozo: int = TAM_TROZO) -> ResultadoIngesta:
+    """
+    Lee una tabla de texto con cabecera (por defecto, separada por
+    tabuladores, como al pegar desde Excel) por trozos de tam_trozo filas.
+    La columna de precio se lee como texto y la parsea parsear_importes.
+    """
+    mapeo = detectar_columnas(pd.read_csv(StringIO(texto), sep=sep, nrows=0).columns)
+    col_precio = next(c for c, n in mapeo.items() if n == "Precio")
+    lector = pd.read_csv(StringIO(texto), sep=sep, chunksize=tam_trozo, skip_blank_lines=True, dtype={col_precio: str})
+    try:
+        with warnings.catch_warnings():
+            # Columnas con tipos mezclados dentro de un trozo (p. ej. fechas
+            # como texto y como número): se normalizan después columna a columna
+            warnings.simplefilter("ignore", pd.errors.DtypeWarning)
+            return _normalizar(lector, fecha_entrega_viviendas, mapeo)
+    finally:
+        lector.close()
+
+
+def _abrir_xlsx(contenido: bytes):
+    from openpyxl import load_workbook
+
+    return load_workbook(BytesIO(contenido), read_only=True, data_only=True)
+
+
+def hojas_xlsx(contenido: bytes) -> list:
+    libro = _abrir_xlsx(contenido)
+    try:
+        return list(libro.sheetnames)
+    finally:
+        libro.close()
+
+
+def _nombres_columnas(cabecera) -> list:
+    nombres = []
+    for i, valor in enumerate(cabecera):
+        nombre = str(valor).strip() if valor is not None and str(valor).strip() else f"Columna {i + 1}"
+        while nombre in nombres:
+            nombre += "_"
+        nombres.append(nombre)
+    return nombres
+
+
+def cabecera_xlsx(contenido: bytes, hoja: str = None) -> list:
+    """
+    Nombres de las columnas de la primera fila de una hoja (la activa por
+    defecto); las celdas vacías se llaman 'Columna n'.
+    """
+    libro = _abrir_xlsx(contenido)
+    try:
+        ws = libro[hoja] if hoja else libro.active
+        cabecera = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        return _nombres_columnas(cabecera)
+    finally:
+        libro.close()
+
+
+def trozos_xlsx(contenido: bytes, hoja: str = None, columnas: list = None, tam_trozo: int = TAM_TROZO_XLSX):
+    """
+    Recorre una hoja en modo de solo lectura y devuelve tablas de hasta
+    tam_trozo filas con la primera fila como cabecera. columnas limita las
+    columnas que se conservan. Las filas completamente vacías se omiten.
+    """
+    libro = _abrir_xlsx(contenido)
+    try:
+        ws = libro[hoja] if hoja else libro.active
+        filas = ws.iter_rows(values_only=True)
+        nombres = _nombres_columnas(next(filas, ()))
+        posiciones = [nombres.index(c) for c in columnas] if columnas else list(range(len(nombres)))
+        seleccion = [nombres[i] for i in posiciones]
+        bloque = []
+        for fila in filas:
+            valores = [fila[i] if i < len(fila) else None for i in posiciones]
+            if all(v is None for v in valores):
+                continue
+            bloque.append(valores)
+            if len(bloque) == tam_trozo:
+                yield pd.DataFrame(bloque, columns=seleccion)
+                bloque = []
+        if bloque or not seleccion:
+            yield pd.DataFrame(bloque, columns=seleccion)
+    finally:
+        libro.close()
+
+
+def leer_xlsx(
+    contenido: bytes,
+    fecha_entrega_viviendas: date,
+    hoja: str = None,
+    mapeo: dict = None,
+    tam_trozo: int = TAM_TROZO_XLSX,
+) -> ResultadoIngesta:
+    """
+    Lee la tabla de viviendas de una hoja .xlsx. mapeo ({columna de la hoja:
+    'Código' | 'Precio' | 'Fecha venta' | 'Fecha escrituración'}) elige las
+    columnas; por defecto se detectan por la cabecera.
+    """
+    mapeo = mapeo or detectar_columnas(cabecera_xlsx(contenido, hoja))
+    if not {"Código", "Precio", "Fecha venta"} <= set(mapeo.values()):
+        raise ValueError("La tabla debe tener al menos las columnas: Código, Precio y Fecha venta.")
+    return _normalizar(trozos_xlsx(contenido, hoja, list(mapeo), tam_trozo), fecha_entrega_viviendas, mapeo)
+
+
+def leer_capitulos_xlsx(contenido: bytes, hoja: str = None, columna_capitulo: str = None, columna_importe: str = None) -> pd.DataFrame:
+    """
+    Lee de una hoja .xlsx la tabla 'Capítulo' + importe (por defecto, las dos
+    primeras columnas) en el formato de motor.capitulos_desde_importes. Se
+    omiten las filas sin capítulo o sin importe.
+    """
+    nombres = cabecera_xlsx(contenido, hoja)
+    columna_capitulo = columna_capitulo or nombres[0]
+    columna_importe = columna_importe or nombres[1]
+    df = pd.concat(list(trozos_xlsx(contenido, hoja, [columna_capitulo, columna_importe])), ignore_index=True)
+    df = pd.DataFrame({"Capítulo": _textos(df.iloc[:, 0]).to_numpy(dtype=object), "Importe": parsear_importes(df.iloc[:, 1]).to_numpy()})
+    return df.dropna().reset_index(drop=True)
+
+
+def detectar_separador(contenido: bytes) -> str:
+    """
+    Separador de un CSV deducido de su comienzo (TAM_MUESTRA_CSV bytes). Así
+    el archivo entero se lee con el motor C de pandas en lugar de con el de
+    Python, que es el único que admite sep=None y es mucho más lento. Lanza
+    ValueError si la muestra no permite decidirlo.
+    """
+    muestra = contenido[:TAM_MUESTRA_CSV].decode("utf-8", errors="ignore")
+    try:
+        return csv.Sniffer().sniff(muestra, delimiters=SEPARADORES).delimiter
+    except csv.Error as e:
+        raise ValueError("No se ha podido detectar el separador del CSV.") from e
+
+
+def leer_capitulos_csv(contenido: bytes, sep: str = None):
+    """
+    Lee un CSV de capítulos e importes y devuelve (tabla, separador). Con sep
+    conocido (por ejemplo, de una lectura anterior) no se detecta; si no se
+    puede detectar, se recurre al motor de Python con sep=None. Las celdas se
+    leen como texto y la columna de importes se convierte con
+    parsear_importes.
+    """
+    if sep is None:
+        try:
+            sep = detectar_separador(contenido)
+        except ValueError:
+            return _importes_csv(pd.read_csv(BytesIO(contenido), sep=None, engine="python", dtype=str)), None
+    return _importes_csv(pd.read_csv(BytesIO(contenido), sep=sep, engine="c", dtype=str)), sep
+
+
+def _importes_csv(df: pd.DataFrame) -> pd.DataFrame:
+    if len(df.columns) >= 2:
+        df[df.columns[1]] = parsear_importes(df.iloc[:, 1])
+    return df
@@ -0,0 +1,88 @@
+"""
+Memoria ocupada por el estado de las sesiones de la app.
+
+Mide cada clave de st.session_state (tablas con memory_usage(deep=True),
+arrays por sus bytes y contenedores y objetos recorriendo su contenido, sin
+contar dos veces un mismo objeto) y guarda el total de cada sesión en un
+registro del proceso, compartido por todas las sesiones del servidor, para
+dimensionarlo: número de sesiones activas, total, media y máximo.
+"""
+import sys
+import threading
+import time
+from dataclasses import fields, is_dataclass
+
+import numpy as np
+import pandas as pd
+
+# Una sesión que no se ejecuta en este tiempo deja de contarse como activa
+CADUCIDAD_SEGUNDOS = 60 * 60
+
+_sesiones = {}
+_bloqueo = threading.Lock()
+
+
+def tamaño_objeto(valor, _vistos: set = None) -> int:
+    """
+    Bytes aproximados que ocupa un objeto con todo lo que contiene.
+    """
+    vistos = set() if _vistos is None else _vistos
+    if id(valor) in vistos:
+        return 0
+    vistos.add(id(valor))
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, (pd.Series, pd.Index)):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    tamaño = sys.getsizeof(valor)
+    if isinstance(valor, dict):
+        tamaño += sum(tamaño_objeto(k, vistos) + tamaño_objeto(v, vistos) for k, v in valor.items())
+    elif isinstance(valor, (list, tuple, set, frozenset)):
+        tamaño += sum(tamaño_objeto(v, vistos) for v in valor)
+    elif is_dataclass(valor):
+        tamaño += sum(tamaño_objeto(getattr(valor, f.name), vistos) for f in fields(valor))
+    elif hasattr(valor, "__dict__") and not isinstance(valor, type):
+        tamaño += tamaño_objeto(vars(valor), vistos)
+    return tamaño
+
+
+def informe(estado) -> pd.DataFrame:
+    """
+    Una fila por clave del estado de sesión con su tipo y sus bytes, de mayor
+    a menor.
+    """
+    vistos = set()
+    filas = [
+        {"Clave": str(clave), "Tipo": type(valor).__name__, "Bytes": tamaño_objeto(valor, vistos)}
+        for clave, valor in estado.items()
+    ]
+    df = pd.DataFrame(filas, columns=["Clave", "Tipo", "Bytes"])
+    return df.sort_values("Bytes", ascending=False, ignore_index=True)
+
+
+def registrar(id_sesion: str, bytes_sesion: int) -> None:
+    """
+    Anota el tamaño actual de una sesión en el registro del proceso.
+    """
+    with _bloqueo:
+        _sesiones[id_sesion] = (int(bytes_sesion), time.time())
+
+
+def resumen_servidor(caducidad: float = CADUCIDAD_SEGUNDOS) -> dict:
+    """
+    Sesiones activas (registradas en los últimos 'caducidad' segundos) y sus
+    bytes: total, media y máximo. Olvida las sesiones caducadas.
+    """
+    limite = time.time() - caducidad
+    with _bloqueo:
+        for id_sesion in [s for s, (_, momento) in _sesiones.items() if momento < limite]:
+            del _sesiones[id_sesion]
+        tamaños = [tam for tam, _ in _sesiones.values()]
+    return {
+        "sesiones": len(tamaños),
+        "total": sum(tamaños),
+        "media": sum(tamaños) / len(tamaños) if tamaños else 0,
+        "maximo": max(tamaños, default=0),
+    }
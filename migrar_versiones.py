@@ -0,0 +1,40 @@
+"""
+Migra las versiones guardadas en formatos anteriores (versiones/*/*.pkl, con
+st.session_state completo, y versiones/*/*.npz, con las entradas en un único
+archivo) al formato actual: manifiestos .json sobre el almacén deduplicado.
+
+Uso:
+    python migrar_versiones.py [--carpeta versiones] [--eliminar] [--limpiar]
+"""
+import argparse
+import sys
+
+from versionado import CARPETA_BASE, limpiar_almacen, migrar_versiones
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migra versiones .pkl y .npz al formato de manifiestos (.json).")
+    parser.add_argument("--carpeta", default=CARPETA_BASE, help="Carpeta base de proyectos (por defecto: ./versiones)")
+    parser.add_argument("--eliminar", action="store_true", help="Eliminar los archivos migrados correctamente")
+    parser.add_argument("--limpiar", action="store_true", help="Eliminar del almacén los blobs que no usa ninguna versión")
+    args = parser.parse_args(argv)
+
+    resultados = migrar_versiones(args.carpeta, eliminar=args.eliminar)
+    if args.limpiar:
+        print(f"🧹 {limpiar_almacen(args.carpeta)} blobs sin usar eliminados del almacén.")
+    if not resultados:
+        print("No hay versiones antiguas que migrar.")
+        return 0
+
+    errores = 0
+    for origen, destino, error in resultados:
+        if error is None:
+            print(f"✅ {origen} → {destino}")
+        else:
+            errores += 1
+            print(f"❌ {origen}: {error}", file=sys.stderr)
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
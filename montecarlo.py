@@ -0,0 +1,319 @@
+"""
+Simulación Monte Carlo del ritmo de ventas, los precios y el plazo de obra.
+
+Cada escenario sortea, por vivienda, un retraso de la venta (Poisson, en
+meses) y un descuento sobre el precio (normal truncada) y, por escenario, una
+ampliación del plazo de obra (Poisson). Los escenarios se generan como
+arrays y se evalúan por lotes con escenarios.ModeloEscenarios en una sola
+pasada vectorizada por lote.
+
+Las series mensuales de cada escenario (flujo acumulado, saldo de la cuenta
+especial y necesidades de financiación) y sus indicadores se escriben a disco
+lote a lote como arrays .npy sobre un eje de meses común, de modo que 100.000
+trayectorias no necesitan caber en memoria; las bandas P10/P50/P90 se
+calculan después leyendo esos arrays por bloques de meses.
+
+Por defecto cada simulación va a una carpeta propia dentro de
+CARPETA_SIMULACIONES, que se acota en tamaño: al terminar una simulación se
+borran las más antiguas hasta quedar por debajo de TAM_MAXIMO_BYTES. Solo se
+borran simulaciones terminadas (con el archivo SIMULACION_COMPLETA), nunca
+una que otra sesión está escribiendo o leyendo. Las bandas y los indicadores
+del resultado quedan en memoria; solo las trayectorias completas se pierden
+al borrarse su carpeta.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+import motor
+from escenarios import (
+    DESCUENTO_PRECIO,
+    DESPLAZAMIENTO_VENTAS,
+    METRICAS,
+    ModeloEscenarios,
+)
+
+# Series mensuales que se guardan por escenario
+SERIES = {
+    "flujo_acumulado": "Flujo acumulado (€)",
+    "acumulado_cuenta_especial": "Acumulado cuenta especial (€)",
+    "necesidades": "Total necesidades financiación (€)",
+}
+
+PERCENTILES = (10, 50, 90)
+
+# Escenarios por lote de simulación y meses por bloque al calcular percentiles
+TAM_LOTE = 2048
+MESES_POR_BLOQUE = 16
+
+# Carpeta común de las simulaciones y tamaño máximo que ocupan entre todas
+CARPETA_SIMULACIONES = os.path.join(os.getcwd(), ".simulaciones")
+TAM_MAXIMO_BYTES = 2 * 1024 * 1024 * 1024
+# Marca de simulación terminada (ya no se escribe ni se lee su carpeta) y
+# antigüedad a partir de la cual una sin terminar se da por abandonada
+SIMULACION_COMPLETA = "completa"
+ABANDONADA_SEGUNDOS = 24 * 3600
+
+
+@dataclass
+class SupuestosMontecarlo:
+    """
+    Distribuciones de la simulación. Los retrasos se recortan a
+    retraso_maximo_meses para acotar el horizonte.
+    """
+    retraso_ventas_medio_meses: float = 2.0
+    descuento_medio_pct: float = 3.0
+    descuento_desviacion_pct: float = 2.0
+    ampliacion_plazo_media_meses: float = 1.0
+    retraso_maximo_meses: int = 24
+
+
+@dataclass
+class ResultadoMontecarlo:
+    """
+    Resultado de simular: carpeta con los arrays de cada escenario, bandas
+    mensuales de percentiles de cada serie y percentiles de los indicadores.
+    """
+    carpeta: str
+    num_escenarios: int
+    semilla: int
+    bandas: pd.DataFrame
+    indicadores: pd.DataFrame
+
+
+def sortear(
+    rng: np.random.Generator,
+    supuestos: SupuestosMontecarlo,
+    num_escenarios: int,
+    num_viviendas: int,
+    plazo_base: int,
+) -> dict:
+    """
+    Sortea los cambios de num_escenarios escenarios en el formato de
+    ModeloEscenarios.evaluar.
+    """
+    s = supuestos
+    retrasos = np.minimum(
+        rng.poisson(s.retraso_ventas_medio_meses, (num_escenarios, num_viviendas)), s.retraso_maximo_meses
+    )
+    descuentos = np.clip(
+        rng.normal(s.descuento_medio_pct, s.descuento_desviacion_pct, (num_escenarios, num_viviendas)), 0.0, 100.0
+    )
+    ampliaciones = np.minimum(rng.poisson(s.ampliacion_plazo_media_meses, num_escenarios), s.retraso_maximo_meses)
+    return {
+        DESPLAZAMIENTO_VENTAS: retrasos,
+        DESCUENTO_PRECIO: descuentos,
+        "plazo_obra_meses": plazo_base + ampliaciones,
+    }
+
+
+def _horizonte(modelo: ModeloEscenarios, supuestos: SupuestosMontecarlo):
+    """
+    Eje de meses (primer_mes, num_meses) que contiene cualquier escenario: los
+    sorteos solo retrasan eventos, así que va del primer mes del escenario
+    base al último del escenario con todos los retrasos al máximo.
+    """
+    n = modelo.num_viviendas_vendidas
+    maximo = supuestos.retraso_maximo_meses
+    extremos = modelo.evaluar_series({
+        DESPLAZAMIENTO_VENTAS: np.array([np.zeros(n), np.full(n, maximo)]),
+        "plazo_obra_meses": np.array([modelo.parametros.plazo_obra_meses, modelo.parametros.plazo_obra_meses + maximo]),
+    })
+    return extremos["primer_mes"], extremos["flujo_acumulado"].shape[1]
+
+
+def _al_eje(serie: np.ndarray, primer_mes_serie: int, primer_mes: int, num_meses: int, acumulada: bool) -> np.ndarray:
+    """
+    Sitúa una matriz escenarios x meses en el eje común: ceros antes de su
+    primer mes y, después del último, ceros o el último valor si es acumulada.
+    """
+    salida = np.zeros((serie.shape[0], num_meses), dtype=np.float64)
+    inicio = primer_mes_serie - primer_mes
+    fin = inicio + serie.shape[1]
+    salida[:, inicio:fin] = serie
+    if acumulada and fin < num_meses:
+        salida[:, fin:] = serie[:, -1:]
+    return salida
+
+
+def simular(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    num_escenarios: int,
+    semilla: int = 0,
+    supuestos: SupuestosMontecarlo = None,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+    carpeta: str = None,
+    tam_lote: int = TAM_LOTE,
+) -> ResultadoMontecarlo:
+    """
+    Simula num_escenarios escenarios y escribe en 'carpeta' un .npy por
+    serie (escenarios x meses) y por indicador (un valor por escenario), más
+    meta.json con la semilla, los supuestos y el eje de meses. Sin carpeta se
+    usa una nueva en CARPETA_SIMULACIONES (acotada con expulsar). La misma
+    semilla y el mismo tam_lote reproducen exactamente la simulación.
+    """
+    supuestos = supuestos or SupuestosMontecarlo()
+    if num_escenarios < 1:
+        raise ValueError("El número de escenarios debe ser positivo.")
+    en_comun = carpeta is None
+    if en_comun:
+        os.makedirs(CARPETA_SIMULACIONES, exist_ok=True)
+        carpeta = tempfile.mkdtemp(prefix="montecarlo_", dir=CARPETA_SIMULACIONES)
+    os.makedirs(carpeta, exist_ok=True)
+
+    modelo = ModeloEscenarios(parametros, df_viviendas, df_planificacion, df_capitulos)
+    primer_mes, num_meses = _horizonte(modelo, supuestos)
+
+    series = {
+        nombre: np.lib.format.open_memmap(
+            os.path.join(carpeta, f"{nombre}.npy"), mode="w+", dtype=np.float64, shape=(num_escenarios, num_meses)
+        )
+        for nombre in SERIES
+    }
+    indicadores = {
+        metrica: np.lib.format.open_memmap(
+            os.path.join(carpeta, f"{metrica}.npy"), mode="w+", dtype=np.float64, shape=(num_escenarios,)
+        )
+        for metrica in METRICAS
+    }
+
+    inicios = range(0, num_escenarios, tam_lote)
+    semillas = np.random.SeedSequence(semilla).spawn(len(inicios))
+    for inicio, semilla_lote in zip(inicios, semillas):
+        fin = min(inicio + tam_lote, num_escenarios)
+        cambios = sortear(
+            np.random.default_rng(semilla_lote), supuestos, fin - inicio,
+            modelo.num_viviendas_vendidas, parametros.plazo_obra_meses,
+        )
+        resultado = modelo.evaluar_series(cambios)
+        for nombre in SERIES:
+            series[nombre][inicio:fin] = _al_eje(
+                resultado[nombre], resultado["primer_mes"], primer_mes, num_meses, acumulada=nombre != "necesidades"
+            )
+        for metrica in METRICAS:
+            indicadores[metrica][inicio:fin] = resultado[metrica]
+
+    for array in (*series.values(), *indicadores.values()):
+        array.flush()
+    del series, indicadores
+
+    with open(os.path.join(carpeta, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "semilla": semilla,
+            "num_escenarios": num_escenarios,
+            "tam_lote": tam_lote,
+            "primer_mes": primer_mes,
+            "num_meses": num_meses,
+            "supuestos": asdict(supuestos),
+        }, f, ensure_ascii=False, indent=1)
+
+    resultado = ResultadoMontecarlo(
+        carpeta=carpeta,
+        num_escenarios=num_escenarios,
+        semilla=semilla,
+        bandas=bandas(carpeta),
+        indicadores=percentiles_indicadores(carpeta),
+    )
+    if en_comun:
+        open(os.path.join(carpeta, SIMULACION_COMPLETA), "w").close()
+        expulsar(conservar=carpeta)
+    return resultado
+
+
+def _tamaño_carpeta(carpeta: str) -> int:
+    total = 0
+    for nombre in os.listdir(carpeta):
+        try:
+            total += os.path.getsize(os.path.join(carpeta, nombre))
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def expulsar(carpeta: str = None, tam_maximo: int = None, conservar: str = None) -> int:
+    """
+    Borra las simulaciones terminadas de la carpeta común, empezando por las
+    más antiguas, hasta que ocupen como mucho tam_maximo bytes (por defecto
+    TAM_MAXIMO_BYTES), salvo la carpeta 'conservar'. Las que están en curso
+    no se borran; las que llevan más de ABANDONADA_SEGUNDOS sin terminar, sí.
+    Devuelve el número de simulaciones borradas.
+    """
+    carpeta = carpeta or CARPETA_SIMULACIONES
+    tam_maximo = TAM_MAXIMO_BYTES if tam_maximo is None else tam_maximo
+    try:
+        nombres = os.listdir(carpeta)
+    except FileNotFoundError:
+        return 0
+    limite_abandonadas = time.time() - ABANDONADA_SEGUNDOS
+    simulaciones = []
+    total = 0
+    for nombre in nombres:
+        ruta = os.path.join(carpeta, nombre)
+        try:
+            if not os.path.isdir(ruta):
+                continue
+            tam = _tamaño_carpeta(ruta)
+            total += tam
+            marca = os.path.join(ruta, SIMULACION_COMPLETA)
+            if os.path.isfile(marca):
+                simulaciones.append((os.path.getmtime(marca), tam, ruta))
+            elif os.path.getmtime(ruta) < limite_abandonadas:
+                simulaciones.append((os.path.getmtime(ruta), tam, ruta))
+        except FileNotFoundError:
+            continue
+    borradas = 0
+    for _, tam, ruta in sorted(simulaciones):
+        if total <= tam_maximo:
+            break
+        if conservar is not None and os.path.abspath(ruta) == os.path.abspath(conservar):
+            continue
+        shutil.rmtree(ruta, ignore_errors=True)
+        total -= tam
+        borradas += 1
+    return borradas
+
+
+def _leer_meta(carpeta: str) -> dict:
+    with open(os.path.join(carpeta, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def bandas(carpeta: str, percentiles=PERCENTILES) -> pd.DataFrame:
+    """
+    Percentiles mensuales de cada serie de una simulación guardada: columna
+    'Mes' y '<serie> P<n>' para cada serie y percentil. Lee los arrays por
+    bloques de meses.
+    """
+    meta = _leer_meta(carpeta)
+    df = pd.DataFrame({"Mes": motor.etiquetas_mes(meta["primer_mes"], meta["num_meses"])})
+    for nombre, etiqueta in SERIES.items():
+        datos = np.load(os.path.join(carpeta, f"{nombre}.npy"), mmap_mode="r")
+        valores = np.empty((len(percentiles), datos.shape[1]), dtype=np.float64)
+        for inicio in range(0, datos.shape[1], MESES_POR_BLOQUE):
+            bloque = np.asarray(datos[:, inicio:inicio + MESES_POR_BLOQUE])
+            valores[:, inicio:inicio + MESES_POR_BLOQUE] = np.percentile(bloque, percentiles, axis=0)
+        for fila, percentil in enumerate(percentiles):
+            df[f"{etiqueta} P{percentil}"] = valores[fila]
+    return df
+
+
+def percentiles_indicadores(carpeta: str, percentiles=PERCENTILES) -> pd.DataFrame:
+    """
+    Percentiles de cada indicador de una simulación guardada: una fila por
+    indicador y una columna por percentil.
+    """
+    filas = []
+    for metrica, etiqueta in METRICAS.items():
+        valores = np.load(os.path.join(carpeta, f"{metrica}.npy"), mmap_mode="r")
+        fila = {"Indicador": etiqueta}
+        fila.update({f"P{p}": v for p, v in zip(percentiles, np.percentile(valores, percentiles))})
+        filas.append(fila)
+    return pd.DataFrame(filas)
@@ -0,0 +1,1064 @@
+"""
+Motor de cálculo del flujo de caja de la promoción.
+
+Contiene todos los cálculos que antes vivían dentro de las pestañas de
+streamlit_app.py (ingresos, comisiones, cronograma de ejecución, otros costes,
+cuenta especial, necesidades de financiación y cuenta de resultados) como
+funciones puras sobre DataFrames y escalares. No importa Streamlit ni Plotly,
+de modo que puede llamarse desde procesos por lotes, barridos de escenarios o
+pruebas sin renderizar la interfaz.
+"""
+from dataclasses import dataclass, field, asdict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional: sin él se usa el recorrido con NumPy
+    njit = None
+
+
+# Pesos por defecto de cada capítulo sobre el coste de ejecución (%)
+PESOS_DEFECTO = {
+    'Actuaciones previas': 0.0008,
+    'Demoliciones': 0.03554,
+    'Acondicionamiento del terreno': 2.43289,
+    'Cimentaciones': 2.36372,
+    'Estructuras': 10.64831,
+    'Fachadas y particiones': 8.71951,
+    'Carpintería, cerrajería, vidrios y protecciones solares': 9.88736,
+    'Remates y ayudas': 1.11051,
+    'Instalaciones': 17.93712,
+    'Aislamientos e impermeabilizaciones': 1.36965,
+    'Cubiertas': 3.1591,
+    'Revestimientos y trasdosados': 19.7394,
+    'Señalización y equipamiento': 6.44508,
+    'Urbanización interior de la parcela': 14.79113,
+    'Gestión de residuos': 1.03846,
+    'Control de calidad y ensayos': 0.05725,
+    'Seguridad y salud': 0.26417
+}
+
+# Planificación por defecto basada en cronograma.csv (meses desde inicio de obra)
+FECHAS_INICIO_RELATIVAS = {
+    'Actuaciones previas': 0,
+    'Demoliciones': 0,
+    'Acondicionamiento del terreno': 0,
+    'Cimentaciones': 2,
+    'Estructuras': 4,
+    'Fachadas y particiones': 8,
+    'Carpintería, cerrajería, vidrios y protecciones solares': 10,
+    'Remates y ayudas': 12,
+    'Instalaciones': 10,
+    'Aislamientos e impermeabilizaciones': 4,
+    'Cubiertas': 6,
+    'Revestimientos y trasdosados': 12,
+    'Señalización y equipamiento': 15,
+    'Urbanización interior de la parcela': 13,
+    'Gestión de residuos': 0,
+    'Control de calidad y ensayos': 14,
+    'Seguridad y salud': 0
+}
+
+DURACIONES_DEFECTO = {
+    'Actuaciones previas': 3,
+    'Demoliciones': 3,
+    'Acondicionamiento del terreno': 3,
+    'Cimentaciones': 4,
+    'Estructuras': 4,
+    'Fachadas y particiones': 4,
+    'Carpintería, cerrajería, vidrios y protecciones solares': 5,
+    'Remates y ayudas': 6,
+    'Instalaciones': 6,
+    'Aislamientos e impermeabilizaciones': 3,
+    'Cubiertas': 2,
+    'Revestimientos y trasdosados': 5,
+    'Señalización y equipamiento': 2,
+    'Urbanización interior de la parcela': 4,
+    'Gestión de residuos': 17,
+    'Control de calidad y ensayos': 5,
+    'Seguridad y salud': 17
+}
+
+COLUMNAS_INGRESOS = ["Reserva (€)", "Contrato (€)", "Aplazado (€)", "Escritura (€)"]
+
+COLUMNAS_OTROS_COSTES = [
+    "Coste suelo (€)",
+    "Honorarios técnicos (€)",
+    "Gastos administración (€)",
+    "Costes financieros (€)",
+]
+
+COLUMNAS_RESUMEN_FLUJO = [
+    "Mes",
+    "Ingresos netos (€)",
+    "Coste ejecución (€)",
+    "Total otros costes (€)",
+    "Flujo mensual total (€)",
+    "Flujo acumulado (€)",
+    "Ingreso cuenta especial (€)",
+    "Gasto cuenta especial (€)",
+    "Flujo cuenta especial (€)",
+    "Acumulado cuenta especial (€)",
+    "Déficit cuenta especial (€)"
+]
+
+COLUMNAS_NECESIDADES = [
+    "Coste suelo (€)",
+    "Honorarios técnicos (€)",
+    "Gastos administración (€)",
+    "Costes financieros (€)",
+    "Comisiones pre-escritura (€)",
+    "Déficit cuenta especial (€)"
+]
+
+
+@dataclass
+class ParametrosProyecto:
+    """
+    Valores escalares de entrada del modelo (los widgets de las pestañas
+    'Inputs Generales' e 'Ingresos y Comisiones'), con los mismos valores por
+    defecto que la interfaz.
+    """
+    num_viviendas: int = 20
+    superficie_total: float = 2000.0
+    precio_medio_venta: float = 350000.0
+    coste_suelo: float = 300000.0
+    coste_ejecucion_m2: float = 1600.0
+    comisiones_venta: float = 15.0
+    porcentaje_honorarios: float = 5.0
+    porcentaje_admin: float = 4.0
+    gastos_financieros: float = 5000.0
+    iva_venta: float = 10.0
+    iva_ejecucion: float = 0.0
+    iva_otros: float = 21.0
+    fecha_inicio_obra: date = field(default_factory=date.today)
+    fecha_inicio_comercializacion: date = field(default_factory=date.today)
+    plazo_obra_meses: int = 18
+    reserva_fija: float = 10000.0
+    pct_contrato: float = 25.0
+    pct_aplazado: float = 25.0
+
+    @property
+    def fecha_fin_obra(self) -> date:
+        return self.fecha_inicio_obra + relativedelta(months=self.plazo_obra_meses)
+
+    @property
+    def fecha_entrega_viviendas(self) -> date:
+        return self.fecha_fin_obra + relativedelta(months=3)
+
+    @property
+    def coste_total_ejecucion(self) -> float:
+        return self.superficie_total * self.coste_ejecucion_m2
+
+    def como_dict(self) -> dict:
+        return asdict(self)
+
+
+def fechas_proyecto(fecha_inicio_obra: date, plazo_obra_meses: int):
+    """
+    Devuelve (fecha_fin_obra, fecha_entrega_viviendas). La entrega se fija
+    tres meses después del fin de obra.
+    """
+    fecha_fin_obra = fecha_inicio_obra + relativedelta(months=plazo_obra_meses)
+    fecha_entrega_viviendas = fecha_fin_obra + relativedelta(months=3)
+    return fecha_fin_obra, fecha_entrega_viviendas
+
+
+# ---------------------------------------------------------------------------
+# Meses como índices enteros
+# ---------------------------------------------------------------------------
+
+def indice_mes(fecha) -> int:
+    """
+    Índice entero del mes de una fecha (año * 12 + mes - 1). Dos fechas del
+    mismo mes tienen el mismo índice y sumar n meses equivale a sumar n.
+    """
+    return fecha.year * 12 + fecha.month - 1
+
+
+def indices_mes(fechas) -> np.ndarray:
+    """
+    Versión vectorizada de indice_mes para una serie o array de fechas
+    (datetime64). Los NaT deben filtrarse antes.
+    """
+    meses = np.asarray(fechas).astype("datetime64[M]")
+    return meses.astype(np.int64) + 1970 * 12
+
+
+def etiquetas_mes(primer_mes: int, num_meses: int) -> list:
+    """
+    Etiquetas 'YYYY-MM' de num_meses meses consecutivos desde primer_mes.
+    """
+    return [f"{m // 12:04d}-{m % 12 + 1:02d}" for m in range(primer_mes, primer_mes + num_meses)]
+
+
+def mes_desde_etiqueta(etiqueta: str) -> int:
+    """
+    Índice de mes de una etiqueta 'YYYY-MM' (inversa de etiquetas_mes).
+    """
+    año, mes = str(etiqueta).split("-")[:2]
+    return int(año) * 12 + int(mes) - 1
+
+
+def rango_tabla(df: pd.DataFrame):
+    """
+    (primer_mes, num_meses) de una tabla mensual densa de este módulo (un mes
+    por fila, consecutivos, en la columna o el índice 'Mes'). Solo se leen la
+    primera y la última etiqueta.
+    """
+    meses = df["Mes"].to_numpy() if "Mes" in df.columns else df.index.to_numpy()
+    if len(meses) == 0:
+        return 0, 0
+    primer_mes = mes_desde_etiqueta(meses[0])
+    if mes_desde_etiqueta(meses[-1]) - primer_mes + 1 != len(meses):
+        raise ValueError("La tabla mensual no tiene un mes por fila consecutivo.")
+    return primer_mes, len(meses)
+
+
+def calendario(*rangos):
+    """
+    Calendario del proyecto: (primer_mes, num_meses) del tramo continuo de
+    meses que contiene todos los rangos (primer_mes, num_meses) indicados,
+    desde el primer evento hasta el último. Los rangos vacíos se ignoran.
+    """
+    rangos = [(primer_mes, num_meses) for primer_mes, num_meses in rangos if num_meses > 0]
+    if not rangos:
+        return 0, 0
+    primer_mes = min(primer for primer, _ in rangos)
+    fin = max(primer + num for primer, num in rangos)
+    return primer_mes, fin - primer_mes
+
+
+def alinear(valores, primer_mes_serie: int, primer_mes: int, num_meses: int) -> np.ndarray:
+    """
+    Sitúa una serie mensual (o una matriz filas x meses) que empieza en
+    primer_mes_serie sobre el calendario (primer_mes, num_meses), con ceros
+    en los meses sin datos. El calendario debe contener la serie.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    salida = np.zeros(valores.shape[:-1] + (num_meses,), dtype=np.float64)
+    inicio = primer_mes_serie - primer_mes
+    salida[..., inicio:inicio + valores.shape[-1]] = valores
+    return salida
+
+
+def como_fechas(serie: pd.Series) -> pd.Series:
+    """
+    Convierte una columna a datetime64 (día primero) sin volver a parsear si
+    ya lo es.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    return pd.to_datetime(serie, dayfirst=True, errors="coerce")
+
+
+def rango_meses(fecha_inicio: date, fecha_fin: date):
+    """
+    Devuelve (primer_mes, num_meses) de la serie mensual que empieza en
+    fecha_inicio y avanza de mes en mes mientras no supere fecha_fin (el día
+    se ajusta a fin de mes igual que con relativedelta).
+    """
+    num_meses = 0
+    fecha_iter = fecha_inicio
+    while fecha_iter <= fecha_fin:
+        num_meses += 1
+        fecha_iter += relativedelta(months=1)
+    return indice_mes(fecha_inicio), num_meses
+
+
+# ---------------------------------------------------------------------------
+# Viviendas
+# ---------------------------------------------------------------------------
+
+def preparar_viviendas(df_viviendas: pd.DataFrame, fecha_entrega_viviendas: date) -> pd.DataFrame:
+    """
+    Normaliza una tabla de viviendas pegada desde Excel: detecta las columnas
+    Código, Precio, Fecha venta y Fecha escrituración (flexible a variaciones
+    en la cabecera), convierte las fechas y asigna la fecha de entrega cuando
+    no hay escrituración. Lanza ValueError si faltan columnas obligatorias.
+    Las filas sin precio válido se descartan; ingesta.normalizar_viviendas
+    devuelve además el informe de filas erróneas.
+    """
+    import ingesta
+
+    return ingesta.normalizar_viviendas(df_viviendas, fecha_entrega_viviendas).viviendas
+
+
+def ventas_por_mes(df_viviendas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Número de viviendas vendidas por mes ('YYYY-MM'), solo los meses con ventas.
+    """
+    fechas_venta = como_fechas(df_viviendas["Fecha venta"]).to_numpy(dtype="datetime64[ns]")
+    meses, vendidas = np.unique(indices_mes(fechas_venta[~np.isnat(fechas_venta)]), return_counts=True)
+    return pd.DataFrame({
+        "Mes": [etiquetas_mes(int(m), 1)[0] for m in meses],
+        "Viviendas vendidas": vendidas,
+    })
+
+
+# ---------------------------------------------------------------------------
+# Ingresos y comisiones
+# ---------------------------------------------------------------------------
+
+def calcular_ingresos(
+    df_viviendas: pd.DataFrame,
+    fecha_entrega_viviendas: date,
+    reserva_fija: float,
+    pct_contrato: float,
+    pct_aplazado: float,
+    iva_venta: float,
+    comisiones_venta: float,
+    iva_otros: float,
+) -> pd.DataFrame:
+    """
+    Cronograma mensual de ingresos por fase de pago (reserva en el mes de
+    venta, contrato +1, aplazado +3 y escritura en la fecha de escrituración o
+    de entrega) y comisiones sobre el ingreso sin IVA.
+    """
+    primer_mes, importes = cronograma_ingresos(
+        df_viviendas,
+        fecha_entrega_viviendas,
+        reserva_fija,
+        pct_contrato,
+        pct_aplazado,
+        iva_venta,
+    )
+    reserva, contrato, aplazado, escritura = importes
+
+    total_con_iva = reserva + contrato + aplazado + escritura
+    total_sin_iva = total_con_iva / (1 + iva_venta / 100)
+    comisiones = -(total_sin_iva * (comisiones_venta / 100) * (1 + iva_otros / 100))
+    neto = total_con_iva + comisiones
+
+    df = pd.DataFrame({
+        "Mes": etiquetas_mes(primer_mes, importes.shape[1]),
+        "Reserva (€)": reserva,
+        "Contrato (€)": contrato,
+        "Aplazado (€)": aplazado,
+        "Escritura (€)": escritura,
+        "Comisiones (€)": comisiones,
+        "Total ingresos (€)": total_con_iva,
+        "Ingresos netos (€)": neto,
+    })
+    df["Acumulado"] = df["Total ingresos (€)"].cumsum()
+    return df
+
+
+def cronograma_ingresos(
+    df_viviendas: pd.DataFrame,
+    fecha_entrega_viviendas: date,
+    reserva_fija: float,
+    pct_contrato: float,
+    pct_aplazado: float,
+    iva_venta: float,
+):
+    """
+    Núcleo vectorizado del cronograma de ingresos: acumula por mes con
+    np.bincount los pagos de cada vivienda (ver pagos_ingresos). Devuelve
+    (primer_mes, importes), donde importes es una matriz 4 x meses con las
+    filas de COLUMNAS_INGRESOS.
+    """
+    pagos = pagos_ingresos(df_viviendas, fecha_entrega_viviendas, reserva_fija, pct_contrato, pct_aplazado, iva_venta)
+    primer_mes, num_meses = pagos["primer_mes"], pagos["num_meses"]
+    importes = np.zeros((len(COLUMNAS_INGRESOS), num_meses), dtype=np.float64)
+    for fila, (mes, importe) in enumerate(zip(pagos["meses"], pagos["importes"])):
+        importes[fila] = np.bincount(mes - primer_mes, weights=importe, minlength=num_meses)
+    return primer_mes, importes
+
+
+def horizonte_ingresos(fechas_venta: np.ndarray, fechas_escritura: np.ndarray, fecha_entrega_viviendas: date):
+    """
+    (primer_mes, num_meses) del horizonte de ingresos antes de ampliarlo con
+    los pagos (ver pagos_ingresos): con rango_meses desde la primera fecha de
+    venta (o la entrega, si no hay ventas) hasta tres meses después de la
+    última escrituración (o entrega). Las fechas, como datetime64[ns].
+    """
+    entrega = np.datetime64(fecha_entrega_viviendas, "ns")
+    con_venta = ~np.isnat(fechas_venta)
+    fecha_min = pd.Timestamp(fechas_venta[con_venta].min()).date() if con_venta.any() else fecha_entrega_viviendas
+    fecha_max = pd.Timestamp(np.where(np.isnat(fechas_escritura), entrega, fechas_escritura).max()).date() + relativedelta(months=3)
+    return rango_meses(fecha_min, fecha_max)
+
+
+def pagos_ingresos(
+    df_viviendas: pd.DataFrame,
+    fecha_entrega_viviendas: date,
+    reserva_fija: float,
+    pct_contrato: float,
+    pct_aplazado: float,
+    iva_venta: float,
+) -> dict:
+    """
+    Pagos de cada vivienda vendida por fase: índice de mes e importe de la
+    reserva (mes de venta), contrato (+1), aplazado (+3 desde contrato) y
+    escritura (en su fecha o en la entrega). Devuelve un diccionario con
+    'filas' (posición en df_viviendas de cada vivienda con fecha de venta),
+    'meses' e 'importes' (matrices 4 x viviendas con las filas de
+    COLUMNAS_INGRESOS) y el horizonte 'primer_mes' / 'num_meses'.
+
+    El horizonte va desde el mes de la primera venta hasta tres meses después
+    de la última escrituración (o entrega), ampliado si algún pago cae fuera.
+    Las viviendas sin fecha de venta no generan pagos.
+    """
+    fechas_venta = como_fechas(df_viviendas["Fecha venta"]).to_numpy(dtype="datetime64[ns]")
+    fechas_escritura = como_fechas(df_viviendas["Fecha escrituración"]).to_numpy(dtype="datetime64[ns]")
+    entrega = np.datetime64(fecha_entrega_viviendas, "ns")
+
+    con_venta = ~np.isnat(fechas_venta)
+    primer_mes, num_meses = horizonte_ingresos(fechas_venta, fechas_escritura, fecha_entrega_viviendas)
+
+    fechas_venta = fechas_venta[con_venta]
+    fechas_escritura = fechas_escritura[con_venta]
+    precios = df_viviendas["Precio"].to_numpy(dtype=np.float64)[con_venta]
+
+    # Importes por vivienda
+    precio_con_iva = precios * (1 + iva_venta / 100)
+    restante = precio_con_iva - reserva_fija
+    importe_contrato = precio_con_iva * pct_contrato / 100
+    importe_aplazado = precio_con_iva * pct_aplazado / 100
+    importe_escritura = restante - importe_contrato - importe_aplazado
+    importe_reserva = np.full(len(precios), reserva_fija, dtype=np.float64)
+
+    # Meses de cada fase: reserva en la venta, contrato +1, aplazado +3 desde
+    # contrato y escritura en su fecha (o en la entrega si no la hay). Si la
+    # vivienda se vende ya terminada, escritura en la entrega o al mes siguiente.
+    mes_reserva = indices_mes(fechas_venta)
+    mes_contrato = mes_reserva + 1
+    mes_aplazado = mes_contrato + 3
+    mes_entrega = indice_mes(fecha_entrega_viviendas)
+    terminada = fechas_venta.astype("datetime64[D]") >= entrega
+    mes_escritura = np.full(len(precios), mes_entrega, dtype=np.int64)
+    con_escritura = ~np.isnat(fechas_escritura)
+    mes_escritura[con_escritura] = indices_mes(fechas_escritura[con_escritura])
+    mes_escritura = np.where(terminada, np.maximum(mes_entrega, mes_contrato), mes_escritura)
+
+    meses = np.array([mes_reserva, mes_contrato, mes_aplazado, mes_escritura], dtype=np.int64).reshape(4, len(precios))
+    importes = np.array([importe_reserva, importe_contrato, importe_aplazado, importe_escritura], dtype=np.float64).reshape(4, len(precios))
+
+    if len(precios):
+        ultimo_mes = max(primer_mes + num_meses - 1, int(meses.max()))
+        primer_mes = min(primer_mes, int(meses.min()))
+        num_meses = ultimo_mes - primer_mes + 1
+
+    return {
+        "filas": np.flatnonzero(con_venta),
+        "meses": meses,
+        "importes": importes,
+        "primer_mes": primer_mes,
+        "num_meses": num_meses,
+    }
+
+
+def ingresos_acumulados(df_ingresos: pd.DataFrame) -> pd.DataFrame:
+    """
+    Acumulado por conceptos de la tabla de ingresos.
+    """
+    df_acumulado = df_ingresos.copy()
+    for col in ["Reserva (€)", "Contrato (€)", "Aplazado (€)", "Escritura (€)", "Comisiones (€)", "Total ingresos (€)", "Ingresos netos (€)"]:
+        df_acumulado[f"{col[:-4]} acumulado (€)"] = df_acumulado[col].cumsum()
+    columnas = ["Mes"] + [c for c in df_acumulado.columns if "acumulado" in c]
+    return df_acumulado[columnas]
+
+
+# ---------------------------------------------------------------------------
+# Costes de ejecución
+# ---------------------------------------------------------------------------
+
+def capitulos_por_defecto(coste_total_ejecucion: float) -> pd.DataFrame:
+    """
+    Tabla de capítulos con los pesos por defecto y su coste ajustado.
+    """
+    df_capitulos = pd.DataFrame({
+        "Capítulo": list(PESOS_DEFECTO.keys()),
+        "Peso (%)": list(PESOS_DEFECTO.values())
+    })
+    df_capitulos["Coste ejecución ajustado (€)"] = -round(df_capitulos["Peso (%)"] * coste_total_ejecucion / 100, 2)
+    return df_capitulos
+
+
+def capitulos_desde_pesos(df_pesos: pd.DataFrame, coste_total_ejecucion: float) -> pd.DataFrame:
+    """
+    Tabla de capítulos a partir de 'Capítulo' y 'Peso (%)' guardados, con el
+    coste ajustado al coste total de ejecución actual.
+    """
+    df_capitulos = df_pesos[["Capítulo", "Peso (%)"]].copy()
+    df_capitulos["Coste ejecución ajustado (€)"] = -round(df_capitulos["Peso (%)"] * coste_total_ejecucion / 100, 2)
+    return df_capitulos
+
+
+def capitulos_desde_importes(df_csv: pd.DataFrame, coste_total_ejecucion: float) -> pd.DataFrame:
+    """
+    Convierte una tabla 'Capítulo' + importe (segunda columna) en pesos sobre
+    el total y coste ajustado al coste total de ejecución.
+    """
+    df_csv = df_csv.copy()
+    columna_importe = df_csv.columns[1]
+    df_csv[columna_importe] = df_csv[columna_importe].astype(str).str.replace(",", ".").astype(float)
+    df_csv = df_csv.rename(columns={columna_importe: "Importe"})
+    df_csv["Peso (%)"] = df_csv["Importe"] / df_csv["Importe"].sum() * 100
+    df_csv["Coste ejecución ajustado (€)"] = -round(df_csv["Peso (%)"] * coste_total_ejecucion / 100, 2)
+    return df_csv[["Capítulo", "Peso (%)", "Coste ejecución ajustado (€)"]]
+
+
+def planificacion_por_defecto(df_capitulos: pd.DataFrame, fecha_inicio_obra: date) -> pd.DataFrame:
+    """
+    Inicio y duración por capítulo según la planificación por defecto. Los
+    capítulos desconocidos empiezan en el mes igual a su posición y duran 6 meses.
+    """
+    planificacion = []
+    for i, row in df_capitulos.iterrows():
+        capitulo = row["Capítulo"]
+        offset_meses = FECHAS_INICIO_RELATIVAS.get(capitulo, i)
+        inicio = fecha_inicio_obra + relativedelta(months=offset_meses)
+        duracion = DURACIONES_DEFECTO.get(capitulo, 6)
+        planificacion.append({
+            "Capítulo": capitulo,
+            "Inicio": inicio,
+            "Duración (meses)": duracion
+        })
+    return pd.DataFrame(planificacion)
+
+
+def calcular_cronograma(
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+    coste_total_ejecucion: float,
+) -> pd.DataFrame:
+    """
+    Cronograma económico mensual de ejecución: el coste de cada capítulo se
+    reparte a partes iguales entre los meses de su duración. Devuelve una
+    tabla indexada por 'Mes' con una columna por capítulo y el total mensual.
+    """
+    primer_mes, capitulos, matriz = cronograma_ejecucion(df_planificacion, df_capitulos, coste_total_ejecucion)
+
+    df_cronograma = pd.DataFrame(
+        matriz.T,
+        index=pd.Index(etiquetas_mes(primer_mes, matriz.shape[1]), name="Mes"),
+        columns=capitulos,
+    )
+    df_cronograma["Total mensual (€)"] = matriz.sum(axis=0)
+    return df_cronograma
+
+
+def cronograma_ejecucion(
+    df_planificacion: pd.DataFrame,
+    df_capitulos: pd.DataFrame,
+    coste_total_ejecucion: float,
+):
+    """
+    Núcleo matricial del cronograma de ejecución. Devuelve (primer_mes,
+    capitulos, matriz), donde matriz es un array capítulos x meses con el
+    coste mensual de cada capítulo; el total mensual es matriz.sum(axis=0) y
+    cada fila es el cronograma de un capítulo.
+
+    El coste mensual de un capítulo es su coste total (redondeado a céntimos)
+    dividido entre su duración, también redondeado. El horizonte es continuo
+    desde el mes del primer inicio hasta el último mes con coste (los meses
+    intermedios sin coste aparecen con cero). Las filas sin capítulo, inicio o
+    duración se ignoran; los capítulos sin peso cuestan cero. Si un capítulo
+    aparece varias veces, sus filas se suman.
+    """
+    # Unimos planificación con pesos para obtener el % de cada capítulo
+    df_merge = pd.merge(df_planificacion, df_capitulos[["Capítulo", "Peso (%)"]], on="Capítulo", how="left")
+    df_merge = df_merge.dropna(subset=["Capítulo", "Inicio", "Duración (meses)"])
+
+    inicios = pd.to_datetime(df_merge["Inicio"]).to_numpy(dtype="datetime64[D]")
+    duraciones = df_merge["Duración (meses)"].to_numpy().astype(np.int64)
+    coste_total = -np.round(df_merge["Peso (%)"].to_numpy(dtype=np.float64) / 100 * coste_total_ejecucion, 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # round() de Python (redondeo decimal exacto), no np.round
+        coste_mensual = np.array([round(c, 2) for c in (coste_total / duraciones).tolist()], dtype=np.float64)
+
+    codigos, capitulos = pd.factorize(df_merge["Capítulo"])
+    if len(inicios) == 0:
+        return 0, list(capitulos), np.zeros((0, 0), dtype=np.float64)
+
+    # Horizonte denso desde el primer inicio hasta el último mes con coste
+    meses_inicio = indices_mes(inicios)
+    primer_mes = int(meses_inicio.min())
+    num_meses = max(int((meses_inicio + duraciones).max()) - primer_mes, 0)
+
+    # Matriz filas x meses: cada fila ocupa los meses [desplazamiento, desplazamiento + duración)
+    desplazamientos = meses_inicio - primer_mes
+    meses = np.arange(num_meses)
+    activo = (meses >= desplazamientos[:, None]) & (meses < (desplazamientos + duraciones)[:, None])
+    matriz_filas = np.where(activo, coste_mensual[:, None], 0.0)
+    matriz_filas[np.isnan(matriz_filas)] = 0.0
+
+    if len(capitulos) == len(codigos):
+        matriz = matriz_filas
+    else:
+        matriz = np.zeros((len(capitulos), num_meses), dtype=np.float64)
+        np.add.at(matriz, codigos, matriz_filas)
+    return primer_mes, list(capitulos), matriz
+
+
+# ---------------------------------------------------------------------------
+# Otros costes
+# ---------------------------------------------------------------------------
+
+def calcular_otros_costes(
+    df_viviendas,
+    fecha_inicio_obra: date,
+    fecha_inicio_comercializacion: date,
+    plazo_obra_meses: int,
+    coste_suelo: float,
+    coste_total_ejecucion: float,
+    porcentaje_honorarios: float,
+    porcentaje_admin: float,
+    gastos_financieros: float,
+) -> dict:
+    """
+    Costes no ejecutivos por mes: suelo, honorarios técnicos, gastos de
+    administración y costes financieros. Devuelve un diccionario con la tabla
+    de cada concepto ('suelo', 'honorarios', 'admin', 'financieros'), con los
+    meses en que tiene pagos, y el consolidado ('total'), con un mes por fila
+    desde el primer pago hasta el último.
+    """
+    primer_mes, matriz, eventos = cronograma_otros_costes(
+        df_viviendas,
+        fecha_inicio_obra,
+        fecha_inicio_comercializacion,
+        plazo_obra_meses,
+        coste_suelo,
+        coste_total_ejecucion,
+        porcentaje_honorarios,
+        porcentaje_admin,
+        gastos_financieros,
+    )
+    num_meses = matriz.shape[1]
+    etiquetas = np.array(etiquetas_mes(primer_mes, num_meses), dtype=object)
+
+    tablas = {}
+    for clave, columna, fila, con_pago in zip(("suelo", "honorarios", "admin", "financieros"), COLUMNAS_OTROS_COSTES, matriz, eventos):
+        tablas[clave] = pd.DataFrame({"Mes": etiquetas[con_pago], columna: fila[con_pago]}, columns=["Mes", columna])
+
+    # Consolidación: suma de las filas sobre el mismo eje de meses
+    df_total_costes = pd.DataFrame(dict(zip(COLUMNAS_OTROS_COSTES, matriz)))
+    df_total_costes.insert(0, "Mes", etiquetas)
+    total = matriz.sum(axis=0)
+    df_total_costes["Total otros costes (€)"] = total
+    df_total_costes["Total otros costes acumulado (€)"] = np.cumsum(total)
+    tablas["total"] = df_total_costes
+    return tablas
+
+
+def cronograma_otros_costes(
+    df_viviendas,
+    fecha_inicio_obra: date,
+    fecha_inicio_comercializacion: date,
+    plazo_obra_meses: int,
+    coste_suelo: float,
+    coste_total_ejecucion: float,
+    porcentaje_honorarios: float,
+    porcentaje_admin: float,
+    gastos_financieros: float,
+):
+    """
+    Núcleo vectorizado de los costes no ejecutivos. Devuelve (primer_mes,
+    matriz, eventos): matriz es un array 4 x meses con las filas de
+    COLUMNAS_OTROS_COSTES y eventos, una máscara de la misma forma con los
+    meses en que cada concepto tiene algún pago. El eje va del primer pago al
+    último.
+
+    - Suelo: al inicio de la comercialización.
+    - Honorarios técnicos: 50% al inicio de obra, 20% repartido durante la
+      obra y 30% al final.
+    - Administración: 50% al inicio de obra y 50% en la entrega (fin de obra
+      más tres meses).
+    - Costes financieros: por vivienda vendida, en el mes del contrato (el
+      siguiente a la venta).
+    """
+    pagos = pagos_otros_costes(
+        df_viviendas,
+        fecha_inicio_obra,
+        fecha_inicio_comercializacion,
+        plazo_obra_meses,
+        coste_suelo,
+        coste_total_ejecucion,
+        porcentaje_honorarios,
+        porcentaje_admin,
+        gastos_financieros,
+    )
+    todos = np.concatenate([meses for meses, _, _ in pagos])
+    primer_mes = int(todos.min())
+    num_meses = int(todos.max()) - primer_mes + 1
+    matriz = np.zeros((len(pagos), num_meses), dtype=np.float64)
+    eventos = np.zeros((len(pagos), num_meses), dtype=bool)
+    for fila, (meses, importes, _) in enumerate(pagos):
+        matriz[fila] = np.bincount(meses - primer_mes, weights=importes, minlength=num_meses)
+        eventos[fila, meses - primer_mes] = True
+    return primer_mes, matriz, eventos
+
+
+def pagos_otros_costes(
+    df_viviendas,
+    fecha_inicio_obra: date,
+    fecha_inicio_comercializacion: date,
+    plazo_obra_meses: int,
+    coste_suelo: float,
+    coste_total_ejecucion: float,
+    porcentaje_honorarios: float,
+    porcentaje_admin: float,
+    gastos_financieros: float,
+) -> tuple:
+    """
+    Pagos de cada concepto de COLUMNAS_OTROS_COSTES como (meses, importes,
+    filas), en el orden en que se suman; filas es la posición en df_viviendas
+    de la vivienda de cada coste financiero y None en el resto de conceptos.
+    """
+    mes_inicio_obra = indice_mes(fecha_inicio_obra)
+    mes_fin_obra = mes_inicio_obra + plazo_obra_meses
+    mes_entrega = mes_fin_obra + 3
+
+    importe_total_honorarios = -(porcentaje_honorarios / 100 * coste_total_ejecucion)
+    total_admin = -(porcentaje_admin / 100 * coste_total_ejecucion)
+    mensual_durante_obra = (importe_total_honorarios * 0.20) / plazo_obra_meses if plazo_obra_meses else 0.0
+
+    if df_viviendas is not None:
+        fechas_venta = como_fechas(df_viviendas["Fecha venta"]).to_numpy(dtype="datetime64[ns]")
+        filas_vendidas = np.flatnonzero(~np.isnat(fechas_venta))
+        meses_contrato = indices_mes(fechas_venta[filas_vendidas]) + 1
+    else:
+        filas_vendidas = meses_contrato = np.zeros(0, dtype=np.int64)
+
+    return (
+        (np.array([indice_mes(fecha_inicio_comercializacion)]), np.array([-coste_suelo]), None),
+        (
+            np.concatenate([mes_inicio_obra + np.arange(plazo_obra_meses), [mes_inicio_obra, mes_fin_obra]]),
+            np.concatenate([np.full(plazo_obra_meses, mensual_durante_obra), [importe_total_honorarios * 0.50, importe_total_honorarios * 0.30]]),
+            None,
+        ),
+        (np.array([mes_inicio_obra, mes_entrega]), np.array([total_admin * 0.5, total_admin * 0.5]), None),
+        (meses_contrato, np.full(len(meses_contrato), -gastos_financieros, dtype=np.float64), filas_vendidas),
+    )
+
+
+
+# ---------------------------------------------------------------------------
+# Flujo de caja, cuenta especial y necesidades de financiación
+# ---------------------------------------------------------------------------
+
+def calcular_flujo_caja(
+    df_ingresos: pd.DataFrame,
+    df_cronograma: pd.DataFrame,
+    df_otros_costes: pd.DataFrame,
+) -> pd.DataFrame:
+    """
+    Une ingresos, coste de ejecución y otros costes por mes y calcula el flujo
+    mensual, el acumulado y el saldo de la cuenta especial intervenida. La
+    cuenta especial solo cubre costes de ejecución: cuando su saldo se vuelve
+    negativo se registra el déficit y el saldo vuelve a cero.
+
+    Las tres tablas se colocan sobre el calendario del proyecto (un mes por
+    fila desde el primer evento hasta el último) sumando sus columnas como
+    arrays; los acumulados se recalculan sobre ese calendario.
+    """
+    rango_ingresos = rango_tabla(df_ingresos)
+    rango_cronograma = rango_tabla(df_cronograma)
+    rango_otros = rango_tabla(df_otros_costes)
+    primer_mes, num_meses = calendario(rango_ingresos, rango_cronograma, rango_otros)
+
+    def alineadas(df_tabla, primer_mes_tabla):
+        return {
+            columna: alinear(df_tabla[columna].to_numpy(dtype=np.float64), primer_mes_tabla, primer_mes, num_meses)
+            for columna in df_tabla.columns
+            if columna != "Mes"
+        }
+
+    columnas = {"Mes": etiquetas_mes(primer_mes, num_meses)}
+    columnas.update(alineadas(df_ingresos, rango_ingresos[0]))
+    columnas["Coste ejecución (€)"] = alinear(
+        df_cronograma["Total mensual (€)"].to_numpy(dtype=np.float64), rango_cronograma[0], primer_mes, num_meses
+    )
+    columnas.update(alineadas(df_otros_costes, rango_otros[0]))
+    if "Acumulado" in columnas:
+        columnas["Acumulado"] = np.cumsum(columnas["Total ingresos (€)"])
+    if "Total otros costes acumulado (€)" in columnas:
+        columnas["Total otros costes acumulado (€)"] = np.cumsum(columnas["Total otros costes (€)"])
+    df_merge = pd.DataFrame(columnas)
+
+    # Calcular flujo de caja mensual total y acumulado
+    df_merge["Flujo mensual total (€)"] = df_merge["Ingresos netos (€)"] + df_merge["Coste ejecución (€)"] + df_merge["Total otros costes (€)"]
+    df_merge["Flujo acumulado (€)"] = df_merge["Flujo mensual total (€)"].cumsum()
+
+    # Calcular flujo de cuenta especial intervenida
+    df_merge["Ingreso cuenta especial (€)"] = (
+        df_merge["Reserva (€)"] +
+        df_merge["Contrato (€)"] +
+        df_merge["Aplazado (€)"]
+    )
+    df_merge["Gasto cuenta especial (€)"] = df_merge["Coste ejecución (€)"]
+    df_merge["Flujo cuenta especial (€)"] = df_merge["Ingreso cuenta especial (€)"] + df_merge["Gasto cuenta especial (€)"]
+
+    # Calcular acumulado y déficit mensual de cuenta especial
+    acumulado, deficits = saldo_cuenta_especial(df_merge["Flujo cuenta especial (€)"].to_numpy(dtype=np.float64))
+
+    df_merge["Acumulado cuenta especial (€)"] = acumulado
+    df_merge["Déficit cuenta especial (€)"] = deficits
+    return df_merge
+
+
+def _saldo_cuenta_especial_numpy(flujos, acumulado, deficits):
+    if flujos.shape[0] == 1:
+        # Un solo escenario: el bucle con floats de Python es lo más rápido
+        saldo = 0.0
+        for t, flujo in enumerate(flujos[0].tolist()):
+            saldo += flujo
+            if saldo < 0:
+                deficits[0, t] = saldo
+                saldo = 0.0
+            acumulado[0, t] = saldo
+        return
+    saldo = np.zeros(flujos.shape[0], dtype=np.float64)
+    for t in range(flujos.shape[1]):
+        saldo = saldo + flujos[:, t]
+        negativo = saldo < 0
+        deficits[:, t] = np.where(negativo, saldo, 0.0)
+        saldo = np.where(negativo, 0.0, saldo)
+        acumulado[:, t] = saldo
+
+
+def _saldo_cuenta_especial_bucle(flujos, acumulado, deficits):
+    for s in range(flujos.shape[0]):
+        saldo = 0.0
+        for t in range(flujos.shape[1]):
+            saldo += flujos[s, t]
+            if saldo < 0:
+                deficits[s, t] = saldo
+                saldo = 0.0
+            acumulado[s, t] = saldo
+
+
+_saldo_cuenta_especial_numba = njit(cache=True, nogil=True)(_saldo_cuenta_especial_bucle) if njit else None
+
+
+def saldo_cuenta_especial(flujos):
+    """
+    Saldo de la cuenta especial con reinicio a cero. Recorre los flujos mes a
+    mes acumulando el saldo; cuando queda negativo se registra ese importe
+    como déficit del mes y el saldo vuelve a cero.
+
+    Acepta un array 1-D (meses) o 2-D (escenarios x meses) y devuelve
+    (acumulado, deficits) con la misma forma. Usa numba si está instalado; si
+    no, recorre los meses con operaciones vectorizadas sobre los escenarios.
+    """
+    flujos = np.asarray(flujos, dtype=np.float64)
+    una_dimension = flujos.ndim == 1
+    flujos = np.ascontiguousarray(np.atleast_2d(flujos))
+    acumulado = np.zeros_like(flujos)
+    deficits = np.zeros_like(flujos)
+    if _saldo_cuenta_especial_numba is not None:
+        _saldo_cuenta_especial_numba(flujos, acumulado, deficits)
+    else:
+        _saldo_cuenta_especial_numpy(flujos, acumulado, deficits)
+    if una_dimension:
+        return acumulado[0], deficits[0]
+    return acumulado, deficits
+
+
+def calcular_necesidades(df_flujo: pd.DataFrame) -> pd.DataFrame:
+    """
+    Necesidades de financiación mensuales: suelo, honorarios, administración,
+    costes financieros, comisiones pre-escritura (estimadas en proporción a los
+    ingresos de reserva, contrato y aplazado) y déficit de la cuenta especial.
+    """
+    df_merge = df_flujo.copy()
+    df_merge["Comisiones pre-escritura (€)"] = 0
+    if "Comisiones (€)" in df_merge.columns:
+        # Estimar comisiones pre-escritura proporcionalmente según los ingresos
+        ingresos_total = df_merge[["Reserva (€)", "Contrato (€)", "Aplazado (€)", "Escritura (€)"]].sum(axis=1)
+        ingresos_pre = df_merge[["Reserva (€)", "Contrato (€)", "Aplazado (€)"]].sum(axis=1)
+        proporcion_pre = ingresos_pre / ingresos_total.replace(0, 1)
+        df_merge["Comisiones pre-escritura (€)"] = df_merge["Comisiones (€)"] * proporcion_pre
+
+    for col in COLUMNAS_NECESIDADES:
+        if col not in df_merge.columns:
+            df_merge[col] = 0
+
+    df_merge["Total necesidades financiación (€)"] = df_merge[COLUMNAS_NECESIDADES].sum(axis=1)
+
+    return df_merge[["Mes"] + COLUMNAS_NECESIDADES + ["Total necesidades financiación (€)"]].copy()
+
+
+# ---------------------------------------------------------------------------
+# Cuenta de resultados
+# ---------------------------------------------------------------------------
+
+def calcular_cuenta_resultados(
+    num_viviendas: int,
+    precio_medio_venta: float,
+    superficie_total: float,
+    coste_suelo: float,
+    coste_ejecucion_m2: float,
+    comisiones_venta: float,
+    porcentaje_honorarios: float,
+    porcentaje_admin: float,
+    gastos_financieros: float,
+) -> pd.DataFrame:
+    """
+    Cuenta de resultados de la promoción (sin IVA).
+    """
+    ingresos_por_venta = precio_medio_venta * num_viviendas
+    total_comisiones = ingresos_por_venta * comisiones_venta / 100
+    ingresos_netos = ingresos_por_venta - total_comisiones
+
+    coste_ejecucion_total = coste_ejecucion_m2 * superficie_total
+    coste_honorarios = coste_ejecucion_total * porcentaje_honorarios / 100
+    coste_admin = coste_ejecucion_total * porcentaje_admin / 100
+    coste_financiero = gastos_financieros * num_viviendas
+    costes_no_ejecutivos = coste_honorarios + coste_admin + coste_financiero
+
+    total_costes = coste_suelo + coste_ejecucion_total + costes_no_ejecutivos
+    margen = ingresos_netos - total_costes
+
+    margen_vivienda = margen / num_viviendas if num_viviendas else 0
+    margen_m2 = margen / superficie_total if superficie_total else 0
+
+    cuenta_resultados = {
+        "Concepto": [
+            "Ingresos por venta",
+            "(-) Comisiones",
+            "= Ingresos Netos",
+            "Compra de terrenos",
+            "Costes de ejecución",
+            "Costes no ejecutivos",
+            "= Total Costes",
+            "= Margen",
+            "Margen por vivienda",
+            "Margen por m² construido"
+        ],
+        "Importe (€)": [
+            ingresos_por_venta,
+            -total_comisiones,
+            ingresos_netos,
+            -coste_suelo,
+            -coste_ejecucion_total,
+            -costes_no_ejecutivos,
+            -total_costes,
+            margen,
+            margen_vivienda,
+            margen_m2
+        ]
+    }
+    return pd.DataFrame(cuenta_resultados)
+
+
+# ---------------------------------------------------------------------------
+# Evaluación completa
+# ---------------------------------------------------------------------------
+
+def evaluar_proyecto(
+    parametros: ParametrosProyecto,
+    df_viviendas: pd.DataFrame = None,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+) -> dict:
+    """
+    Evalúa el modelo completo y devuelve todas las tablas mensuales.
+
+    - df_viviendas: tabla ya normalizada (ver preparar_viviendas). Si es None no
+      hay ingresos y el flujo de caja no puede calcularse.
+    - df_capitulos: 'Capítulo' y 'Peso (%)'. Por defecto, PESOS_DEFECTO.
+    - df_planificacion: 'Capítulo', 'Inicio' y 'Duración (meses)'. Por defecto,
+      la planificación por defecto desde el inicio de obra.
+
+    Claves del resultado: 'ingresos', 'capitulos', 'planificacion',
+    'cronograma', 'otros_costes' (diccionario de calcular_otros_costes), 'flujo',
+    'resumen_flujo', 'necesidades' y 'cuenta_resultados'. Las tablas que
+    dependen de los ingresos son None cuando no hay viviendas.
+    """
+    p = parametros
+    coste_total_ejecucion = p.coste_total_ejecucion
+
+    if df_capitulos is None:
+        df_capitulos = capitulos_por_defecto(coste_total_ejecucion)
+    if df_planificacion is None:
+        df_planificacion = planificacion_por_defecto(df_capitulos, p.fecha_inicio_obra)
+
+    df_ingresos = None
+    if df_viviendas is not None and not df_viviendas.empty:
+        df_ingresos = calcular_ingresos(
+            df_viviendas,
+            p.fecha_entrega_viviendas,
+            p.reserva_fija,
+            p.pct_contrato,
+            p.pct_aplazado,
+            p.iva_venta,
+            p.comisiones_venta,
+            p.iva_otros,
+        )
+
+    df_cronograma = calcular_cronograma(df_planificacion, df_capitulos, coste_total_ejecucion)
+    otros_costes = calcular_otros_costes(
+        df_viviendas,
+        p.fecha_inicio_obra,
+        p.fecha_inicio_comercializacion,
+        p.plazo_obra_meses,
+        p.coste_suelo,
+        coste_total_ejecucion,
+        p.porcentaje_honorarios,
+        p.porcentaje_admin,
+        p.gastos_financieros,
+    )
+
+    df_flujo = df_resumen_flujo = df_necesidades = None
+    if df_ingresos is not None:
+        df_flujo = calcular_flujo_caja(df_ingresos, df_cronograma, otros_costes["total"])
+        df_resumen_flujo = df_flujo[COLUMNAS_RESUMEN_FLUJO].copy()
+        df_necesidades = calcular_necesidades(df_flujo)
+
+    df_resultados = calcular_cuenta_resultados(
+        p.num_viviendas,
+        p.precio_medio_venta,
+        p.superficie_total,
+        p.coste_suelo,
+        p.coste_ejecucion_m2,
+        p.comisiones_venta,
+        p.porcentaje_honorarios,
+        p.porcentaje_admin,
+        p.gastos_financieros,
+    )
+
+    return {
+        "ingresos": df_ingresos,
+        "capitulos": df_capitulos,
+        "planificacion": df_planificacion,
+        "cronograma": df_cronograma,
+        "otros_costes": otros_costes,
+        "flujo": df_flujo,
+        "resumen_flujo": df_resumen_flujo,
+        "necesidades": df_necesidades,
+        "cuenta_resultados": df_resultados,
+    }
+
+
+def indicadores(resultados: dict) -> dict:
+    """
+    Indicadores principales de un resultado de evaluar_proyecto:
+
+    - margen: margen de la cuenta de resultados (sin IVA).
+    - pico_financiacion: mayor saldo negativo del flujo acumulado (≥ 0).
+    - total_necesidades: suma de las necesidades de financiación (≥ 0).
+    - deficit_max_cuenta_especial: mayor déficit mensual de la cuenta especial (≥ 0).
+
+    Los indicadores de flujo son None si no hay viviendas.
+    """
+    df_resultados = resultados["cuenta_resultados"]
+    margen = float(df_resultados.loc[df_resultados["Concepto"] == "= Margen", "Importe (€)"].iloc[0])
+    kpis = {
+        "margen": margen,
+        "pico_financiacion": None,
+        "total_necesidades": None,
+        "deficit_max_cuenta_especial": None,
+    }
+    df_flujo = resultados["flujo"]
+    if df_flujo is not None:
+        kpis["pico_financiacion"] = max(0.0, -float(df_flujo["Flujo acumulado (€)"].min()))
+        kpis["total_necesidades"] = -float(resultados["necesidades"]["Total necesidades financiación (€)"].sum())
+        kpis["deficit_max_cuenta_especial"] = max(0.0, -float(df_flujo["Déficit cuenta especial (€)"].min()))
+    return kpis
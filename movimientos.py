@@ -0,0 +1,326 @@
+"""
+Libro de movimientos: cada entrada o salida de caja del proyecto como una fila.
+
+El libro es columnar (un array NumPy tipado por columna, sin objetos de
+Python por fila):
+
+- proyecto (int16): posición en 'proyectos' (una cartera concatena libros).
+- vivienda (int32): posición en 'viviendas' (sus códigos); -1 si el
+  movimiento no es de una vivienda.
+- fase (int8): posición en FASES.
+- capitulo (int16): posición en 'capitulos'; -1 si no es coste de ejecución.
+- mes (int32): índice de mes (motor.indice_mes).
+- importe (float64).
+
+Son 21 bytes por movimiento: un millón de viviendas (cuatro pagos, cuatro
+comisiones y un coste financiero cada una) ocupan unos 190 MB. Las filas se
+ordenan por mes y 'inicios' guarda dónde empieza cada mes, de modo que los
+movimientos de una celda del flujo de caja son un corte contiguo del libro.
+
+Los pagos salen de las mismas funciones del motor con que se calculan sus
+tablas (pagos_ingresos, cronograma_ejecucion y pagos_otros_costes), y las
+tablas mensuales son agrupaciones por fase y mes (np.bincount) sobre el
+libro, así que cuadran con ellas; las comisiones se calculan pago a pago y
+cuadran salvo redondeo.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import motor
+
+FASES = {
+    "reserva": "Reserva",
+    "contrato": "Contrato",
+    "aplazado": "Aplazado",
+    "escritura": "Escritura",
+    "comision": "Comisión",
+    "coste_financiero": "Coste financiero",
+    "ejecucion": "Ejecución",
+    "suelo": "Suelo",
+    "honorarios": "Honorarios técnicos",
+    "administracion": "Administración",
+}
+
+_FASES_INGRESOS = ("reserva", "contrato", "aplazado", "escritura")
+_FASES_OTROS_COSTES = ("suelo", "honorarios", "administracion", "coste_financiero")
+
+# Columnas de la tabla de flujo de caja (motor.calcular_flujo_caja) que son
+# suma de movimientos, con las fases que suman
+COLUMNAS_FLUJO = {
+    "Reserva (€)": ("reserva",),
+    "Contrato (€)": ("contrato",),
+    "Aplazado (€)": ("aplazado",),
+    "Escritura (€)": ("escritura",),
+    "Comisiones (€)": ("comision",),
+    "Total ingresos (€)": _FASES_INGRESOS,
+    "Ingresos netos (€)": _FASES_INGRESOS + ("comision",),
+    "Coste ejecución (€)": ("ejecucion",),
+    "Coste suelo (€)": ("suelo",),
+    "Honorarios técnicos (€)": ("honorarios",),
+    "Gastos administración (€)": ("administracion",),
+    "Costes financieros (€)": ("coste_financiero",),
+    "Total otros costes (€)": _FASES_OTROS_COSTES,
+    "Flujo mensual total (€)": tuple(FASES),
+    "Ingreso cuenta especial (€)": ("reserva", "contrato", "aplazado"),
+    "Gasto cuenta especial (€)": ("ejecucion",),
+    "Flujo cuenta especial (€)": ("reserva", "contrato", "aplazado", "ejecucion"),
+}
+
+_TIPOS = {
+    "proyecto": np.int16,
+    "vivienda": np.int32,
+    "fase": np.int8,
+    "capitulo": np.int16,
+    "mes": np.int32,
+    "importe": np.float64,
+}
+
+
+@dataclass
+class Movimientos:
+    """
+    Libro de movimientos ordenado por mes. Los movimientos del mes m son las
+    filas inicios[m - primer_mes]:inicios[m - primer_mes + 1].
+    """
+    proyecto: np.ndarray
+    vivienda: np.ndarray
+    fase: np.ndarray
+    capitulo: np.ndarray
+    mes: np.ndarray
+    importe: np.ndarray
+    proyectos: list
+    viviendas: np.ndarray
+    capitulos: list
+    primer_mes: int
+    inicios: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.importe)
+
+    @property
+    def num_meses(self) -> int:
+        return len(self.inicios) - 1
+
+
+def _codigos_fase(fases) -> np.ndarray:
+    orden = list(FASES)
+    return np.array([orden.index(f) for f in fases], dtype=np.int8)
+
+
+def _ordenar(columnas: dict, proyectos: list, viviendas: np.ndarray, capitulos: list) -> Movimientos:
+    """
+    Ordena las columnas por mes (orden estable: dentro de un mes se conserva
+    el orden de generación) y calcula el índice de inicio de cada mes.
+    """
+    orden = np.argsort(columnas["mes"], kind="stable")
+    columnas = {nombre: np.ascontiguousarray(valores[orden], dtype=_TIPOS[nombre]) for nombre, valores in columnas.items()}
+    meses = columnas["mes"]
+    primer_mes = int(meses[0]) if len(meses) else 0
+    num_meses = int(meses[-1]) - primer_mes + 1 if len(meses) else 0
+    inicios = np.zeros(num_meses + 1, dtype=np.int64)
+    np.cumsum(np.bincount(meses - primer_mes, minlength=num_meses), out=inicios[1:])
+    return Movimientos(
+        **columnas,
+        proyectos=list(proyectos),
+        viviendas=viviendas,
+        capitulos=list(capitulos),
+        primer_mes=primer_mes,
+        inicios=inicios,
+    )
+
+
+def construir(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame = None,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+    proyecto: str = "",
+) -> Movimientos:
+    """
+    Libro de movimientos de un proyecto con las mismas entradas (y los mismos
+    valores por defecto) que motor.evaluar_proyecto.
+    """
+    p = parametros
+    coste_total_ejecucion = p.coste_total_ejecucion
+    if df_capitulos is None:
+        df_capitulos = motor.capitulos_por_defecto(coste_total_ejecucion)
+    if df_planificacion is None:
+        df_planificacion = motor.planificacion_por_defecto(df_capitulos, p.fecha_inicio_obra)
+
+    # Trozos de columnas (vivienda, fase, capitulo, mes, importe)
+    trozos = []
+
+    def anotar(vivienda, fase, capitulo, mes, importe):
+        n = len(importe)
+        trozos.append((
+            np.broadcast_to(np.asarray(vivienda, dtype=np.int32), n),
+            np.full(n, fase, dtype=np.int8),
+            np.broadcast_to(np.asarray(capitulo, dtype=np.int16), n),
+            np.asarray(mes, dtype=np.int32),
+            np.asarray(importe, dtype=np.float64),
+        ))
+
+    viviendas = np.array([], dtype=object)
+    if df_viviendas is not None and not df_viviendas.empty:
+        viviendas = df_viviendas["Código"].astype(str).to_numpy(dtype=object)
+        pagos = motor.pagos_ingresos(
+            df_viviendas, p.fecha_entrega_viviendas, p.reserva_fija, p.pct_contrato, p.pct_aplazado, p.iva_venta
+        )
+        for codigo, meses, importes in zip(_codigos_fase(_FASES_INGRESOS), pagos["meses"], pagos["importes"]):
+            anotar(pagos["filas"], codigo, -1, meses, importes)
+        # Comisión de cada pago, sobre su importe sin IVA (como en motor.calcular_ingresos)
+        codigo_comision = _codigos_fase(["comision"])[0]
+        for meses, importes in zip(pagos["meses"], pagos["importes"]):
+            comisiones = -(importes / (1 + p.iva_venta / 100) * (p.comisiones_venta / 100) * (1 + p.iva_otros / 100))
+            anotar(pagos["filas"], codigo_comision, -1, meses, comisiones)
+
+    primer_mes, capitulos, matriz = motor.cronograma_ejecucion(df_planificacion, df_capitulos, coste_total_ejecucion)
+    filas_capitulo, columnas_mes = np.nonzero(matriz)
+    anotar(-1, _codigos_fase(["ejecucion"])[0], filas_capitulo, primer_mes + columnas_mes, matriz[filas_capitulo, columnas_mes])
+
+    otros = motor.pagos_otros_costes(
+        df_viviendas,
+        p.fecha_inicio_obra,
+        p.fecha_inicio_comercializacion,
+        p.plazo_obra_meses,
+        p.coste_suelo,
+        coste_total_ejecucion,
+        p.porcentaje_honorarios,
+        p.porcentaje_admin,
+        p.gastos_financieros,
+    )
+    for codigo, (meses, importes, filas) in zip(_codigos_fase(_FASES_OTROS_COSTES), otros):
+        anotar(-1 if filas is None else filas, codigo, -1, meses, importes)
+
+    columnas = {
+        nombre: np.concatenate([trozo[i] for trozo in trozos])
+        for i, nombre in enumerate(("vivienda", "fase", "capitulo", "mes", "importe"))
+    }
+    columnas["proyecto"] = np.zeros(len(columnas["importe"]), dtype=np.int16)
+    return _ordenar(columnas, [proyecto], viviendas, capitulos)
+
+
+def concatenar(libros: list) -> Movimientos:
+    """
+    Une los libros de varios proyectos (por ejemplo, los de una cartera) en
+    uno solo, renumerando proyectos, viviendas y capítulos.
+    """
+    proyectos, viviendas, capitulos = [], [], {}
+    columnas = {nombre: [] for nombre in _TIPOS}
+    desplazamiento_viviendas = 0
+    for libro in libros:
+        desplazamiento_proyectos = len(proyectos)
+        proyectos.extend(libro.proyectos)
+        viviendas.append(libro.viviendas)
+        traduccion = np.array([capitulos.setdefault(c, len(capitulos)) for c in libro.capitulos] + [-1], dtype=np.int16)
+        columnas["proyecto"].append(libro.proyecto + desplazamiento_proyectos)
+        columnas["vivienda"].append(np.where(libro.vivienda >= 0, libro.vivienda + desplazamiento_viviendas, -1))
+        columnas["capitulo"].append(traduccion[libro.capitulo])
+        for nombre in ("fase", "mes", "importe"):
+            columnas[nombre].append(getattr(libro, nombre))
+        desplazamiento_viviendas += len(libro.viviendas)
+    columnas = {
+        nombre: np.concatenate(partes) if partes else np.zeros(0, dtype=_TIPOS[nombre])
+        for nombre, partes in columnas.items()
+    }
+    viviendas = np.concatenate(viviendas) if viviendas else np.array([], dtype=object)
+    return _ordenar(columnas, proyectos, viviendas, list(capitulos))
+
+
+def construir_cartera(seleccion: list) -> Movimientos:
+    """
+    Libro de movimientos de una selección de versiones (diccionarios con
+    'proyecto' y 'version', como catalogo.versiones_cartera).
+    """
+    from versionado import leer_entradas
+
+    libros = []
+    for s in seleccion:
+        parametros, tablas = leer_entradas(s["version"], s["proyecto"])
+        libros.append(construir(
+            motor.ParametrosProyecto(**parametros),
+            tablas.get("df_viviendas"),
+            tablas.get("df_planificacion"),
+            tablas.get("df_capitulos"),
+            proyecto=s["proyecto"],
+        ))
+    return concatenar(libros)
+
+
+def _mascara_fases(libro: Movimientos, fases, filas: slice = slice(None)) -> np.ndarray:
+    if fases is None:
+        return np.ones(len(libro.fase[filas]), dtype=bool)
+    return np.isin(libro.fase[filas], _codigos_fase(fases))
+
+
+def por_mes(libro: Movimientos, fases=None, primer_mes: int = None, num_meses: int = None) -> np.ndarray:
+    """
+    Suma mensual de los movimientos de las fases indicadas (por defecto,
+    todas) sobre el calendario (primer_mes, num_meses); por defecto, el del
+    libro. El calendario debe contener los meses del libro.
+    """
+    primer_mes = libro.primer_mes if primer_mes is None else primer_mes
+    num_meses = libro.num_meses if num_meses is None else num_meses
+    seleccion = _mascara_fases(libro, fases)
+    return np.bincount(
+        libro.mes[seleccion] - primer_mes, weights=libro.importe[seleccion], minlength=num_meses
+    )[:num_meses]
+
+
+def tabla_mensual(libro: Movimientos, columnas: dict = None) -> pd.DataFrame:
+    """
+    Tabla 'Mes' x columnas, cada una la suma mensual de sus fases
+    ({columna: fases}); por defecto, una columna por fase.
+    """
+    if columnas is None:
+        columnas = {etiqueta: (fase,) for fase, etiqueta in FASES.items()}
+    df = pd.DataFrame({"Mes": motor.etiquetas_mes(libro.primer_mes, libro.num_meses)})
+    for columna, fases in columnas.items():
+        df[columna] = por_mes(libro, fases)
+    return df
+
+
+def detalle(libro: Movimientos, mes, fases=None) -> pd.DataFrame:
+    """
+    Movimientos de un mes (índice o etiqueta 'YYYY-MM') de las fases
+    indicadas (por defecto, todas), de mayor a menor importe absoluto.
+    """
+    if isinstance(mes, str):
+        mes = motor.mes_desde_etiqueta(mes)
+    posicion = mes - libro.primer_mes
+    if 0 <= posicion < libro.num_meses:
+        filas = slice(int(libro.inicios[posicion]), int(libro.inicios[posicion + 1]))
+    else:
+        filas = slice(0, 0)
+    seleccion = _mascara_fases(libro, fases, filas)
+
+    vivienda = libro.vivienda[filas][seleccion]
+    capitulo = libro.capitulo[filas][seleccion]
+    importe = libro.importe[filas][seleccion]
+    etiquetas_fase = np.array(list(FASES.values()), dtype=object)
+    capitulos = np.array(list(libro.capitulos) + [None], dtype=object)
+    codigos = np.append(libro.viviendas, None)
+    df = pd.DataFrame({
+        "Proyecto": np.array(libro.proyectos, dtype=object)[libro.proyecto[filas][seleccion]],
+        "Código": codigos[vivienda],
+        "Fase": etiquetas_fase[libro.fase[filas][seleccion]],
+        "Capítulo": capitulos[capitulo],
+        "Mes": motor.etiquetas_mes(mes, 1) * len(importe),
+        "Importe (€)": importe,
+    })
+    if len(libro.proyectos) == 1:
+        df = df.drop(columns="Proyecto")
+    orden = np.argsort(-np.abs(importe), kind="stable")
+    return df.iloc[orden].reset_index(drop=True)
+
+
+def detalle_celda(libro: Movimientos, mes, columna: str) -> pd.DataFrame:
+    """
+    Movimientos que suman una celda de la tabla de flujo de caja: el mes de
+    la fila y una columna de COLUMNAS_FLUJO.
+    """
+    if columna not in COLUMNAS_FLUJO:
+        raise ValueError(f"La columna '{columna}' no es suma de movimientos.")
+    return detalle(libro, mes, COLUMNAS_FLUJO[columna])
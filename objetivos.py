@@ -0,0 +1,221 @@
+"""
+Búsqueda de objetivos: el valor de una variable que lleva un indicador a un
+umbral.
+
+Responde preguntas como "¿qué precio medio mínimo mantiene el pico de
+financiación por debajo de 2 M€?" o "¿cuántos meses puede retrasarse el
+inicio de obra sin que la cuenta especial entre en déficit?". Supone que el
+indicador es monótono en la variable dentro del rango: cada iteración evalúa
+de una vez, con escenarios.ModeloEscenarios, una rejilla de puntos sobre el
+intervalo, localiza el tramo donde se cumple por primera (o última) vez la
+condición y lo vuelve a dividir hasta la tolerancia. Cada búsqueda son unas
+pocas evaluaciones vectorizadas, del orden de milisegundos.
+
+El mínimo del flujo acumulado se busca con el pico de financiación, que es
+ese mínimo cambiado de signo.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import motor
+from escenarios import (
+    DESCUENTO_PRECIO,
+    DESPLAZAMIENTO_VENTAS,
+    METRICAS,
+    RETRASO_COMERCIALIZACION,
+    RETRASO_INICIO_OBRA,
+    VARIABLES,
+    VARIABLES_ENTERAS,
+    ModeloEscenarios,
+    valor_base,
+)
+
+CONDICIONES = {"<=": "como máximo", ">=": "como mínimo"}
+SENTIDOS = {"minimo": "Valor mínimo", "maximo": "Valor máximo"}
+
+# Puntos evaluados por iteración
+PUNTOS = 33
+
+
+@dataclass
+class ResultadoObjetivo:
+    """
+    Solución de una búsqueda: valor de la variable (None si ningún valor del
+    rango cumple la condición), indicador en ese valor y número de escenarios
+    evaluados.
+    """
+    variable: str
+    metrica: str
+    objetivo: float
+    valor: float
+    valor_metrica: float
+    evaluaciones: int
+
+
+def rango_busqueda(parametros: motor.ParametrosProyecto, variable: str):
+    """
+    Rango (mínimo, máximo) de búsqueda por defecto de una variable: de cero al
+    triple del valor base, hasta tres años de retraso o ampliación de plazo y
+    porcentajes entre 0 y 100.
+    """
+    if variable in (DESPLAZAMIENTO_VENTAS, RETRASO_INICIO_OBRA, RETRASO_COMERCIALIZACION):
+        return 0, 36
+    if variable == DESCUENTO_PRECIO or variable.startswith(("pct_", "porcentaje_", "iva_")) or variable == "comisiones_venta":
+        return 0.0, 100.0
+    base = valor_base(parametros, variable)
+    if variable == "plazo_obra_meses":
+        return 1, base + 36
+    if variable in VARIABLES_ENTERAS:
+        return 1, max(1, int(base) * 3)
+    return 0.0, float(base) * 3
+
+
+def resolver(
+    modelo: ModeloEscenarios,
+    variable: str,
+    metrica: str,
+    objetivo: float,
+    condicion: str = "<=",
+    buscar: str = "minimo",
+    minimo=None,
+    maximo=None,
+    tolerancia: float = None,
+    puntos: int = PUNTOS,
+) -> ResultadoObjetivo:
+    """
+    Valor mínimo o máximo (buscar) de 'variable' en [minimo, maximo] con el que
+    'metrica' (clave de escenarios.METRICAS) queda 'condicion' ("<=" o ">=")
+    'objetivo'. La tolerancia por defecto es una millonésima del rango, o una
+    unidad en las variables enteras.
+    """
+    if variable not in VARIABLES:
+        raise ValueError(f"Variable de escenario desconocida: {variable}")
+    if metrica not in METRICAS:
+        raise ValueError(f"Indicador desconocido: {metrica}")
+    if condicion not in CONDICIONES:
+        raise ValueError(f"Condición no válida: {condicion}")
+    if buscar not in SENTIDOS:
+        raise ValueError(f"Sentido de búsqueda no válido: {buscar}")
+
+    por_defecto = rango_busqueda(modelo.parametros, variable)
+    a = por_defecto[0] if minimo is None else minimo
+    b = por_defecto[1] if maximo is None else maximo
+    if a > b:
+        raise ValueError("El mínimo del rango no puede ser mayor que el máximo.")
+    entera = variable in VARIABLES_ENTERAS
+    if tolerancia is None:
+        tolerancia = 1 if entera else (b - a) * 1e-6
+
+    evaluaciones = 0
+    while True:
+        x = np.linspace(a, b, max(int(puntos), 3))
+        if entera:
+            x = np.unique(np.round(x).astype(np.int64))
+        valores = modelo.evaluar({variable: x})[metrica]
+        evaluaciones += len(x)
+        cumple = valores <= objetivo if condicion == "<=" else valores >= objetivo
+        if not cumple.any():
+            # Solo en la primera iteración: después un extremo siempre cumple
+            return ResultadoObjetivo(variable, metrica, objetivo, None, None, evaluaciones)
+
+        if buscar == "minimo":
+            i = int(np.argmax(cumple))
+            solucion, valor_metrica = x[i], valores[i]
+            if i == 0:
+                break
+            a, b = x[i - 1], x[i]
+        else:
+            i = len(x) - 1 - int(np.argmax(cumple[::-1]))
+            solucion, valor_metrica = x[i], valores[i]
+            if i == len(x) - 1:
+                break
+            a, b = x[i], x[i + 1]
+        if b - a <= tolerancia:
+            break
+
+    solucion = int(solucion) if entera else float(solucion)
+    return ResultadoObjetivo(variable, metrica, objetivo, solucion, float(valor_metrica), evaluaciones)
+
+
+def resolver_entradas(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    variable: str,
+    metrica: str,
+    objetivo: float,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+    **opciones,
+) -> ResultadoObjetivo:
+    """
+    Como resolver, preparando el modelo a partir de las entradas del proyecto.
+    """
+    modelo = ModeloEscenarios(parametros, df_viviendas, df_planificacion, df_capitulos)
+    return resolver(modelo, variable, metrica, objetivo, **opciones)
+
+
+def _resolver_version(argumentos: tuple) -> dict:
+    proyecto, version, variable, metrica, objetivo, opciones = argumentos
+    from versionado import leer_entradas
+
+    inicio = time.perf_counter()
+    fila = {"Proyecto": proyecto, "Versión": version, "Valor": None, "Indicador en el valor": None, "Error": None}
+    try:
+        parametros, tablas = leer_entradas(version, proyecto)
+        resultado = resolver_entradas(
+            motor.ParametrosProyecto(**parametros),
+            tablas.get("df_viviendas"),
+            variable,
+            metrica,
+            objetivo,
+            tablas.get("df_planificacion"),
+            tablas.get("df_capitulos"),
+            **opciones,
+        )
+        fila["Valor"] = resultado.valor
+        fila["Indicador en el valor"] = resultado.valor_metrica
+        if resultado.valor is None:
+            fila["Error"] = "Ningún valor del rango cumple el objetivo."
+    except Exception as e:
+        fila["Error"] = str(e)
+    fila["Segundos"] = time.perf_counter() - inicio
+    return fila
+
+
+def resolver_proyectos(
+    variable: str,
+    metrica: str,
+    objetivo: float,
+    seleccion: list = None,
+    procesos: int = None,
+    **opciones,
+) -> pd.DataFrame:
+    """
+    Resuelve la misma pregunta para cada versión de 'seleccion' (diccionarios
+    con 'proyecto' y 'version', como catalogo.versiones_recientes); por
+    defecto, la versión más reciente de cada proyecto del catálogo. Los
+    proyectos se reparten en un pool de procesos (procesos; por defecto, uno
+    por núcleo). Devuelve una fila por proyecto con 'Valor', 'Indicador en el
+    valor', 'Error' y 'Segundos'.
+    """
+    if seleccion is None:
+        import catalogo
+
+        catalogo.asegurar()
+        seleccion = catalogo.versiones_recientes()
+    trabajos = [
+        (s["proyecto"], s["version"], variable, metrica, objetivo, opciones)
+        for s in seleccion
+    ]
+    procesos = min(procesos or os.cpu_count() or 1, max(len(trabajos), 1))
+    if procesos == 1:
+        filas = [_resolver_version(trabajo) for trabajo in trabajos]
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            filas = list(pool.map(_resolver_version, trabajos))
+    return pd.DataFrame(filas, columns=["Proyecto", "Versión", "Valor", "Indicador en el valor", "Error", "Segundos"])
@@ -0,0 +1,186 @@
+"""
+Perfilado de las etapas de la app por ejecución.
+
+Cada bloque instrumentado (lectura de viviendas, ingresos, capítulos y
+Gantt, cronograma, otros costes, flujo de caja, necesidades, resumen,
+guardado y carga de versiones) se envuelve con medir(), que anota su tiempo
+real, las filas que procesa y el pico de memoria que reserva. Las medidas
+se acumulan por sesión hasta que cerrar() las da por terminadas al final de
+la ejecución (también las de los callbacks, que corren antes del script) y
+las escribe como una línea JSON en un registro común a todas las sesiones
+del servidor; resumen() calcula sobre ese registro los percentiles de cada
+etapa.
+
+El perfilado es opcional: sin activar, medir() no mide nada. El pico de
+memoria se toma con tracemalloc, que ralentiza las reservas de memoria de
+todo el proceso y cuyo pico es también del proceso (con varias sesiones a la
+vez es aproximado). Por eso solo se mide con el perfilado de servidor
+(PERFILADO=1); las sesiones abiertas con ?debug=1 anotan tiempos y filas,
+con el pico de memoria en None.
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+import pandas as pd
+
+# Perfilado activo en todas las sesiones (además de las abiertas con ?debug=1)
+ACTIVO = os.environ.get("PERFILADO", "") == "1"
+RUTA_REGISTRO = os.path.join(os.getcwd(), "registro_perfilado.jsonl")
+# Al superar este tamaño el registro se renombra a .1 y se empieza otro
+TAM_MAXIMO_REGISTRO = 20 * 1024 * 1024
+# Ejecuciones más recientes del registro que entran en el resumen
+ULTIMAS_EJECUCIONES = 5000
+PERCENTILES = (50, 90, 99)
+
+_pendientes = {}
+_bloqueo = threading.Lock()
+
+
+@dataclass
+class Medida:
+    """
+    Medida de una etapa: segundos de reloj, filas procesadas (None si no
+    aplica) y pico de memoria reservada durante la etapa, en bytes (None sin
+    tracemalloc).
+    """
+    etapa: str
+    filas: int = None
+    segundos: float = 0.0
+    pico_bytes: int = None
+
+
+def activar_memoria() -> None:
+    """
+    Enciende tracemalloc para medir el pico de memoria de cada etapa (solo
+    se usa con el perfilado de servidor, ACTIVO).
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+@contextmanager
+def medir(sesion: str, etapa: str, filas: int = None, activo: bool = True):
+    """
+    Mide el bloque 'with' como la etapa 'etapa' de la sesión. Devuelve la
+    Medida, cuyas 'filas' pueden fijarse dentro del bloque. Con activo=False
+    no mide ni anota nada.
+    """
+    medida = Medida(etapa, filas)
+    if not activo:
+        yield medida
+        return
+    con_memoria = ACTIVO and tracemalloc.is_tracing()
+    if con_memoria:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    inicio = time.perf_counter()
+    try:
+        yield medida
+    finally:
+        # También si el bloque termina con st.stop() o st.rerun()
+        medida.segundos = time.perf_counter() - inicio
+        if con_memoria:
+            medida.pico_bytes = max(tracemalloc.get_traced_memory()[1] - base, 0)
+        with _bloqueo:
+            _pendientes.setdefault(sesion, []).append(medida)
+
+
+def cerrar(sesion: str, segundos_ejecucion: float, ruta: str = None) -> list:
+    """
+    Cierra la ejecución de una sesión: devuelve sus medidas pendientes y las
+    añade al registro como una línea JSON con el momento, la sesión y el
+    tiempo total de la ejecución.
+    """
+    with _bloqueo:
+        medidas = _pendientes.pop(sesion, [])
+    if not medidas:
+        return medidas
+    linea = json.dumps({
+        "momento": time.time(),
+        "sesion": sesion,
+        "segundos_ejecucion": segundos_ejecucion,
+        "etapas": [asdict(m) for m in medidas],
+    }, ensure_ascii=False)
+    ruta = ruta or RUTA_REGISTRO
+    with _bloqueo:
+        try:
+            if os.path.getsize(ruta) > TAM_MAXIMO_REGISTRO:
+                os.replace(ruta, f"{ruta}.1")
+        except FileNotFoundError:
+            pass
+        with open(ruta, "a", encoding="utf-8") as f:
+            f.write(linea + "\n")
+    return medidas
+
+
+def tabla(medidas: list) -> pd.DataFrame:
+    """
+    Medidas de una ejecución como tabla (Etapa, Segundos, Filas, Pico MB).
+    """
+    return pd.DataFrame(
+        [
+            {
+                "Etapa": m.etapa,
+                "Segundos": m.segundos,
+                "Filas": m.filas,
+                "Pico MB": None if m.pico_bytes is None else m.pico_bytes / 2**20,
+            }
+            for m in medidas
+        ],
+        columns=["Etapa", "Segundos", "Filas", "Pico MB"],
+    )
+
+
+def leer_registro(ruta: str = None, ultimas: int = ULTIMAS_EJECUCIONES) -> pd.DataFrame:
+    """
+    Una fila por medida de las 'ultimas' ejecuciones del registro (momento,
+    sesión, etapa, segundos, filas y pico_bytes). Las líneas dañadas se
+    ignoran.
+    """
+    columnas = ["momento", "sesion", "etapa", "segundos", "filas", "pico_bytes"]
+    try:
+        with open(ruta or RUTA_REGISTRO, encoding="utf-8") as f:
+            lineas = deque(f, maxlen=ultimas)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=columnas)
+    filas = []
+    for linea in lineas:
+        try:
+            ejecucion = json.loads(linea)
+        except json.JSONDecodeError:
+            continue
+        for m in ejecucion.get("etapas", []):
+            filas.append({"momento": ejecucion.get("momento"), "sesion": ejecucion.get("sesion"), **m})
+    return pd.DataFrame(filas, columns=columnas)
+
+
+def resumen(ruta: str = None, ultimas: int = ULTIMAS_EJECUCIONES) -> pd.DataFrame:
+    """
+    Percentiles (PERCENTILES) de los segundos de cada etapa en las 'ultimas'
+    ejecuciones del registro, con el número de medidas, de sesiones, el
+    máximo, las filas medianas y el pico de memoria p90; de la etapa más
+    lenta (p90) a la más rápida.
+    """
+    df = leer_registro(ruta, ultimas)
+    columnas = (
+        ["Etapa", "Medidas", "Sesiones"] + [f"p{p} s" for p in PERCENTILES] + ["Máximo s", "Filas (mediana)", "Pico p90 MB"]
+    )
+    if df.empty:
+        return pd.DataFrame(columns=columnas)
+    df["pico_bytes"] = pd.to_numeric(df["pico_bytes"], errors="coerce")
+    df["filas"] = pd.to_numeric(df["filas"], errors="coerce")
+    grupos = df.groupby("etapa")
+    resultado = pd.DataFrame({"Medidas": grupos.size(), "Sesiones": grupos["sesion"].nunique()})
+    for p in PERCENTILES:
+        resultado[f"p{p} s"] = grupos["segundos"].quantile(p / 100)
+    resultado["Máximo s"] = grupos["segundos"].max()
+    resultado["Filas (mediana)"] = grupos["filas"].median()
+    resultado["Pico p90 MB"] = grupos["pico_bytes"].quantile(0.9) / 2**20
+    resultado = resultado.rename_axis("Etapa").reset_index()
+    return resultado.sort_values(f"p{PERCENTILES[1]} s", ascending=False, ignore_index=True)
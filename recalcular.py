@@ -0,0 +1,197 @@
+"""
+Recalcula versiones guardadas sin Streamlit y exporta sus tablas.
+
+Para cada proyecto (o proyecto/versión) indicado evalúa el motor completo y
+escribe ingresos, costes de ejecución, otros costes, flujo de caja,
+necesidades de financiación y cuenta de resultados en
+<salida>/<proyecto>/<versión>/, como CSV y/o Parquet (una tabla por archivo)
+o XLSX (una hoja por tabla). Los proyectos se reparten en un pool de
+procesos; cada proceso escribe sus propios archivos. Informa del tiempo de
+cada proyecto y termina con código 1 si alguno falla, para usarlo desde cron.
+
+Uso:
+    python recalcular.py [PROYECTO[/VERSIÓN] ...] [--todos] [--formato csv parquet xlsx]
+                         [--salida salida_recalculo] [--procesos N]
+
+Sin versión se toma la más reciente del proyecto; sin proyectos ni --todos se
+recalculan todos. Parquet necesita pyarrow y XLSX, openpyxl.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import motor
+
+FORMATOS = ("csv", "parquet", "xlsx")
+
+# Tablas exportadas: nombre del archivo u hoja -> función que la extrae del
+# resultado de motor.evaluar_proyecto
+TABLAS = {
+    "ingresos": lambda r: r["ingresos"],
+    "costes_ejecucion": lambda r: r["cronograma"].reset_index(),
+    "otros_costes": lambda r: r["otros_costes"]["total"],
+    "flujo_caja": lambda r: r["flujo"],
+    "necesidades_financiacion": lambda r: r["necesidades"],
+    "cuenta_resultados": lambda r: r["cuenta_resultados"],
+}
+
+
+def _nombre_archivo(nombre: str) -> str:
+    # Los nombres de proyecto y versión ya son nombres de archivo válidos;
+    # solo se evita que un separador cree subcarpetas
+    return nombre.replace(os.sep, "_").replace("/", "_")
+
+
+def exportar(resultados: dict, carpeta: str, formatos=("csv",)) -> list:
+    """
+    Escribe las TABLAS de un resultado de motor.evaluar_proyecto en 'carpeta'
+    en cada formato. Las tablas None (sin viviendas) se omiten. Devuelve las
+    rutas escritas.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    tablas = {nombre: extraer(resultados) for nombre, extraer in TABLAS.items()}
+    tablas = {nombre: df for nombre, df in tablas.items() if df is not None}
+    rutas = []
+    if "csv" in formatos:
+        for nombre, df in tablas.items():
+            ruta = os.path.join(carpeta, f"{nombre}.csv")
+            df.to_csv(ruta, index=False)
+            rutas.append(ruta)
+    if "parquet" in formatos:
+        for nombre, df in tablas.items():
+            ruta = os.path.join(carpeta, f"{nombre}.parquet")
+            df.to_parquet(ruta, index=False)
+            rutas.append(ruta)
+    if "xlsx" in formatos:
+        import pandas as pd
+
+        ruta = os.path.join(carpeta, "resultados.xlsx")
+        with pd.ExcelWriter(ruta, engine="openpyxl") as writer:
+            for nombre, df in tablas.items():
+                df.to_excel(writer, sheet_name=nombre[:31], index=False)
+        rutas.append(ruta)
+    return rutas
+
+
+def recalcular_version(proyecto: str, version: str, salida: str, formatos=("csv",)) -> dict:
+    """
+    Evalúa una versión guardada y exporta sus tablas. Devuelve un diccionario
+    con 'proyecto', 'version', 'segundos', 'archivos' y 'error' (None si todo
+    ha ido bien); no lanza excepciones.
+    """
+    from versionado import leer_entradas
+
+    inicio = time.perf_counter()
+    resultado = {"proyecto": proyecto, "version": version, "archivos": [], "error": None}
+    try:
+        parametros, tablas = leer_entradas(version, proyecto)
+        resultados = motor.evaluar_proyecto(
+            motor.ParametrosProyecto(**parametros),
+            tablas.get("df_viviendas"),
+            tablas.get("df_planificacion"),
+            tablas.get("df_capitulos"),
+        )
+        if resultados["flujo"] is None:
+            raise ValueError("La versión no tiene viviendas: no hay flujo de caja.")
+        carpeta = os.path.join(salida, _nombre_archivo(proyecto), _nombre_archivo(version))
+        resultado["archivos"] = exportar(resultados, carpeta, formatos)
+    except Exception as e:
+        resultado["error"] = f"{type(e).__name__}: {e}"
+    resultado["segundos"] = time.perf_counter() - inicio
+    return resultado
+
+
+def _recalcular_trabajo(trabajo: tuple) -> dict:
+    return recalcular_version(*trabajo)
+
+
+def seleccionar(objetivos: list) -> list:
+    """
+    Convierte 'proyecto' o 'proyecto/versión' en pares (proyecto, versión);
+    sin objetivos, todos los proyectos con su versión más reciente. Los
+    proyectos sin versiones se devuelven con versión None.
+    """
+    from versionado import listar_proyectos, listar_versiones
+
+    pares = []
+    for objetivo in objetivos or listar_proyectos():
+        proyecto, _, version = objetivo.partition("/")
+        if not version:
+            versiones = listar_versiones(proyecto) if proyecto in listar_proyectos() else []
+            version = versiones[0]["nombre"] if versiones else None
+        pares.append((proyecto, version))
+    return pares
+
+
+def recalcular(pares: list, salida: str, formatos=("csv",), procesos: int = None, al_terminar=None) -> list:
+    """
+    Recalcula cada (proyecto, versión) en un pool de procesos (por defecto,
+    uno por núcleo). al_terminar(resultado) se llama según va acabando cada
+    uno. Devuelve los resultados en el orden de 'pares'.
+    """
+    resultados = {}
+
+    def anotar(par, resultado):
+        resultados[par] = resultado
+        if al_terminar:
+            al_terminar(resultado)
+
+    trabajos = []
+    for proyecto, version in pares:
+        if version is None:
+            anotar((proyecto, version), {
+                "proyecto": proyecto, "version": None, "archivos": [], "segundos": 0.0,
+                "error": "El proyecto no existe o no tiene versiones.",
+            })
+        else:
+            trabajos.append((proyecto, version, salida, tuple(formatos)))
+
+    procesos = min(procesos or os.cpu_count() or 1, max(len(trabajos), 1))
+    if procesos == 1:
+        for trabajo in trabajos:
+            anotar(trabajo[:2], _recalcular_trabajo(trabajo))
+    else:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            futuros = {pool.submit(_recalcular_trabajo, trabajo): trabajo[:2] for trabajo in trabajos}
+            for futuro in as_completed(futuros):
+                anotar(futuros[futuro], futuro.result())
+    return [resultados[par] for par in pares]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recalcula versiones guardadas y exporta sus tablas sin Streamlit.")
+    parser.add_argument("objetivos", nargs="*", metavar="PROYECTO[/VERSIÓN]", help="Proyectos o versiones a recalcular")
+    parser.add_argument("--todos", action="store_true", help="Recalcular todos los proyectos (versión más reciente)")
+    parser.add_argument("--formato", nargs="+", choices=FORMATOS, default=["csv"], help="Formatos de salida (por defecto: csv)")
+    parser.add_argument("--salida", default="salida_recalculo", help="Carpeta de salida (por defecto: ./salida_recalculo)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto: uno por núcleo)")
+    args = parser.parse_args(argv)
+
+    if args.todos and args.objetivos:
+        parser.error("--todos no admite proyectos concretos.")
+    pares = seleccionar([] if args.todos else args.objetivos)
+    if not pares:
+        print("No hay proyectos que recalcular.", file=sys.stderr)
+        return 1
+
+    def informar(resultado):
+        nombre = f"{resultado['proyecto']} / {resultado['version'] or '-'}"
+        if resultado["error"] is None:
+            print(f"✅ {nombre}: {resultado['segundos']:.2f} s, {len(resultado['archivos'])} archivos", flush=True)
+        else:
+            print(f"❌ {nombre}: {resultado['error']}", file=sys.stderr, flush=True)
+
+    inicio = time.perf_counter()
+    resultados = recalcular(pares, args.salida, args.formato, args.procesos, al_terminar=informar)
+    errores = sum(1 for r in resultados if r["error"] is not None)
+    print(
+        f"{len(resultados) - errores}/{len(resultados)} versiones recalculadas en "
+        f"{time.perf_counter() - inicio:.1f} s → {args.salida}"
+    )
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Análisis de sensibilidad: barridos en rejilla, tornado y mapas de calor.
+
+Los escenarios se evalúan por lotes con escenarios.ModeloEscenarios. Las
+rejillas grandes se reparten además en trozos entre un pool de procesos: cada
+proceso prepara el modelo una sola vez (en su inicializador) y evalúa por
+lotes los trozos que recibe.
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import motor
+from escenarios import (
+    DESCUENTO_PRECIO,
+    DESPLAZAMIENTO_VENTAS,
+    METRICAS,
+    RETRASO_COMERCIALIZACION,
+    RETRASO_INICIO_OBRA,
+    VARIABLES,
+    VARIABLES_ENTERAS,
+    ModeloEscenarios,
+    valor_base,
+)
+
+# Escenarios por trozo enviado a cada proceso del pool; por debajo de este
+# número la rejilla se evalúa en el propio proceso
+TAM_TROZO = 2048
+
+
+def rango_por_defecto(parametros: motor.ParametrosProyecto, variable: str):
+    """
+    Rango (mínimo, máximo) propuesto para una variable: ±20 % del valor base,
+    unos meses de retraso para las variables de calendario y hasta un 10 % de
+    descuento.
+    """
+    if variable in (DESPLAZAMIENTO_VENTAS, RETRASO_INICIO_OBRA, RETRASO_COMERCIALIZACION):
+        return 0, 6
+    if variable == DESCUENTO_PRECIO:
+        return 0.0, 10.0
+    base = valor_base(parametros, variable)
+    if variable == "plazo_obra_meses":
+        return max(1, base - 3), base + 6
+    if variable in VARIABLES_ENTERAS:
+        return max(1, int(round(base * 0.8))), max(1, int(round(base * 1.2)))
+    return float(base) * 0.8, float(base) * 1.2
+
+
+def valores_rango(variable: str, minimo, maximo, pasos: int) -> np.ndarray:
+    """
+    Valores equiespaciados entre mínimo y máximo (enteros y sin repetir para
+    las variables enteras).
+    """
+    valores = np.linspace(minimo, maximo, max(int(pasos), 1))
+    if variable in VARIABLES_ENTERAS:
+        valores = np.unique(np.round(valores).astype(np.int64))
+    return valores
+
+
+def rejilla(valores: dict) -> pd.DataFrame:
+    """
+    Producto cartesiano de los valores de cada variable ({variable: valores}):
+    una fila por escenario y una columna por variable.
+    """
+    for variable in valores:
+        if variable not in VARIABLES:
+            raise ValueError(f"Variable de escenario desconocida: {variable}")
+    combinaciones = list(itertools.product(*valores.values()))
+    return pd.DataFrame(combinaciones, columns=list(valores))
+
+
+_modelo = None
+
+
+def _iniciar_proceso(entradas: tuple) -> None:
+    global _modelo
+    _modelo = ModeloEscenarios(*entradas)
+
+
+def _evaluar_trozo(cambios: dict) -> dict:
+    return _modelo.evaluar(cambios)
+
+
+def evaluar_rejilla(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    df_rejilla: pd.DataFrame,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+    procesos: int = None,
+    tam_trozo: int = TAM_TROZO,
+) -> pd.DataFrame:
+    """
+    Evalúa cada fila de df_rejilla (ver rejilla) y devuelve la rejilla con una
+    columna más por métrica (claves de escenarios.METRICAS). procesos es el
+    tamaño del pool (por defecto, uno por núcleo).
+    """
+    entradas = (parametros, df_viviendas, df_planificacion, df_capitulos)
+    cambios = {variable: df_rejilla[variable].to_numpy() for variable in df_rejilla.columns}
+    num = len(df_rejilla)
+    procesos = procesos or os.cpu_count() or 1
+
+    if procesos == 1 or num <= tam_trozo:
+        resultados = ModeloEscenarios(*entradas).evaluar(cambios) if num else {m: np.empty(0) for m in METRICAS}
+    else:
+        trozos = [
+            {variable: valores[inicio:inicio + tam_trozo] for variable, valores in cambios.items()}
+            for inicio in range(0, num, tam_trozo)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=min(procesos, len(trozos)), initializer=_iniciar_proceso, initargs=(entradas,)
+        ) as pool:
+            partes = list(pool.map(_evaluar_trozo, trozos))
+        resultados = {m: np.concatenate([parte[m] for parte in partes]) for m in METRICAS}
+
+    df_resultados = df_rejilla.reset_index(drop=True).copy()
+    for metrica in METRICAS:
+        df_resultados[metrica] = resultados[metrica]
+    return df_resultados
+
+
+def tornado(
+    parametros: motor.ParametrosProyecto,
+    df_viviendas: pd.DataFrame,
+    extremos: dict,
+    df_planificacion: pd.DataFrame = None,
+    df_capitulos: pd.DataFrame = None,
+):
+    """
+    Sensibilidad de una variable cada vez: evalúa cada variable en sus dos
+    extremos ({variable: (bajo, alto)}) con el resto en su valor base.
+    Devuelve (df_tornado, base): una fila por variable con 'Variable',
+    'Valor bajo', 'Valor alto' y '<métrica> bajo' / '<métrica> alto' para cada
+    métrica, y las métricas del escenario base.
+    """
+    variables = list(extremos)
+    num = 1 + 2 * len(variables)
+    cambios = {}
+    for i, variable in enumerate(variables):
+        valores = np.full(num, valor_base(parametros, variable), dtype=np.float64)
+        valores[1 + 2 * i] = extremos[variable][0]
+        valores[2 + 2 * i] = extremos[variable][1]
+        cambios[variable] = valores
+    resultados = ModeloEscenarios(parametros, df_viviendas, df_planificacion, df_capitulos).evaluar(cambios)
+
+    base = {metrica: float(resultados[metrica][0]) for metrica in METRICAS}
+    filas = []
+    for i, variable in enumerate(variables):
+        fila = {
+            "Variable": variable,
+            "Valor bajo": extremos[variable][0],
+            "Valor alto": extremos[variable][1],
+        }
+        for metrica in METRICAS:
+            fila[f"{metrica} bajo"] = float(resultados[metrica][1 + 2 * i])
+            fila[f"{metrica} alto"] = float(resultados[metrica][2 + 2 * i])
+        filas.append(fila)
+    return pd.DataFrame(filas), base
+
+
+def mapa_calor(df_resultados: pd.DataFrame, x: str, y: str, metrica: str) -> pd.DataFrame:
+    """
+    Tabla y x x de una métrica de un barrido. Si la rejilla tiene más
+    variables, cada celda es la media sobre el resto.
+    """
+    return df_resultados.pivot_table(index=y, columns=x, values=metrica, aggfunc="mean").sort_index(ascending=False)
@@ -1,26 +1,51 @@
+import time
+
+_inicio_ejecucion = time.perf_counter()
+
+import functools
 import os
+import sys
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from datetime import date
 from dateutil.relativedelta import relativedelta
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import time
 
+import catalogo
 from versionado import (
-    guardar_version,
+    GUARDADO_COMPLETO,
+    GUARDADO_ERROR,
+    GUARDADO_PENDIENTE,
+    guardar_version_en_segundo_plano,
+    estado_guardado,
     cargar_version,
-    listar_versiones,
+    claves_parametros,
     duplicar_version,
     eliminar_version,
 )
 
+# Elementos por página en los selectores de proyectos y versiones
+TAM_PAGINA = 20
+
 # 1) ¡SET_PAGE_CONFIG SIEMPRE PRIMERO!
 st.set_page_config(
     page_title="Flujo de Caja – Promoción Inmobiliaria",
     layout="wide",
 )
 
+# Informe de arranque: tiempos de la primera ejecución de la sesión
+if "tiempos_arranque" not in st.session_state:
+    st.session_state.tiempos_arranque = {}
+
+
+def _registrar_tiempo(concepto: str, segundos: float = None) -> None:
+    """
+    Guarda (solo la primera vez) el tiempo transcurrido desde el inicio de la
+    ejecución actual del script, o el indicado.
+    """
+    if segundos is None:
+        segundos = time.perf_counter() - _inicio_ejecucion
+    st.session_state.tiempos_arranque.setdefault(concepto, segundos)
+
 # 2) Pantalla de bienvenida / carga
 if "pantalla_carga" not in st.session_state:
     st.session_state.pantalla_carga = True
@@ -35,11 +60,13 @@ if st.session_state.pantalla_carga:
         "<p style='text-align: center;'>Cargando aplicación... por favor espera</p>",
         unsafe_allow_html=True,
     )
-    with st.spinner("Inicializando módulos..."):
-        time.sleep(2.5)
     if st.button("Entrar"):
         st.session_state.pantalla_carga = False
         st.rerun()
+    _registrar_tiempo("Bienvenida interactiva (s)")
+    st.caption(
+        f"⏱️ Interactivo en {st.session_state.tiempos_arranque['Bienvenida interactiva (s)'] * 1000:,.0f} ms"
+    )
     st.stop()
 
 # 3) Botón universal para “volver al selector” en cualquier momento
@@ -48,18 +75,33 @@ if "selected_project" in st.session_state:
         del st.session_state.selected_project
         st.rerun()
 
-# 4) Definición de carpeta base de proyectos/versiones
+# 4) Definición de carpeta base de proyectos/versiones. El catálogo (SQLite)
+# se genera recorriendo la carpeta solo la primera vez; después lo mantienen
+# al día guardar/duplicar/eliminar versión.
 CARPETA_BASE = os.path.join(os.getcwd(), "versiones")
 os.makedirs(CARPETA_BASE, exist_ok=True)
+catalogo.asegurar()
+
+
+def _pagina(total: int, clave: str) -> int:
+    """
+    Selector de página para listas paginadas; devuelve el desplazamiento.
+    """
+    num_paginas = max(1, -(-total // TAM_PAGINA))
+    if num_paginas == 1:
+        return 0
+    # Una búsqueda nueva puede dejar la página anterior fuera de rango
+    if st.session_state.get(clave, 1) > num_paginas:
+        st.session_state[clave] = 1
+    pagina = st.number_input(
+        f"Página (de {num_paginas})", min_value=1, max_value=num_paginas, value=1, step=1, key=clave
+    )
+    return (int(pagina) - 1) * TAM_PAGINA
+
 
 # 5) Selector / creación de proyecto
 if "selected_project" not in st.session_state:
     st.title("📂 Seleccionar o crear proyecto")
-    proyectos = [
-        d
-        for d in os.listdir(CARPETA_BASE)
-        if os.path.isdir(os.path.join(CARPETA_BASE, d))
-    ]
 
     col1, col2 = st.columns(2)
     with col1:
@@ -69,27 +111,195 @@ if "selected_project" not in st.session_state:
                 os.makedirs(
                     os.path.join(CARPETA_BASE, nuevo.strip()), exist_ok=True
                 )
+                catalogo.registrar_proyecto(nuevo.strip())
                 st.session_state.selected_project = nuevo.strip()
                 st.rerun()
             else:
                 st.error("Escribe un nombre válido")
 
     with col2:
+        busqueda = st.text_input("🔎 Buscar proyecto", key="buscar_proj")
+        _, total_proyectos = catalogo.buscar_proyectos(busqueda, limite=0)
+        desplazamiento = _pagina(total_proyectos, "pagina_proj")
+        proyectos, _ = catalogo.buscar_proyectos(busqueda, TAM_PAGINA, desplazamiento)
         if proyectos:
             sel = st.selectbox(
-                "📑 Proyectos existentes", proyectos, key="sel_proj"
+                f"📑 Proyectos existentes ({total_proyectos})", proyectos, key="sel_proj"
             )
             if st.button("Cargar proyecto", key="btn_sel"):
                 st.session_state.selected_project = sel
                 st.rerun()
+        elif busqueda.strip():
+            st.info("Ningún proyecto coincide con la búsqueda.")
         else:
             st.info("No hay proyectos todavía. Crea uno nuevo a la izquierda.")
+        if st.button("🔄 Reindexar catálogo", key="btn_reindexar"):
+            catalogo.reconstruir()
+            st.rerun()
 
+    _registrar_tiempo("Selector de proyecto interactivo (s)")
     st.stop()  # 🚧 Cortamos aquí hasta que el usuario elija/cree un proyecto
 
-# 6) A partir de aquí YA hay un proyecto en sesión
+# 6) A partir de aquí YA hay un proyecto en sesión. Los módulos de cálculo
+# (pandas) solo se cargan ahora; Plotly se importa al dibujar el primer gráfico.
+_pandas_en_frio = "pandas" not in sys.modules
+_inicio_importacion = time.perf_counter()
+import numpy as np
+import pandas as pd
+
+import cache_lecturas
+import cartera
+import etapas
+import graficos
+import ingesta
+import memoria
+import montecarlo
+import motor
+import objetivos
+import perfilado
+import sensibilidad
+
+if _pandas_en_frio:
+    _registrar_tiempo("Importación pandas + motor (s)", time.perf_counter() - _inicio_importacion)
+
+# Perfilado de etapas: en todo el servidor con PERFILADO=1 o en esta sesión con ?debug=1
+_contexto = get_script_run_ctx()
+_id_sesion = _contexto.session_id if _contexto is not None else "local"
+_modo_depuracion = st.query_params.get("debug") == "1"
+_perfilado = perfilado.ACTIVO or _modo_depuracion
+# tracemalloc afecta a todo el proceso: solo con el perfilado de servidor
+if perfilado.ACTIVO:
+    perfilado.activar_memoria()
+
+
+def _medir(etapa: str, filas: int = None):
+    return perfilado.medir(_id_sesion, etapa, filas, _perfilado)
+
+
+# Entradas y etapas compartidas por las secciones. Cada sección las pide al
+# dibujarse; las etapas se resuelven desde la caché (etapas.py).
+COLUMNAS_PLANIFICACION = ["Capítulo", "Inicio", "Duración (meses)"]
+
+
+def _parametros() -> motor.ParametrosProyecto:
+    return motor.ParametrosProyecto(**{clave: st.session_state[clave] for clave in claves_parametros()})
+
+
+def _capitulos(coste_total_ejecucion: float) -> pd.DataFrame:
+    """
+    Capítulos con los pesos de la versión cargada (o del archivo subido en
+    'Costes') o, si no hay, los pesos por defecto.
+    """
+    with _medir("Capítulos") as medida:
+        if st.session_state.get("df_capitulos") is not None:
+            df_capitulos = motor.capitulos_desde_pesos(st.session_state["df_capitulos"], coste_total_ejecucion)
+        else:
+            df_capitulos = motor.capitulos_por_defecto(coste_total_ejecucion)
+        medida.filas = len(df_capitulos)
+    return df_capitulos
+
+
+def _planificacion(df_capitulos: pd.DataFrame, fecha_inicio_obra: date) -> pd.DataFrame:
+    """
+    Planificación vigente: la base del editor de 'Costes' (la de la versión
+    cargada, con los cambios ya hechos en el editor) o la de por defecto.
+    """
+    df_planificacion = st.session_state.get("df_planificacion_base")
+    if df_planificacion is None:
+        df_planificacion = motor.planificacion_por_defecto(df_capitulos, fecha_inicio_obra)
+    return df_planificacion[COLUMNAS_PLANIFICACION]
+
+
+def _conservar_ediciones() -> None:
+    """
+    Pasa los cambios pendientes del editor de planificación a su tabla base.
+    El estado del editor se pierde cuando 'Costes' no se dibuja; así, al
+    volver, el editor empieza de nuevo desde la planificación ya editada.
+    """
+    version = st.session_state.get("version_planificacion", 0)
+    edicion = st.session_state.get(f"editor_planificacion_{version}") or {}
+    if any(edicion.get(cambios) for cambios in ("edited_rows", "added_rows", "deleted_rows")):
+        st.session_state["df_planificacion_base"] = st.session_state["df_planificacion"]
+        st.session_state["version_planificacion"] = version + 1
+
+
+def _gantt(df_planificacion: pd.DataFrame, df_capitulos: pd.DataFrame):
+    with _medir("Gantt", len(df_planificacion)):
+        df_gantt = df_planificacion.copy()
+        df_gantt["Fin"] = pd.to_datetime(df_gantt["Inicio"]) + df_gantt["Duración (meses)"].apply(lambda m: relativedelta(months=int(m)))
+        return graficos.gantt(df_gantt, df_capitulos["Capítulo"])
+
+
+def _ingresos(p: motor.ParametrosProyecto):
+    """
+    Ingresos y comisiones mensuales; None sin tabla de viviendas.
+    """
+    df_viviendas = st.session_state.get("df_viviendas")
+    if df_viviendas is None:
+        return None
+    with _medir("Ingresos y comisiones", len(df_viviendas)):
+        return etapas.ingresos(
+            df_viviendas,
+            p.fecha_entrega_viviendas,
+            p.reserva_fija,
+            p.pct_contrato,
+            p.pct_aplazado,
+            p.iva_venta,
+            p.comisiones_venta,
+            p.iva_otros,
+        )
+
+
+def _cronograma(df_planificacion: pd.DataFrame, df_capitulos: pd.DataFrame, coste_total_ejecucion: float) -> pd.DataFrame:
+    with _medir("Cronograma de ejecución", len(df_planificacion)):
+        return etapas.cronograma(df_planificacion[COLUMNAS_PLANIFICACION], df_capitulos, coste_total_ejecucion)
+
+
+def _otros_costes(p: motor.ParametrosProyecto) -> dict:
+    df_viviendas = st.session_state.get("df_viviendas")
+    with _medir("Otros costes", None if df_viviendas is None else len(df_viviendas)):
+        return etapas.otros_costes(
+            df_viviendas,
+            p.fecha_inicio_obra,
+            p.fecha_inicio_comercializacion,
+            p.plazo_obra_meses,
+            p.coste_suelo,
+            p.coste_total_ejecucion,
+            p.porcentaje_honorarios,
+            p.porcentaje_admin,
+            p.gastos_financieros,
+        )
+
+
+def _flujo(p: motor.ParametrosProyecto):
+    """
+    Flujo de caja mensual con la cuenta especial; None sin ingresos.
+    """
+    inicio = time.perf_counter()
+    df_ingresos = _ingresos(p)
+    if df_ingresos is None:
+        return None
+    df_capitulos = _capitulos(p.coste_total_ejecucion)
+    df_cronograma = _cronograma(_planificacion(df_capitulos, p.fecha_inicio_obra), df_capitulos, p.coste_total_ejecucion)
+    df_total_costes = _otros_costes(p)["total"]
+    with _medir("Flujo de caja") as medida:
+        df_merge = etapas.flujo_caja(df_ingresos, df_cronograma, df_total_costes)
+        medida.filas = len(df_merge)
+    _registrar_tiempo("Primera ejecución completa del modelo (s)", time.perf_counter() - inicio)
+    return df_merge
+
+
 nombre_proyecto = st.session_state.selected_project
 st.title(f"🧮 Modelo de Flujo de Caja – {nombre_proyecto}")
+_informe_arranque = st.sidebar.empty()
+
+# Solo se dibuja la sección elegida y Streamlit borra el estado de los widgets
+# que no se dibujan en una ejecución: los parámetros del modelo se reasignan
+# aquí (con su valor por defecto la primera vez) para conservarlos entre
+# secciones, y los cambios del editor de planificación pasan a su tabla base.
+for _clave, _valor in motor.ParametrosProyecto().como_dict().items():
+    st.session_state[_clave] = st.session_state.get(_clave, _valor)
+_conservar_ediciones()
 
 # 7) Aquí arrancarían tus pestañas (tabs = st.tabs([...]))
 # ...
@@ -103,10 +313,14 @@ with st.expander("🕒 Versiones del proyecto", expanded=False):
     )
 
     def _guardar():
-        guardar_version(nombre_nueva.strip(), nombre_proyecto)
-        st.session_state["msg_version"] = (
-            f"✅ Versión '{nombre_nueva.strip()}' guardada"
-        )
+        # La planificación vigente, aunque 'Costes' no se haya dibujado
+        _conservar_ediciones()
+        p = _parametros()
+        st.session_state["df_planificacion"] = _planificacion(_capitulos(p.coste_total_ejecucion), p.fecha_inicio_obra)
+        # La escritura sigue en segundo plano; aquí solo se copian las entradas
+        with _medir("Guardar versión"):
+            ficha = guardar_version_en_segundo_plano(nombre_nueva.strip(), nombre_proyecto)
+        st.session_state.setdefault("guardados", []).append((ficha, nombre_nueva.strip()))
 
     st.button(
         "Guardar versión",
@@ -114,17 +328,61 @@ with st.expander("🕒 Versiones del proyecto", expanded=False):
         disabled=(not nombre_nueva.strip()),
         key="btn_guardar",
     )
+
+    @st.fragment(run_every=1.0 if st.session_state.get("guardados") else None)
+    def _estado_guardados():
+        """
+        Guardados en segundo plano de la sesión: se consultan cada segundo
+        mientras queda alguno pendiente, y al terminar uno se vuelve a
+        ejecutar la app para que aparezca en la lista de versiones.
+        """
+        guardados = st.session_state.get("guardados", [])
+        pendientes = []
+        for ficha, version in guardados:
+            estado, error = estado_guardado(ficha)
+            if estado == GUARDADO_PENDIENTE:
+                pendientes.append((ficha, version))
+                st.info(f"⏳ Guardando la versión '{version}'...")
+            elif estado == GUARDADO_COMPLETO:
+                st.session_state["msg_version"] = f"✅ Versión '{version}' guardada"
+            elif estado == GUARDADO_ERROR:
+                st.session_state["error_version"] = f"❌ No se ha podido guardar la versión '{version}': {error}"
+        if len(pendientes) < len(guardados):
+            st.session_state["guardados"] = pendientes
+            st.rerun()
+
+    _estado_guardados()
     if st.session_state.get("msg_version"):
         st.success(st.session_state.pop("msg_version"))
-
-    # — Histórico y acciones
-    versiones = listar_versiones(nombre_proyecto)
+    if st.session_state.get("error_version"):
+        st.error(st.session_state.pop("error_version"))
+
+    # — Histórico y acciones (desde el catálogo, con búsqueda y paginación)
+    busqueda_version = st.text_input("🔎 Buscar versión", key="buscar_version")
+    _, total_versiones = catalogo.buscar_versiones(nombre_proyecto, busqueda_version, limite=0)
+    desplazamiento = _pagina(total_versiones, "pagina_version")
+    versiones, _ = catalogo.buscar_versiones(nombre_proyecto, busqueda_version, TAM_PAGINA, desplazamiento)
     if not versiones:
-        st.info("No hay versiones guardadas todavía.")
+        if busqueda_version.strip():
+            st.info("Ninguna versión coincide con la búsqueda.")
+        else:
+            st.info("No hay versiones guardadas todavía.")
     else:
+        def _kpis(v):
+            partes = []
+            if v["margen"] is not None:
+                partes.append(f"margen {v['margen']:,.0f} €")
+            if v["pico_financiacion"] is not None:
+                partes.append(f"pico financiación {v['pico_financiacion']:,.0f} €")
+            return " · ".join(partes)
+
         opciones = [v["nombre"] for v in versiones]
-        fechas = [v["fecha"].strftime("%Y-%m-%d %H:%M") for v in versiones]
-        display = [f"{n} ({f})" for n, f in zip(opciones, fechas)]
+        display = []
+        for v in versiones:
+            detalle = v["fecha"].strftime("%Y-%m-%d %H:%M")
+            if _kpis(v):
+                detalle += f" · {_kpis(v)}"
+            display.append(f"{v['nombre']} ({detalle})")
 
         seleccion = st.selectbox(
             "Selecciona una versión",
@@ -137,7 +395,8 @@ with st.expander("🕒 Versiones del proyecto", expanded=False):
 
         # → Cargar
         def _cargar():
-            cargar_version(seleccion, nombre_proyecto)
+            with _medir("Cargar versión"):
+                cargar_version(seleccion, nombre_proyecto)
             st.session_state["msg_version"] = "🔄 Versión cargada"
 
         with c1:
@@ -174,311 +433,349 @@ with st.expander("🕒 Versiones del proyecto", expanded=False):
         if st.session_state.get("msg_version"):
             st.info(st.session_state.pop("msg_version"))
 
-# 8) Aquí continúa el resto de tu aplicación: pestañas con Inputs, cálculos, gráficas…
+# 8) Secciones de la app. Solo se ejecuta la sección elegida (st.tabs ejecuta
+# el cuerpo de todas las pestañas en cada interacción): cada una calcula lo que
+# muestra y toma de la caché de etapas los resultados de las anteriores.
+
+
+def _seccion(funcion):
+    """
+    Convierte una sección en fragmento: sus widgets vuelven a ejecutar solo la
+    sección. Esas ejecuciones parciales no llegan al final del script, así que
+    el perfilado se cierra al terminar la sección.
+    """
+    @st.fragment
+    @functools.wraps(funcion)
+    def fragmento():
+        inicio = time.perf_counter()
+        funcion()
+        contexto = get_script_run_ctx()
+        if _perfilado and contexto is not None and contexto.fragment_ids_this_run:
+            perfilado.cerrar(_id_sesion, time.perf_counter() - inicio)
+
+    return fragmento
+
+
+@_seccion
+def _seccion_cartera():
+    st.header("🏢 Cartera consolidada")
+    st.caption(
+        "Suma mes a mes el flujo de caja y las necesidades de financiación de la versión elegida "
+        "de cada proyecto activo (por defecto, la más reciente)."
+    )
 
-tabs = st.tabs(["Inputs Generales", "Ingresos y Comisiones", "Costes", "Flujo de Caja", "Resumen"])
+    seleccion_cartera = catalogo.versiones_cartera(incluir_inactivos=True)
+    df_seleccion = pd.DataFrame(
+        [{"Activo": s["activo"], "Proyecto": s["proyecto"], "Versión": s["version"]} for s in seleccion_cartera],
+        columns=["Activo", "Proyecto", "Versión"],
+    )
+    df_seleccion_editada = st.data_editor(
+        df_seleccion,
+        disabled=["Proyecto", "Versión"],
+        hide_index=True,
+        use_container_width=True,
+        key="editor_cartera",
+    )
+    for (_, original), (_, editada) in zip(df_seleccion.iterrows(), df_seleccion_editada.iterrows()):
+        if bool(original["Activo"]) != bool(editada["Activo"]):
+            catalogo.activar_cartera(editada["Proyecto"], bool(editada["Activo"]))
+
+    with st.expander("🔀 Elegir la versión de un proyecto"):
+        proyectos_cartera = df_seleccion["Proyecto"].tolist()
+        if proyectos_cartera:
+            proyecto_cartera = st.selectbox("Proyecto", proyectos_cartera, key="cartera_proyecto")
+            versiones_proyecto, _ = catalogo.buscar_versiones(proyecto_cartera, limite=1000)
+            opciones_version = ["(la más reciente)"] + [v["nombre"] for v in versiones_proyecto]
+            version_cartera = st.selectbox("Versión", opciones_version, key="cartera_version")
+            if st.button("Guardar elección", key="btn_cartera_version"):
+                catalogo.fijar_cartera(
+                    proyecto_cartera,
+                    None if version_cartera == opciones_version[0] else version_cartera,
+                    activo=True,
+                )
+                st.rerun()
 
+    if st.button("📊 Consolidar cartera", key="btn_cartera"):
+        activos = catalogo.versiones_cartera()
+        barra = st.progress(0.0, text="Evaluando proyectos...")
+        inicio = time.perf_counter()
+        cartera.evaluar_versiones(
+            activos,
+            al_avanzar=lambda hechos, total: barra.progress(hechos / max(total, 1), text=f"Evaluando proyectos... {hechos}/{total}"),
+        )
+        etapas.consolidar_cartera(activos)
+        # En sesión solo queda la selección; el consolidado está en la caché
+        st.session_state["cartera"] = activos
+        st.session_state["cartera_segundos"] = time.perf_counter() - inicio
+        barra.empty()
+
+    seleccion_consolidada = st.session_state.get("cartera")
+    if seleccion_consolidada is not None:
+        resultado_cartera = etapas.consolidar_cartera(seleccion_consolidada)
+        df_proyectos = resultado_cartera.proyectos
+        con_error = df_proyectos[df_proyectos["Error"].notna()]
+        st.success(
+            f"✅ {len(df_proyectos) - len(con_error)} proyectos consolidados "
+            f"en {st.session_state.get('cartera_segundos', 0):.2f} s"
+        )
+        if not con_error.empty:
+            st.warning(f"⚠️ {len(con_error)} proyectos no se han podido evaluar (ver tabla de proyectos).")
+
+        df_consolidado = resultado_cartera.consolidado
+        if not df_consolidado.empty:
+            col_c1, col_c2, col_c3 = st.columns(3)
+            col_c1.metric("Pico de financiación del grupo", f"{max(0.0, -df_consolidado['Flujo acumulado (€)'].min()):,.0f} €")
+            col_c2.metric("Necesidades totales", f"{-df_consolidado['Total necesidades financiación (€)'].sum():,.0f} €")
+            col_c3.metric("Margen agregado", f"{df_proyectos['Margen (€)'].sum():,.0f} €")
+
+            st.plotly_chart(
+                graficos.linea(df_consolidado, "Mes", ["Flujo acumulado (€)", "Necesidades acumuladas (€)"], "Flujo acumulado y necesidades del grupo", "€"),
+                use_container_width=True,
+            )
+            st.plotly_chart(
+                graficos.apilado(cartera.agrupar_resto(resultado_cartera.por_proyecto["Flujo acumulado (€)"]), "Flujo acumulado por proyecto"),
+                use_container_width=True,
+            )
+            st.plotly_chart(
+                graficos.apilado(
+                    cartera.agrupar_resto(resultado_cartera.por_proyecto["Total necesidades financiación (€)"]),
+                    "Necesidades de financiación mensuales por proyecto",
+                    barras=True,
+                ),
+                use_container_width=True,
+            )
 
-# === Inicialización de fechas por defecto ===
-if "fecha_inicio_obra" not in st.session_state:
-    st.session_state["fecha_inicio_obra"] = date.today()
-if "fecha_inicio_comercializacion" not in st.session_state:
-    st.session_state["fecha_inicio_comercializacion"] = date.today()
-if "plazo_obra_meses" not in st.session_state:
-    st.session_state["plazo_obra_meses"] = 18
+            st.subheader("📋 Consolidado mensual")
+            st.dataframe(df_consolidado, use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Descargar consolidado (CSV)",
+                data=df_consolidado.to_csv(index=False),
+                file_name="cartera_consolidado.csv",
+                mime="text/csv",
+            )
+
+            serie_cartera = st.selectbox("Detalle por proyecto", list(resultado_cartera.por_proyecto), key="cartera_serie")
+            st.dataframe(resultado_cartera.por_proyecto[serie_cartera], use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Descargar detalle por proyecto (CSV)",
+                data=resultado_cartera.por_proyecto[serie_cartera].to_csv(index=False),
+                file_name="cartera_por_proyecto.csv",
+                mime="text/csv",
+            )
 
-fecha_inicio_obra = st.session_state["fecha_inicio_obra"]
-fecha_inicio_comercializacion = st.session_state["fecha_inicio_comercializacion"]
-plazo_obra_meses = st.session_state["plazo_obra_meses"]
+        st.subheader("🏗️ Proyectos")
+        st.dataframe(df_proyectos, use_container_width=True, hide_index=True)
 
-with tabs[0]:
+
+@_seccion
+def _seccion_inputs():
     st.header("📋 Datos Generales del Proyecto")
 
     st.markdown("### 📋 Cargar viviendas desde tabla Excel")
-    fecha_fin_obra = fecha_inicio_obra + relativedelta(months=plazo_obra_meses)
-    fecha_entrega_viviendas = fecha_fin_obra + relativedelta(months=3)
-    
+    fecha_entrega_viviendas = _parametros().fecha_entrega_viviendas
+
+    def _cargar_viviendas(ingesta_viviendas, origen: str) -> None:
+        """
+        Muestra el resultado de leer la tabla de viviendas (pegada o subida)
+        y la deja en sesión para las siguientes secciones.
+        """
+        df_viviendas = ingesta_viviendas.viviendas
+        st.success(f"✅ {len(df_viviendas)} viviendas cargadas correctamente")
+        df_errores = ingesta_viviendas.errores
+        if not df_errores.empty:
+            descartadas = df_errores.loc[df_errores["Descartada"], "Fila"].nunique()
+            st.warning(
+                f"⚠️ {df_errores['Fila'].nunique()} filas con problemas "
+                f"({descartadas} descartadas por no tener un precio válido)."
+            )
+            st.dataframe(df_errores.head(1000), use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Descargar filas con problemas (CSV)",
+                data=df_errores.to_csv(index=False),
+                file_name="viviendas_errores.csv",
+                mime="text/csv",
+                key=f"descargar_errores_{origen}",
+            )
+        if len(df_viviendas) > 1000:
+            st.caption("Se muestran las primeras 1.000 viviendas.")
+        st.dataframe(df_viviendas.head(1000), use_container_width=True)
+
+        # Guardar para siguientes secciones
+        st.session_state["df_viviendas"] = df_viviendas
+
+        # Actualizar inputs calculados
+        st.session_state["num_viviendas"] = len(df_viviendas)
+        st.session_state["precio_medio_venta"] = df_viviendas["Precio"].mean()
+
     with st.expander("📥 Pegar tabla de viviendas desde Excel (Código, Precio, Fecha venta, Fecha escrituración)", expanded=False):
         texto_pegado = st.text_area("📋 Copia y pega aquí la tabla desde Excel (incluyendo cabecera)", height=200)
 
         if texto_pegado.strip():
             try:
-                from io import StringIO
-
                 # Convertimos el texto pegado en un DataFrame
-                data = StringIO(texto_pegado)
-                df_viviendas = pd.read_csv(data, sep="\t")
+                try:
+                    with _medir("Lectura de viviendas") as medida:
+                        ingesta_viviendas = etapas.leer_viviendas(texto_pegado, fecha_entrega_viviendas)
+                        medida.filas = ingesta_viviendas.filas_leidas
+                except ValueError:
+                    st.error("❌ La tabla debe tener al menos las columnas: Código, Precio y Fecha venta.")
+                    ingesta_viviendas = None
 
-                # Normalizar nombres de columnas (por si llevan espacios)
-                df_viviendas.columns = [c.strip().lower() for c in df_viviendas.columns]
+                if ingesta_viviendas is not None:
+                    _cargar_viviendas(ingesta_viviendas, "pegado")
 
-                # Detectar columnas esperadas (flexible a variaciones)
-                col_codigo = next((c for c in df_viviendas.columns if "código" in c or "codigo" in c or "id" == c), None)
-                col_precio = next((c for c in df_viviendas.columns if "precio" in c), None)
-                col_venta = next((c for c in df_viviendas.columns if "venta" in c), None)
-                col_escritura = next((c for c in df_viviendas.columns if "escritu" in c), None)
+            except Exception as e:
+                st.error(f"❌ Error al procesar la tabla: {e}")
 
-                if not col_codigo or not col_precio or not col_venta:
-                    st.error("❌ La tabla debe tener al menos las columnas: Código, Precio y Fecha venta.")
+    with st.expander("📤 Subir tabla de viviendas en Excel (.xlsx)", expanded=False):
+        archivo_viviendas = st.file_uploader("Libro de Excel con una hoja de viviendas", type=["xlsx"], key="xlsx_viviendas")
+        if archivo_viviendas:
+            try:
+                contenido_xlsx = archivo_viviendas.getvalue()
+                hoja_viviendas = st.selectbox("Hoja", etapas.hojas_xlsx(contenido_xlsx), key="xlsx_viviendas_hoja")
+                columnas_hoja = etapas.cabecera_xlsx(contenido_xlsx, hoja_viviendas)
+                try:
+                    detectadas = {v: k for k, v in ingesta.detectar_columnas(columnas_hoja).items()}
+                except ValueError:
+                    detectadas = {}
+
+                st.caption("Columnas de la hoja que corresponden a cada dato")
+                mapeo_viviendas = {}
+                columnas_mapeo = st.columns(len(ingesta.COLUMNAS))
+                for columna_destino, col_mapeo in zip(ingesta.COLUMNAS, columnas_mapeo):
+                    opciones = ["—"] + columnas_hoja
+                    actual = detectadas.get(columna_destino)
+                    with col_mapeo:
+                        elegida = st.selectbox(
+                            columna_destino,
+                            opciones,
+                            index=opciones.index(actual) if actual in opciones else 0,
+                            key=f"xlsx_viviendas_{hoja_viviendas}_{columna_destino}",
+                        )
+                    if elegida != "—":
+                        mapeo_viviendas[elegida] = columna_destino
+
+                if len(set(mapeo_viviendas.values())) < len(mapeo_viviendas) or len(mapeo_viviendas) != len(set(mapeo_viviendas)):
+                    st.error("❌ Cada columna de la hoja solo puede asignarse a un dato.")
+                elif not {"Código", "Precio", "Fecha venta"} <= set(mapeo_viviendas.values()):
+                    st.info("ℹ️ Elige al menos las columnas de Código, Precio y Fecha venta.")
                 else:
-                    # Renombrar para trabajar cómodamente
-                    df_viviendas = df_viviendas.rename(columns={
-                        col_codigo: "Código",
-                        col_precio: "Precio",
-                        col_venta: "Fecha venta",
-                        col_escritura: "Fecha escrituración" if col_escritura else None
-                    })
-
-                    # Conversión robusta de fechas (soporta strings y datetime.date)
-                    for col in ["Fecha venta", "Fecha escrituración"]:
-                        if col in df_viviendas.columns:
-                            df_viviendas[col] = df_viviendas[col].apply(lambda x: pd.to_datetime(str(x), dayfirst=True, errors='coerce') if pd.notna(x) else pd.NaT)
-                        else:
-                            df_viviendas[col] = pd.NaT
-
-                    # Asignar fecha por defecto si no hay escrituración
-                    df_viviendas["Fecha escrituración"] = df_viviendas["Fecha escrituración"].fillna(fecha_entrega_viviendas)
-
-                    # Mostrar resumen
-                    st.success(f"✅ {len(df_viviendas)} viviendas cargadas correctamente")
-                    st.dataframe(df_viviendas, use_container_width=True)
-
-                    # Guardar para siguientes pestañas
-                    st.session_state["df_viviendas"] = df_viviendas
-
-                    # Actualizar inputs calculados
-                    st.session_state["num_viviendas"] = len(df_viviendas)
-                    st.session_state["precio_medio_venta"] = df_viviendas["Precio"].mean()
-
+                    with st.spinner("Leyendo el libro..."), _medir("Lectura de viviendas (.xlsx)") as medida:
+                        ingesta_viviendas = etapas.leer_viviendas_xlsx(
+                            contenido_xlsx, fecha_entrega_viviendas, hoja_viviendas, mapeo_viviendas
+                        )
+                        medida.filas = ingesta_viviendas.filas_leidas
+                    _cargar_viviendas(ingesta_viviendas, "xlsx")
             except Exception as e:
-                st.error(f"❌ Error al procesar la tabla: {e}")
+                st.error(f"❌ Error al procesar el libro: {e}")
 
-    # Inputs principales con valores que pueden ser sobreescritos desde la tabla pegada
+    # Inputs principales con valores que pueden ser sobreescritos desde la tabla
+    # pegada (los valores por defecto están en sesión, ver más arriba)
     col_a, col_b, col_c = st.columns(3)
     with col_a:
-        num_viviendas = st.number_input(
-            "Nº de viviendas",
-            min_value=1,
-            value=st.session_state.get("num_viviendas", 20),
-            key="num_viviendas"
-        )
-        superficie_total = st.number_input("Superficie construida total (m²)", min_value=0.0, value=2000.0)
-        precio_medio_venta = st.number_input(
-            "Precio medio de venta por vivienda (€)",
-            min_value=0.0,
-            value=st.session_state.get("precio_medio_venta", 350000.0),
-            key="precio_medio_venta"
-        )
+        st.number_input("Nº de viviendas", min_value=1, key="num_viviendas")
+        st.number_input("Superficie construida total (m²)", min_value=0.0, key="superficie_total")
+        st.number_input("Precio medio de venta por vivienda (€)", min_value=0.0, key="precio_medio_venta")
 
     with col_b:
-        coste_suelo = st.number_input("Coste del Suelo (€)", min_value=0.0, value=300000.0)
-        coste_ejecucion_m2 = st.number_input("Coste ejecución por m²", min_value=0.0, value=1600.0)
-        comisiones_venta = st.number_input("Comisiones (% sobre precio sin IVA)", min_value=0.0, max_value=100.0, value=15.0)
+        st.number_input("Coste del Suelo (€)", min_value=0.0, key="coste_suelo")
+        st.number_input("Coste ejecución por m²", min_value=0.0, key="coste_ejecucion_m2")
+        st.number_input("Comisiones (% sobre precio sin IVA)", min_value=0.0, max_value=100.0, key="comisiones_venta")
 
     with col_c:
-        porcentaje_honorarios = st.number_input("% Honorarios técnicos", min_value=0.0, max_value=100.0, value=5.0)
-        porcentaje_admin = st.number_input("% Gastos administración", min_value=0.0, max_value=100.0, value=4.0)
-        gastos_financieros = st.number_input("Gastos financieros por vivienda (€)", min_value=0.0, value=5000.0)
+        st.number_input("% Honorarios técnicos", min_value=0.0, max_value=100.0, key="porcentaje_honorarios")
+        st.number_input("% Gastos administración", min_value=0.0, max_value=100.0, key="porcentaje_admin")
+        st.number_input("Gastos financieros por vivienda (€)", min_value=0.0, key="gastos_financieros")
 
     st.header("📌 Parámetros Adicionales")
     col_iva1, col_iva2, col_iva3 = st.columns(3)
     with col_iva1:
-        iva_venta = st.number_input("IVA en ventas (%)", min_value=0.0, max_value=100.0, value=10.0)
+        st.number_input("IVA en ventas (%)", min_value=0.0, max_value=100.0, key="iva_venta")
     with col_iva2:
-        iva_ejecucion = st.number_input("IVA en costes de ejecución (%)", min_value=0.0, max_value=100.0, value=0.0)
+        st.number_input("IVA en costes de ejecución (%)", min_value=0.0, max_value=100.0, key="iva_ejecucion")
     with col_iva3:
-        iva_otros = st.number_input("IVA en otros gastos (%)", min_value=0.0, max_value=100.0, value=21.0)
+        st.number_input("IVA en otros gastos (%)", min_value=0.0, max_value=100.0, key="iva_otros")
 
     st.markdown("### 🗓️ Fechas del Proyecto")
     col_f1, col_f2, col_f3 = st.columns(3)
     with col_f1:
-        fecha_inicio_obra = st.date_input("Fecha de inicio de obra", value=fecha_inicio_obra, key="fecha_inicio_obra")
+        st.date_input("Fecha de inicio de obra", key="fecha_inicio_obra")
     with col_f2:
-        fecha_inicio_comercializacion = st.date_input("Inicio comercialización", value=fecha_inicio_comercializacion, key="fecha_inicio_comercializacion")
+        st.date_input("Inicio comercialización", key="fecha_inicio_comercializacion")
     with col_f3:
-        plazo_obra_meses = st.number_input("Plazo de ejecución (meses)", min_value=1, value=plazo_obra_meses, key="plazo_obra_meses")
+        st.number_input("Plazo de ejecución (meses)", min_value=1, key="plazo_obra_meses")
 
-with tabs[1]:
+
+@_seccion
+def _seccion_ingresos():
     st.header("💰 Ingresos")
     st.markdown("**Calendario de pagos del cliente**")
     col_res, col_con, col_apl, col_esc = st.columns(4)
     with col_res:
-        reserva_fija = st.number_input("Reserva (€ por vivienda)", min_value=0.0, value=10000.0)
+        st.number_input("Reserva (€ por vivienda)", min_value=0.0, key="reserva_fija")
     with col_con:
-        pct_contrato = st.number_input("Contrato (%) sobre precio con IVA", min_value=0.0, max_value=100.0, value=25.0)
+        st.number_input("Contrato (%) sobre precio con IVA", min_value=0.0, max_value=100.0, key="pct_contrato")
     with col_apl:
-        pct_aplazado = st.number_input("Aplazado (%) sobre precio con IVA", min_value=0.0, max_value=100.0, value=25.0)
+        st.number_input("Aplazado (%) sobre precio con IVA", min_value=0.0, max_value=100.0, key="pct_aplazado")
     with col_esc:
         st.text_input("Escritura (%)", value="Resto", disabled=True)
 
+    p = _parametros()
     st.subheader("📆 Calendario de proyecto")
-    fecha_fin_obra = fecha_inicio_obra + relativedelta(months=plazo_obra_meses)
-    fecha_entrega_viviendas = fecha_fin_obra + relativedelta(months=3)
-    st.caption(f"🏗️ Fin de obra estimado: **{fecha_fin_obra.strftime('%Y-%m-%d')}**")
-    st.caption(f"🏁 Entrega prevista: **{fecha_entrega_viviendas.strftime('%Y-%m-%d')}**")
+    st.caption(f"🏗️ Fin de obra estimado: **{p.fecha_fin_obra.strftime('%Y-%m-%d')}**")
+    st.caption(f"🏁 Entrega prevista: **{p.fecha_entrega_viviendas.strftime('%Y-%m-%d')}**")
 
     st.header("🏘️ Cronograma Real de Ingresos y Comisiones")
-    df_viviendas = st.session_state.get("df_viviendas")
+    df = _ingresos(p)
 
-    if df_viviendas is not None:
-        df_viviendas["Fecha venta"] = pd.to_datetime(df_viviendas["Fecha venta"], dayfirst=True, errors="coerce")
-        df_viviendas["Fecha escrituración"] = pd.to_datetime(df_viviendas["Fecha escrituración"], dayfirst=True, errors="coerce")
-
-        ingresos_dict = {}
-
-        fecha_min = df_viviendas["Fecha venta"].min().date()
-        fecha_max = df_viviendas["Fecha escrituración"].fillna(pd.Timestamp(fecha_entrega_viviendas)).dt.date.max() + relativedelta(months=3)
-
-        fecha_iter = fecha_min
-        while fecha_iter <= fecha_max:
-            key = fecha_iter.strftime("%Y-%m")
-            ingresos_dict[key] = {
-                "Reserva (€)": 0,
-                "Contrato (€)": 0,
-                "Aplazado (€)": 0,
-                "Escritura (€)": 0,
-                "Comisiones (€)": 0,
-            }
-            fecha_iter += relativedelta(months=1)
-
-        for _, row in df_viviendas.iterrows():
-            precio = row["Precio"]
-            precio_con_iva = precio * (1 + iva_venta / 100)
-            fecha_venta = row["Fecha venta"].date()
-            fecha_escritura = row["Fecha escrituración"].date() if pd.notnull(row["Fecha escrituración"]) else None
-            terminada = fecha_venta >= fecha_entrega_viviendas
-
-            restante = precio_con_iva - reserva_fija
-            importe_contrato = precio_con_iva * pct_contrato / 100
-            importe_aplazado = precio_con_iva * pct_aplazado / 100
-            importe_escritura = restante - importe_contrato - importe_aplazado
-
-            f_reserva = fecha_venta
-            f_contrato = f_reserva + relativedelta(months=1)
-            f_aplazado = f_contrato + relativedelta(months=3)
-
-            if fecha_escritura:
-                if not terminada:
-                    f_escritura = fecha_escritura
-                else:
-                    f_escritura = max(fecha_entrega_viviendas, fecha_venta + relativedelta(months=1))
-            else:
-                if not terminada:
-                    f_escritura = fecha_entrega_viviendas
-                else:
-                    f_escritura = max(fecha_entrega_viviendas, fecha_venta + relativedelta(months=1))
-
-            ingresos_dict[f_reserva.strftime("%Y-%m")]["Reserva (€)"] += reserva_fija
-            ingresos_dict[f_contrato.strftime("%Y-%m")]["Contrato (€)"] += importe_contrato
-            ingresos_dict[f_aplazado.strftime("%Y-%m")]["Aplazado (€)"] += importe_aplazado
-            ingresos_dict[f_escritura.strftime("%Y-%m")]["Escritura (€)"] += importe_escritura
-
-        for mes in ingresos_dict:
-            total_con_iva = sum([
-                ingresos_dict[mes]["Reserva (€)"],
-                ingresos_dict[mes]["Contrato (€)"],
-                ingresos_dict[mes]["Aplazado (€)"],
-                ingresos_dict[mes]["Escritura (€)"],
-            ])
-            total_sin_iva = total_con_iva / (1 + iva_venta / 100)
-            comision = total_sin_iva * (comisiones_venta / 100) * (1 + iva_otros / 100)
-            ingresos_dict[mes]["Comisiones (€)"] = -comision
-
-        resumen = {
-            "Mes": [],
-            "Reserva (€)": [],
-            "Contrato (€)": [],
-            "Aplazado (€)": [],
-            "Escritura (€)": [],
-            "Comisiones (€)": [],
-            "Total ingresos (€)": [],
-            "Ingresos netos (€)": [],
-        }
-
-        for mes in sorted(ingresos_dict):
-            reserva = ingresos_dict[mes]["Reserva (€)"]
-            contrato = ingresos_dict[mes]["Contrato (€)"]
-            aplazado = ingresos_dict[mes]["Aplazado (€)"]
-            escritura = ingresos_dict[mes]["Escritura (€)"]
-            comisiones = ingresos_dict[mes]["Comisiones (€)"]
-            total = reserva + contrato + aplazado + escritura
-            neto = total + comisiones
-
-            resumen["Mes"].append(mes)
-            resumen["Reserva (€)"].append(reserva)
-            resumen["Contrato (€)"].append(contrato)
-            resumen["Aplazado (€)"].append(aplazado)
-            resumen["Escritura (€)"].append(escritura)
-            resumen["Comisiones (€)"].append(comisiones)
-            resumen["Total ingresos (€)"].append(total)
-            resumen["Ingresos netos (€)"].append(neto)
-
-        df = pd.DataFrame(resumen)
-        df["Acumulado"] = df["Total ingresos (€)"].cumsum()
-        
+    if df is not None:
         st.subheader("📋 Tabla mensual de ingresos y comisiones")
         st.dataframe(df.round(2), use_container_width=True)
 
         st.subheader("📊 Gráfico de Ingresos Acumulados")
-        fig = px.line(df, x="Mes", y="Acumulado", markers=True, title="Evolución acumulada de ingresos")
-        fig.update_layout(yaxis_title="€ acumulado")
+        fig = graficos.linea(df, "Mes", "Acumulado", "Evolución acumulada de ingresos", yaxis_title="€ acumulado")
         st.plotly_chart(fig, use_container_width=True)
 
         st.subheader("📋 Tabla acumulada por conceptos")
-        df_acumulado = df.copy()
-        for col in ["Reserva (€)", "Contrato (€)", "Aplazado (€)", "Escritura (€)", "Comisiones (€)", "Total ingresos (€)", "Ingresos netos (€)"]:
-            df_acumulado[f"{col[:-4]} acumulado (€)"] = df_acumulado[col].cumsum()
-        columnas = ["Mes"] + [c for c in df_acumulado.columns if "acumulado" in c]
-        st.dataframe(df_acumulado[columnas].round(2), use_container_width=True)
+        df_acumulado = motor.ingresos_acumulados(df)
+        st.dataframe(df_acumulado.round(2), use_container_width=True)
 
-        st.session_state["df"] = df
 
-with tabs[2]:
+@_seccion
+def _seccion_costes():
     st.header("🏗️ Costes de ejecución por capítulo")
 
-    coste_total_ejecucion = superficie_total * coste_ejecucion_m2
-
-    # === BLOQUE 1: Pesos por defecto establecidos ===
-    pesos_defecto = {
-        'Actuaciones previas': 0.0008,
-        'Demoliciones': 0.03554,
-        'Acondicionamiento del terreno': 2.43289,
-        'Cimentaciones': 2.36372,
-        'Estructuras': 10.64831,
-        'Fachadas y particiones': 8.71951,
-        'Carpintería, cerrajería, vidrios y protecciones solares': 9.88736,
-        'Remates y ayudas': 1.11051,
-        'Instalaciones': 17.93712,
-        'Aislamientos e impermeabilizaciones': 1.36965,
-        'Cubiertas': 3.1591,
-        'Revestimientos y trasdosados': 19.7394,
-        'Señalización y equipamiento': 6.44508,
-        'Urbanización interior de la parcela': 14.79113,
-        'Gestión de residuos': 1.03846,
-        'Control de calidad y ensayos': 0.05725,
-        'Seguridad y salud': 0.26417
-    }
-
-    df_capitulos = pd.DataFrame({
-        "Capítulo": list(pesos_defecto.keys()),
-        "Peso (%)": list(pesos_defecto.values())
-    })
-    df_capitulos["Coste ejecución ajustado (€)"] = -round(df_capitulos["Peso (%)"] * coste_total_ejecucion / 100, 2)
-
-    # === BLOQUE 2: Carga opcional de CSV
+    p = _parametros()
+    coste_total_ejecucion = p.coste_total_ejecucion
+
+    # === BLOQUE 1: Pesos por defecto establecidos (o los de la versión cargada) ===
+    df_capitulos = _capitulos(coste_total_ejecucion)
+
+    # === BLOQUE 2: Carga opcional de CSV o Excel
     st.markdown("### 📂 Cargar capítulos y valores (opcional)")
-    st.caption("Sube un CSV con columnas 'Capítulo' y el **importe** del capítulo (no el porcentaje)")
-    archivo_csv = st.file_uploader("Arrastra y suelta el archivo aquí", type=["csv"])
+    st.caption("Sube un CSV o un Excel (.xlsx) con columnas 'Capítulo' y el **importe** del capítulo (no el porcentaje)")
+    archivo_csv = st.file_uploader("Arrastra y suelta el archivo aquí", type=["csv", "xlsx"])
 
     if archivo_csv:
         try:
-            df_csv = pd.read_csv(archivo_csv, sep=None, engine="python", decimal=",")
-            columna_importe = df_csv.columns[1]
-            df_csv[columna_importe] = df_csv[columna_importe].astype(str).str.replace(",", ".").astype(float)
-            df_csv = df_csv.rename(columns={columna_importe: "Importe"})
-            df_csv["Peso (%)"] = df_csv["Importe"] / df_csv["Importe"].sum() * 100
-            df_csv["Coste ejecución ajustado (€)"] = -round(df_csv["Peso (%)"] * coste_total_ejecucion / 100, 2)
-            df_capitulos = df_csv[["Capítulo", "Peso (%)", "Coste ejecución ajustado (€)"]]
+            contenido_capitulos = archivo_csv.getvalue()
+            if archivo_csv.name.lower().endswith(".xlsx"):
+                col_hoja, col_capitulo, col_importe = st.columns(3)
+                with col_hoja:
+                    hoja_capitulos = st.selectbox("Hoja", etapas.hojas_xlsx(contenido_capitulos), key="xlsx_capitulos_hoja")
+                columnas_hoja = etapas.cabecera_xlsx(contenido_capitulos, hoja_capitulos)
+                with col_capitulo:
+                    columna_capitulo = st.selectbox("Columna de capítulo", columnas_hoja, index=0, key="xlsx_capitulos_capitulo")
+                with col_importe:
+                    columna_importe = st.selectbox(
+                        "Columna de importe", columnas_hoja, index=min(1, len(columnas_hoja) - 1), key="xlsx_capitulos_importe"
+                    )
+                df_capitulos = etapas.leer_capitulos_xlsx(
+                    contenido_capitulos, coste_total_ejecucion, hoja_capitulos, columna_capitulo, columna_importe
+                )
+            else:
+                df_capitulos = etapas.leer_capitulos_csv(contenido_capitulos, coste_total_ejecucion, archivo_csv.name)
+            st.session_state["df_capitulos"] = df_capitulos[["Capítulo", "Peso (%)"]]
             st.success("✅ Archivo cargado correctamente")
         except Exception as e:
             st.error(f"❌ Error al procesar el archivo: {e}")
@@ -487,208 +784,48 @@ with tabs[2]:
     st.dataframe(df_capitulos[["Capítulo", "Peso (%)", "Coste ejecución ajustado (€)"]], use_container_width=True)
 
     # === BLOQUE 3: Planificación por defecto basada en cronograma.csv
-    fechas_inicio_relativas = {
-        'Actuaciones previas': 0,
-        'Demoliciones': 0,
-        'Acondicionamiento del terreno': 0,
-        'Cimentaciones': 2,
-        'Estructuras': 4,
-        'Fachadas y particiones': 8,
-        'Carpintería, cerrajería, vidrios y protecciones solares': 10,
-        'Remates y ayudas': 12,
-        'Instalaciones': 10,
-        'Aislamientos e impermeabilizaciones': 4,
-        'Cubiertas': 6,
-        'Revestimientos y trasdosados': 12,
-        'Señalización y equipamiento': 15,
-        'Urbanización interior de la parcela': 13,
-        'Gestión de residuos': 0,
-        'Control de calidad y ensayos': 14,
-        'Seguridad y salud': 0
-    }
-
-    duraciones_defecto = {
-        'Actuaciones previas': 3,
-        'Demoliciones': 3,
-        'Acondicionamiento del terreno': 3,
-        'Cimentaciones': 4,
-        'Estructuras': 4,
-        'Fachadas y particiones': 4,
-        'Carpintería, cerrajería, vidrios y protecciones solares': 5,
-        'Remates y ayudas': 6,
-        'Instalaciones': 6,
-        'Aislamientos e impermeabilizaciones': 3,
-        'Cubiertas': 2,
-        'Revestimientos y trasdosados': 5,
-        'Señalización y equipamiento': 2,
-        'Urbanización interior de la parcela': 4,
-        'Gestión de residuos': 17,
-        'Control de calidad y ensayos': 5,
-        'Seguridad y salud': 17
-    }
-
-    planificacion = []
-    for i, row in df_capitulos.iterrows():
-        capitulo = row["Capítulo"]
-        offset_meses = fechas_inicio_relativas.get(capitulo, i)
-        inicio = fecha_inicio_obra + relativedelta(months=offset_meses)
-        duracion = duraciones_defecto.get(capitulo, 6)
-        planificacion.append({
-            "Capítulo": capitulo,
-            "Inicio": inicio,
-            "Duración (meses)": duracion
-        })
-
-    df_planificacion = pd.DataFrame(planificacion)
+    df_planificacion = _planificacion(df_capitulos, p.fecha_inicio_obra)
 
     # === BLOQUE 4: Tabla editable
     st.markdown("### 🗂️ Revisión y ajustes de planificación por capítulo")
-    df_editable = st.data_editor(df_planificacion, num_rows="dynamic", use_container_width=True)
+    df_editable = st.data_editor(
+        df_planificacion,
+        num_rows="dynamic",
+        use_container_width=True,
+        key=f"editor_planificacion_{st.session_state.get('version_planificacion', 0)}",
+    )
+    st.session_state["df_planificacion"] = df_editable[["Capítulo", "Inicio", "Duración (meses)"]]
 
     # === BLOQUE 5: Gantt
     st.markdown("### 📆 Gráfico de Gantt")
-    df_editable["Fin"] = pd.to_datetime(df_editable["Inicio"]) + df_editable["Duración (meses)"].apply(lambda m: relativedelta(months=int(m)))
-    fig = px.timeline(
-        df_editable,
-        x_start="Inicio",
-        x_end="Fin",
-        y="Capítulo",
-        color="Capítulo",
-        title="Planificación de ejecución por capítulo"
-    )
-    fig.update_yaxes(autorange="reversed", categoryorder="array", categoryarray=list(df_capitulos["Capítulo"]))
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(_gantt(df_editable, df_capitulos), use_container_width=True)
 
-    # 🔄 Guardar para la pestaña de resumen
-    st.session_state["fig_gantt"] = fig
-    
         # === BLOQUE 6: Cronograma económico mensual ===
     st.markdown("### 📆 Cronograma económico mensual")
 
-    # Coste total de ejecución ya calculado
-    total_coste = superficie_total * coste_ejecucion_m2
-
-    # Unimos planificación con pesos para obtener el % de cada capítulo
-    df_merge = pd.merge(df_editable, df_capitulos[["Capítulo", "Peso (%)"]], on="Capítulo", how="left")
-    df_merge["Coste total capítulo (€)"] = -round(df_merge["Peso (%)"] / 100 * total_coste, 2)
-
-    # Generamos una lista de meses desde inicio de obra hasta último fin de capítulo
-    fecha_inicio_global = df_merge["Inicio"].min()
-    fecha_fin_global = df_merge.apply(lambda row: row["Inicio"] + relativedelta(months=int(row["Duración (meses)"])), axis=1).max()
-
-    meses_totales = []
-    fecha_cursor = fecha_inicio_global
-    while fecha_cursor <= fecha_fin_global:
-        meses_totales.append(fecha_cursor.strftime("%Y-%m"))
-        fecha_cursor += relativedelta(months=1)
-
-    # Inicializamos diccionario para el cronograma económico
-    cronograma = {mes: {} for mes in meses_totales}
-
-    for _, row in df_merge.iterrows():
-        capitulo = row["Capítulo"]
-        inicio = row["Inicio"]
-        duracion = int(row["Duración (meses)"])
-        coste_total = row["Coste total capítulo (€)"]
-        coste_mensual = round(coste_total / duracion, 2)
-
-        for i in range(duracion):
-            fecha_mes = inicio + relativedelta(months=i)
-            clave_mes = fecha_mes.strftime("%Y-%m")
-            if capitulo not in cronograma[clave_mes]:
-                cronograma[clave_mes][capitulo] = 0
-            cronograma[clave_mes][capitulo] += coste_mensual
-
-    # Convertimos en DataFrame
-    df_cronograma = pd.DataFrame.from_dict(cronograma, orient="index").fillna(0)
-    df_cronograma.index.name = "Mes"
-    df_cronograma["Total mensual (€)"] = df_cronograma.sum(axis=1)
+    df_cronograma = _cronograma(df_editable, df_capitulos, coste_total_ejecucion)
 
     st.dataframe(df_cronograma.round(2), use_container_width=True)
 
     # Gráfico de evolución acumulada del coste de ejecución (sin picos)
     st.markdown("### 📉 Evolución acumulada del coste de ejecución")
 
-    # Crear columna acumulada
-    df_cronograma_acumulado = df_cronograma.copy()
-    df_cronograma_acumulado["Total acumulado (€)"] = df_cronograma_acumulado["Total mensual (€)"].cumsum()
-
-    # Crear gráfico simple
-    fig_coste = px.line(
-        df_cronograma_acumulado.reset_index(),
-        x="Mes",
-        y="Total acumulado (€)",
-        title="Coste acumulado de ejecución"
-    )
-    fig_coste.update_layout(xaxis_tickangle=-45)
+    fig_coste = graficos.coste_acumulado_ejecucion(df_cronograma)
 
     # Mostrar
     st.plotly_chart(fig_coste, use_container_width=True)
 
-    # === BLOQUE 7: Coste del suelo ===
-    df_suelo = pd.DataFrame(columns=["Mes", "Coste suelo (€)"])
-    mes_inicio_comercial = fecha_inicio_comercializacion.strftime("%Y-%m")
-    df_suelo = pd.DataFrame({
-        "Mes": [mes_inicio_comercial],
-        "Coste suelo (€)": [-coste_suelo]
-    })
-
-    # === BLOQUE 8: Honorarios técnicos ===
-    importe_total_honorarios = -(porcentaje_honorarios / 100 * coste_total_ejecucion)
-    mes_inicio_obra = fecha_inicio_obra.strftime("%Y-%m")
-    mes_fin_obra = (fecha_inicio_obra + relativedelta(months=plazo_obra_meses)).strftime("%Y-%m")
-
-    # 50% inicio, 20% repartido durante obra, 30% al final
-    mensual_durante_obra = (importe_total_honorarios * 0.20) / plazo_obra_meses
-    df_honorarios = []
-    for i in range(plazo_obra_meses):
-        fecha = fecha_inicio_obra + relativedelta(months=i)
-        mes = fecha.strftime("%Y-%m")
-        df_honorarios.append({
-            "Mes": mes,
-            "Honorarios técnicos (€)": mensual_durante_obra
-        })
-    df_honorarios.append({"Mes": mes_inicio_obra, "Honorarios técnicos (€)": importe_total_honorarios * 0.50})
-    df_honorarios.append({"Mes": mes_fin_obra, "Honorarios técnicos (€)": importe_total_honorarios * 0.30})
-    df_honorarios = pd.DataFrame(df_honorarios).groupby("Mes").sum().reset_index()
-
-    # === BLOQUE 9: Gastos de administración ===
-    total_admin = -(porcentaje_admin / 100 * coste_total_ejecucion)
-    mes_entrega = (fecha_inicio_obra + relativedelta(months=plazo_obra_meses + 3)).strftime("%Y-%m")
-    df_admin = pd.DataFrame({
-        "Mes": [mes_inicio_obra, mes_entrega],
-        "Gastos administración (€)": [total_admin * 0.5, total_admin * 0.5]
-    })
-
-    # === BLOQUE 10: Costes financieros ===
-    df_viviendas = st.session_state.get("df_viviendas")
-    if df_viviendas is not None:
-        lista_financieros = []
-        for _, row in df_viviendas.iterrows():
-            fecha_venta = row["Fecha venta"]
-            if pd.notnull(fecha_venta):
-                mes_contrato = (fecha_venta + relativedelta(months=1)).strftime("%Y-%m")
-                lista_financieros.append({
-                    "Mes": mes_contrato,
-                    "Costes financieros (€)": -gastos_financieros
-                })
-        if lista_financieros:
-            df_financieros = pd.DataFrame(lista_financieros)
-            df_financieros = df_financieros.groupby("Mes", as_index=False).sum()
-        else:
-            df_financieros = pd.DataFrame(columns=["Mes", "Costes financieros (€)"])
-    else:
-        df_financieros = pd.DataFrame(columns=["Mes", "Costes financieros (€)"])
+    # === BLOQUES 7-10: Suelo, honorarios, administración y costes financieros ===
+    otros_costes = _otros_costes(p)
+    df_suelo = otros_costes["suelo"]
+    df_honorarios = otros_costes["honorarios"]
+    df_admin = otros_costes["admin"]
+    df_financieros = otros_costes["financieros"]
+    df_total_costes = otros_costes["total"]
 
-    
     # === BLOQUE 11: Consolidación de todos los costes adicionales ===
     st.markdown("### 🧾 Consolidado de costes no ejecutivos")
-    df_total_costes = pd.merge(df_suelo, df_honorarios, on="Mes", how="outer")
-    df_total_costes = pd.merge(df_total_costes, df_admin, on="Mes", how="outer")
-    df_total_costes = pd.merge(df_total_costes, df_financieros, on="Mes", how="outer")
-    df_total_costes = df_total_costes.fillna(0)
-    df_total_costes["Total otros costes (€)"] = df_total_costes.drop(columns=["Mes"]).sum(axis=1)
-    st.dataframe(df_total_costes.round(2), use_container_width=True)
+    st.dataframe(df_total_costes.drop(columns=["Total otros costes acumulado (€)"]).round(2), use_container_width=True)
 
     # Mostrar solo las tablas auxiliares que contengan datos
     with st.expander("🔍 Desglose mensual por tipo de coste", expanded=False):
@@ -711,115 +848,27 @@ with tabs[2]:
     # === BLOQUE 12: Gráfico de otros costes acumulados + barra mensual ===
     st.markdown("### 📊 Evolución de otros costes")
 
-    # Crear columna acumulada
-    df_total_costes["Total otros costes acumulado (€)"] = df_total_costes["Total otros costes (€)"].cumsum()
-
-    # Crear figura combinada: barra mensual + línea acumulada
-    fig_otros = go.Figure()
-
-    # Barra: costes mensuales
-    fig_otros.add_bar(
-        x=df_total_costes["Mes"],
-        y=df_total_costes["Total otros costes (€)"],
-        name="Coste mensual",
-        marker_color="steelblue"
-    )
-
-    # Línea: costes acumulados
-    fig_otros.add_trace(
-        go.Scatter(
-            x=df_total_costes["Mes"],
-            y=df_total_costes["Total otros costes acumulado (€)"],
-            name="Acumulado",
-            mode="lines+markers",
-            line=dict(color="firebrick", width=3)
-        )
-    )
-
-    # Ajustes estéticos
-    fig_otros.update_layout(
-        title="Otros costes: mensual y acumulado",
-        xaxis_title="Mes",
-        yaxis_title="€",
-        xaxis_tickangle=-45,
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
+    # Figura combinada: barra mensual + línea acumulada
+    fig_otros = graficos.otros_costes(df_total_costes)
 
     # Mostrar
     st.plotly_chart(fig_otros, use_container_width=True, key="gantt_costes")
 
-    # Guardamos en sesión por si se usa en resumen
-    st.session_state["df_costes_otros"] = df_total_costes
-
-
 
-with tabs[3]:
+@_seccion
+def _seccion_flujo():
     st.header("📊 Resumen General y Flujo de Caja")
 
-    # Recuperar ingresos y costes desde sesión
-    if "df" in st.session_state:
-        df_ingresos = st.session_state["df"].copy()
-    else:
-        st.warning("⚠️ Aún no se han definido los ingresos. Por favor, ve primero a la pestaña 'Ingresos y Comisiones'.")
-        st.stop()
-
-    df_ingresos = df.copy()
-    df_costes_ejec = df_cronograma.copy()
-    df_otros_costes = st.session_state.get("df_costes_otros", pd.DataFrame(columns=["Mes"]))
-
-    # Unificar las tablas por Mes
-    df_merge = pd.merge(df_ingresos, df_costes_ejec[["Total mensual (€)"]], on="Mes", how="outer")
-    df_merge = df_merge.rename(columns={"Total mensual (€)": "Coste ejecución (€)"})
-    df_merge = pd.merge(df_merge, df_otros_costes, on="Mes", how="outer")
-    df_merge = df_merge.fillna(0)
-
-    # Calcular flujo de caja mensual total y acumulado
-    df_merge["Flujo mensual total (€)"] = df_merge["Ingresos netos (€)"] + df_merge["Coste ejecución (€)"] + df_merge["Total otros costes (€)"]
-    df_merge["Flujo acumulado (€)"] = df_merge["Flujo mensual total (€)"].cumsum()
-
-    # Calcular flujo de cuenta especial intervenida
-    df_merge["Ingreso cuenta especial (€)"] = (
-        df_merge["Reserva (€)"] +
-        df_merge["Contrato (€)"] +
-        df_merge["Aplazado (€)"]
-    )
-    df_merge["Gasto cuenta especial (€)"] = df_merge["Coste ejecución (€)"]
-    df_merge["Flujo cuenta especial (€)"] = df_merge["Ingreso cuenta especial (€)"] + df_merge["Gasto cuenta especial (€)"]
-
-    # Calcular acumulado y déficit mensual de cuenta especial
-    acumulado = []
-    saldo = 0
-    deficits = []
-
-    for flujo in df_merge["Flujo cuenta especial (€)"]:
-        saldo += flujo
-        if saldo < 0:
-            deficits.append(saldo)
-            acumulado.append(0)
-            saldo = 0
-        else:
-            deficits.append(0)
-            acumulado.append(saldo)
-
-    df_merge["Acumulado cuenta especial (€)"] = acumulado
-    df_merge["Déficit cuenta especial (€)"] = deficits
+    # Ingresos y costes de las secciones anteriores (de la caché de etapas)
+    p = _parametros()
+    df_merge = _flujo(p)
+    if df_merge is None:
+        st.warning("⚠️ Aún no se han definido los ingresos. Por favor, ve primero a la sección 'Inputs Generales' y carga las viviendas.")
+        return
 
     # Mostrar tabla resumen mensual de flujo de caja
     st.subheader("📋 Tabla resumen mensual de flujo de caja")
-    columnas_resumen = [
-        "Mes",
-        "Ingresos netos (€)",
-        "Coste ejecución (€)",
-        "Total otros costes (€)",
-        "Flujo mensual total (€)",
-        "Flujo acumulado (€)",
-        "Ingreso cuenta especial (€)",
-        "Gasto cuenta especial (€)",
-        "Flujo cuenta especial (€)",
-        "Acumulado cuenta especial (€)",
-        "Déficit cuenta especial (€)"
-    ]
-    df_resumen = df_merge[columnas_resumen].copy()
+    df_resumen = df_merge[motor.COLUMNAS_RESUMEN_FLUJO].copy()
 
     def highlight_negativos(val):
         return "background-color: #fdd;" if isinstance(val, (int, float)) and val < 0 else ""
@@ -833,16 +882,54 @@ with tabs[3]:
         use_container_width=True
     )
 
+    # Detalle de una celda: los movimientos (viviendas, capítulos, fases) que la suman
+    with st.expander("🔎 Detalle de movimientos de una celda"):
+        if st.checkbox("Ver los movimientos que suman una celda del flujo de caja", key="detalle_activo"):
+            import movimientos
+
+            col_mes, col_columna = st.columns(2)
+            with col_mes:
+                mes_detalle = st.selectbox("Mes", df_merge["Mes"].tolist(), key="detalle_mes")
+            with col_columna:
+                columna_detalle = st.selectbox(
+                    "Columna",
+                    [c for c in movimientos.COLUMNAS_FLUJO if c in df_merge.columns],
+                    key="detalle_columna",
+                )
+            df_capitulos = _capitulos(p.coste_total_ejecucion)
+            libro = etapas.movimientos(
+                p,
+                st.session_state.get("df_viviendas"),
+                _planificacion(df_capitulos, p.fecha_inicio_obra),
+                df_capitulos,
+            )
+            df_detalle = movimientos.detalle_celda(libro, mes_detalle, columna_detalle)
+            valor_celda = float(df_merge.loc[df_merge["Mes"] == mes_detalle, columna_detalle].iloc[0])
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Valor de la celda", f"{valor_celda:,.2f} €")
+            c2.metric("Suma de movimientos", f"{df_detalle['Importe (€)'].sum():,.2f} €")
+            c3.metric("Movimientos", f"{len(df_detalle):,}")
+            st.caption(f"Libro del proyecto: {len(libro):,} movimientos. Se muestran los 1.000 de mayor importe.")
+            st.dataframe(
+                df_detalle.head(1000).style.format({"Importe (€)": "{:,.2f}"}),
+                use_container_width=True,
+            )
+            st.download_button(
+                "📥 Descargar movimientos (CSV)",
+                df_detalle.to_csv(index=False).encode("utf-8"),
+                file_name=f"movimientos_{mes_detalle}.csv",
+                mime="text/csv",
+                key="descargar_detalle",
+            )
+
     # Gráfico flujo acumulado total
     st.subheader("📈 Gráfico de flujo acumulado total")
-    fig_flujo = px.line(df_merge, x="Mes", y="Flujo acumulado (€)", markers=True)
-    fig_flujo.update_layout(title="Evolución acumulada del flujo de caja", yaxis_title="€ acumulado")
+    fig_flujo = graficos.linea(df_merge, "Mes", "Flujo acumulado (€)", "Evolución acumulada del flujo de caja", yaxis_title="€ acumulado")
     st.plotly_chart(fig_flujo, use_container_width=True)
 
     # Gráfico cuenta especial intervenida
     st.subheader("🏦 Gráfico de cuenta especial intervenida")
-    fig_cuenta = px.line(df_merge, x="Mes", y="Acumulado cuenta especial (€)", markers=True)
-    fig_cuenta.update_layout(title="Evolución acumulada de la cuenta especial", yaxis_title="€ acumulado")
+    fig_cuenta = graficos.linea(df_merge, "Mes", "Acumulado cuenta especial (€)", "Evolución acumulada de la cuenta especial", yaxis_title="€ acumulado")
     st.plotly_chart(fig_cuenta, use_container_width=True)
 
     # Tabla de necesidades de financiación
@@ -854,32 +941,8 @@ with tabs[3]:
     así como cualquier déficit en la cuenta especial intervenida.
     """)
 
-    df_merge["Comisiones pre-escritura (€)"] = 0
-    if "Comisiones (€)" in df_merge.columns:
-        # Estimar comisiones pre-escritura proporcionalmente según los ingresos
-        ingresos_total = df_merge[["Reserva (€)", "Contrato (€)", "Aplazado (€)", "Escritura (€)"]].sum(axis=1)
-        ingresos_pre = df_merge[["Reserva (€)", "Contrato (€)", "Aplazado (€)"]].sum(axis=1)
-        proporcion_pre = ingresos_pre / ingresos_total.replace(0, 1)
-        df_merge["Comisiones pre-escritura (€)"] = df_merge["Comisiones (€)"] * proporcion_pre
-
-    columnas_necesidades = [
-        "Mes",
-        "Coste suelo (€)",
-        "Honorarios técnicos (€)",
-        "Gastos administración (€)",
-        "Costes financieros (€)",
-        "Comisiones pre-escritura (€)",
-        "Déficit cuenta especial (€)"
-    ]
-    for col in columnas_necesidades[1:]:
-        if col not in df_merge.columns:
-            df_merge[col] = 0
-
-    df_merge["Total necesidades financiación (€)"] = df_merge[
-        columnas_necesidades[1:]
-    ].sum(axis=1)
-
-    df_necesidades = df_merge[["Mes"] + columnas_necesidades[1:] + ["Total necesidades financiación (€)"]].copy()
+    with _medir("Necesidades de financiación", len(df_merge)):
+        df_necesidades = etapas.necesidades(df_merge)
 
     def resaltar_total(row):
         if row["Total necesidades financiación (€)"] != 0:
@@ -895,10 +958,11 @@ with tabs[3]:
         use_container_width=True
     )
 
-    st.session_state["df_flujo_final"] = df_resumen
-    st.session_state["df_necesidades_financiacion"] = df_necesidades
-with tabs[4]:
+
+@_seccion
+def _seccion_resumen():
     st.header("📄 Resumen del Proyecto")
+    p = _parametros()
 
     # === BLOQUE 1: Mostrar todos los inputs generales
     st.markdown("### 📌 Inputs Generales")
@@ -906,19 +970,19 @@ with tabs[4]:
     col_izq, col_der = st.columns(2)
     with col_izq:
         st.markdown(f"**Nombre del proyecto:** {nombre_proyecto}")
-        st.markdown(f"**Nº viviendas:** {num_viviendas}")
-        st.markdown(f"**Superficie construida total:** {superficie_total:,.1f} m²")
-        st.markdown(f"**Precio medio de venta:** {precio_medio_venta:,.2f} €")
-        st.markdown(f"**Inicio obra:** {fecha_inicio_obra}")
-        st.markdown(f"**Inicio comercialización:** {fecha_inicio_comercializacion}")
-        st.markdown(f"**Plazo de obra (meses):** {plazo_obra_meses}")
+        st.markdown(f"**Nº viviendas:** {p.num_viviendas}")
+        st.markdown(f"**Superficie construida total:** {p.superficie_total:,.1f} m²")
+        st.markdown(f"**Precio medio de venta:** {p.precio_medio_venta:,.2f} €")
+        st.markdown(f"**Inicio obra:** {p.fecha_inicio_obra}")
+        st.markdown(f"**Inicio comercialización:** {p.fecha_inicio_comercializacion}")
+        st.markdown(f"**Plazo de obra (meses):** {p.plazo_obra_meses}")
     with col_der:
-        st.markdown(f"**Coste suelo:** {coste_suelo:,.2f} €")
-        st.markdown(f"**Coste ejecución por m²:** {coste_ejecucion_m2:,.2f} €")
-        st.markdown(f"**% Comisiones venta:** {comisiones_venta:.2f} %")
-        st.markdown(f"**% Honorarios técnicos:** {porcentaje_honorarios:.2f} %")
-        st.markdown(f"**% Gastos administración:** {porcentaje_admin:.2f} %")
-        st.markdown(f"**Gastos financieros por vivienda:** {gastos_financieros:,.2f} €")
+        st.markdown(f"**Coste suelo:** {p.coste_suelo:,.2f} €")
+        st.markdown(f"**Coste ejecución por m²:** {p.coste_ejecucion_m2:,.2f} €")
+        st.markdown(f"**% Comisiones venta:** {p.comisiones_venta:.2f} %")
+        st.markdown(f"**% Honorarios técnicos:** {p.porcentaje_honorarios:.2f} %")
+        st.markdown(f"**% Gastos administración:** {p.porcentaje_admin:.2f} %")
+        st.markdown(f"**Gastos financieros por vivienda:** {p.gastos_financieros:,.2f} €")
 
     # === BLOQUE 2: Mostrar ventas por Mes
     st.markdown("### 🏘️ Ventas por Mes")
@@ -926,15 +990,11 @@ with tabs[4]:
     df_viviendas = st.session_state.get("df_viviendas")
 
     if df_viviendas is not None and not df_viviendas.empty:
-        df_ventas_resumen = (
-            df_viviendas.copy()
-            .assign(Mes=lambda df: df["Fecha venta"].dt.to_period("M").astype(str))
-            .groupby("Mes")
-            .size()
-            .reset_index(name="Viviendas vendidas")
-        )
+        with _medir("Resumen: ventas por mes", len(df_viviendas)):
+            df_ventas_resumen = motor.ventas_por_mes(df_viviendas)
         st.dataframe(df_ventas_resumen, use_container_width=True)
     else:
+        df_ventas_resumen = pd.DataFrame(columns=["Mes", "Viviendas vendidas"])
         st.info("ℹ️ No hay datos de ventas disponibles.")
 
     # === BLOQUE 3: Botón de descarga CSV de inputs
@@ -944,18 +1004,18 @@ with tabs[4]:
     buffer = io.StringIO()
     df_inputs_export = pd.DataFrame([
         ["Nombre del proyecto", nombre_proyecto],
-        ["Nº viviendas", num_viviendas],
-        ["Superficie construida total", superficie_total],
-        ["Precio medio de venta", precio_medio_venta],
-        ["Inicio obra", fecha_inicio_obra],
-        ["Inicio comercialización", fecha_inicio_comercializacion],
-        ["Plazo obra (meses)", plazo_obra_meses],
-        ["Coste suelo", coste_suelo],
-        ["Coste ejecución por m²", coste_ejecucion_m2],
-        ["% Comisiones venta", comisiones_venta],
-        ["% Honorarios técnicos", porcentaje_honorarios],
-        ["% Gastos administración", porcentaje_admin],
-        ["Gastos financieros por vivienda", gastos_financieros],
+        ["Nº viviendas", p.num_viviendas],
+        ["Superficie construida total", p.superficie_total],
+        ["Precio medio de venta", p.precio_medio_venta],
+        ["Inicio obra", p.fecha_inicio_obra],
+        ["Inicio comercialización", p.fecha_inicio_comercializacion],
+        ["Plazo obra (meses)", p.plazo_obra_meses],
+        ["Coste suelo", p.coste_suelo],
+        ["Coste ejecución por m²", p.coste_ejecucion_m2],
+        ["% Comisiones venta", p.comisiones_venta],
+        ["% Honorarios técnicos", p.porcentaje_honorarios],
+        ["% Gastos administración", p.porcentaje_admin],
+        ["Gastos financieros por vivienda", p.gastos_financieros],
     ], columns=["Concepto", "Valor"])
 
     df_ventas_mes = df_ventas_resumen.copy()
@@ -974,77 +1034,374 @@ with tabs[4]:
     # === BLOQUE 4: Mostrar resumen del flujo de caja si está disponible
     st.markdown("### 📊 Tabla resumen del flujo de caja")
 
-    if "df_flujo_final" in st.session_state:
+    df_merge = _flujo(p)
+    if df_merge is not None:
+        df_resumen = df_merge[motor.COLUMNAS_RESUMEN_FLUJO]
+
         def highlight_negativos(val):
             return "background-color: #fdd;" if isinstance(val, (int, float)) and val < 0 else ""
 
-        columnas_numericas = st.session_state["df_flujo_final"].select_dtypes(include=["number"]).columns
+        columnas_numericas = df_resumen.select_dtypes(include=["number"]).columns
 
         st.dataframe(
-            st.session_state["df_flujo_final"].style
+            df_resumen.style
                 .applymap(highlight_negativos, subset=["Flujo acumulado (€)"])
                 .format({col: "{:,.2f}" for col in columnas_numericas}),
             use_container_width=True
         )
     else:
         st.warning("⚠️ Aún no se ha generado el flujo de caja final.")
-    
-    # === BLOQUE 5: Gráfico de Gantt desde la pestaña de Costes ===
+
+    # === BLOQUE 5: Gráfico de Gantt de la planificación de 'Costes' ===
     st.markdown("### 📆 Cronograma de ejecución por capítulo")
 
-    if "fig_gantt" in st.session_state:
-        fig_gantt = st.session_state["fig_gantt"]
-        st.plotly_chart(fig_gantt, use_container_width=True, key="gantt_resumen")
-    else:
-        st.info("ℹ️ El cronograma de ejecución todavía no se ha generado.")
+    df_capitulos = _capitulos(p.coste_total_ejecucion)
+    st.plotly_chart(
+        _gantt(_planificacion(df_capitulos, p.fecha_inicio_obra), df_capitulos),
+        use_container_width=True,
+        key="gantt_resumen",
+    )
 
-    
     # === BLOQUE 6: Cuenta de Resultados de la Promoción (sin IVA)s ===
     st.markdown("### 🧾 Cuenta de Resultados de la Promoción (sin IVA)")
 
-    # Cálculos base
-    ingresos_por_venta = precio_medio_venta * num_viviendas
-    total_comisiones = ingresos_por_venta * comisiones_venta / 100
-    ingresos_netos = ingresos_por_venta - total_comisiones
-
-    coste_ejecucion_total = coste_ejecucion_m2 * superficie_total
-    coste_honorarios = coste_ejecucion_total * porcentaje_honorarios / 100
-    coste_admin = coste_ejecucion_total * porcentaje_admin / 100
-    coste_financiero = gastos_financieros * num_viviendas
-    costes_no_ejecutivos = coste_honorarios + coste_admin + coste_financiero
-
-    total_costes = coste_suelo + coste_ejecucion_total + costes_no_ejecutivos
-    margen = ingresos_netos - total_costes
-
-    margen_vivienda = margen / num_viviendas if num_viviendas else 0
-    margen_m2 = margen / superficie_total if superficie_total else 0
-
-    cuenta_resultados = {
-        "Concepto": [
-            "Ingresos por venta",
-            "(-) Comisiones",
-            "= Ingresos Netos",
-            "Compra de terrenos",
-            "Costes de ejecución",
-            "Costes no ejecutivos",
-            "= Total Costes",
-            "= Margen",
-            "Margen por vivienda",
-            "Margen por m² construido"
-        ],
-        "Importe (€)": [
-            ingresos_por_venta,
-            -total_comisiones,
-            ingresos_netos,
-            -coste_suelo,
-            -coste_ejecucion_total,
-            -costes_no_ejecutivos,
-            -total_costes,
-            margen,
-            margen_vivienda,
-            margen_m2
-        ]
-    }
-
-    df_resultados = pd.DataFrame(cuenta_resultados)
-    st.dataframe(df_resultados.style.format({"Importe (€)": "{:,.2f}"}), use_container_width=True)
\ No newline at end of file
+    with _medir("Resumen: cuenta de resultados"):
+        df_resultados = motor.calcular_cuenta_resultados(
+            p.num_viviendas,
+            p.precio_medio_venta,
+            p.superficie_total,
+            p.coste_suelo,
+            p.coste_ejecucion_m2,
+            p.comisiones_venta,
+            p.porcentaje_honorarios,
+            p.porcentaje_admin,
+            p.gastos_financieros,
+        )
+    st.dataframe(df_resultados.style.format({"Importe (€)": "{:,.2f}"}), use_container_width=True)
+
+
+@_seccion
+def _seccion_sensibilidad():
+    st.header("🎯 Análisis de sensibilidad")
+    st.caption(
+        "Evalúa el modelo completo sobre una rejilla de valores de las variables elegidas: "
+        "tornado (una variable cada vez) y mapa de calor de dos variables."
+    )
+
+    df_viviendas = st.session_state.get("df_viviendas")
+    if df_viviendas is None or df_viviendas.empty:
+        st.info("ℹ️ Carga primero la tabla de viviendas en 'Inputs Generales'.")
+        return
+
+    parametros_base = _parametros()
+    df_capitulos = _capitulos(parametros_base.coste_total_ejecucion)
+    df_planificacion = _planificacion(df_capitulos, parametros_base.fecha_inicio_obra)
+    etiquetas = sensibilidad.VARIABLES
+    variables = st.multiselect(
+        "Variables",
+        list(etiquetas),
+        default=["precio_medio_venta", "coste_ejecucion_m2", "plazo_obra_meses", "pct_contrato"],
+        format_func=etiquetas.get,
+        key="sens_variables",
+    )
+
+    valores = {}
+    extremos = {}
+    for variable in variables:
+        bajo, alto = sensibilidad.rango_por_defecto(parametros_base, variable)
+        entera = variable in sensibilidad.VARIABLES_ENTERAS
+        col_min, col_max, col_pasos = st.columns(3)
+        with col_min:
+            minimo = st.number_input(f"{etiquetas[variable]} · mínimo", value=int(bajo) if entera else float(bajo), key=f"sens_min_{variable}")
+        with col_max:
+            maximo = st.number_input(f"{etiquetas[variable]} · máximo", value=int(alto) if entera else float(alto), key=f"sens_max_{variable}")
+        with col_pasos:
+            pasos = st.number_input(f"{etiquetas[variable]} · valores", min_value=2, max_value=100, value=5, key=f"sens_pasos_{variable}")
+        valores[variable] = sensibilidad.valores_rango(variable, minimo, maximo, pasos)
+        extremos[variable] = (minimo, maximo)
+
+    num_escenarios = int(np.prod([len(v) for v in valores.values()])) if valores else 0
+    st.caption(f"Rejilla completa: {num_escenarios:,} escenarios")
+
+    if st.button("▶️ Calcular sensibilidad", disabled=not variables, key="btn_sensibilidad"):
+        # En sesión solo quedan las entradas del cálculo; el resultado está
+        # en la caché compartida de etapas y se recalcula si se expulsa
+        argumentos_sensibilidad = dict(
+            parametros=parametros_base,
+            df_viviendas=df_viviendas,
+            extremos=extremos,
+            valores=valores,
+            df_planificacion=df_planificacion,
+            df_capitulos=df_capitulos,
+        )
+        with st.spinner(f"Evaluando {num_escenarios:,} escenarios..."):
+            inicio = time.perf_counter()
+            etapas.sensibilidad(**argumentos_sensibilidad)
+        st.session_state["sensibilidad"] = {
+            "argumentos": argumentos_sensibilidad,
+            "segundos": time.perf_counter() - inicio,
+        }
+
+    calculo_sensibilidad = st.session_state.get("sensibilidad")
+    if calculo_sensibilidad is not None:
+        resultado = etapas.sensibilidad(**calculo_sensibilidad["argumentos"])
+        df_barrido = resultado["barrido"]
+        st.success(f"✅ {len(df_barrido):,} escenarios evaluados en {calculo_sensibilidad['segundos']:.2f} s")
+        metrica = st.selectbox(
+            "Métrica", list(sensibilidad.METRICAS), format_func=sensibilidad.METRICAS.get, key="sens_metrica"
+        )
+        nombre_metrica = sensibilidad.METRICAS[metrica]
+
+        st.subheader("🌪️ Tornado")
+        fig_tornado = graficos.tornado(
+            resultado["tornado"], metrica, resultado["base"][metrica],
+            f"{nombre_metrica}: sensibilidad a cada variable", etiquetas
+        )
+        st.plotly_chart(fig_tornado, use_container_width=True)
+
+        variables_barrido = [c for c in df_barrido.columns if c in etiquetas]
+        if len(variables_barrido) >= 2:
+            st.subheader("🗺️ Mapa de calor")
+            col_x, col_y = st.columns(2)
+            with col_x:
+                eje_x = st.selectbox("Eje X", variables_barrido, format_func=etiquetas.get, key="sens_x")
+            with col_y:
+                opciones_y = [v for v in variables_barrido if v != eje_x]
+                eje_y = st.selectbox("Eje Y", opciones_y, format_func=etiquetas.get, key="sens_y")
+            fig_mapa = graficos.mapa_calor(
+                sensibilidad.mapa_calor(df_barrido, eje_x, eje_y, metrica),
+                nombre_metrica, etiquetas[eje_x], etiquetas[eje_y]
+            )
+            st.plotly_chart(fig_mapa, use_container_width=True)
+            if len(variables_barrido) > 2:
+                st.caption("Cada celda es la media sobre el resto de variables de la rejilla.")
+
+        st.subheader("📋 Escenarios")
+        st.dataframe(
+            df_barrido.rename(columns={**etiquetas, **sensibilidad.METRICAS}).head(1000),
+            use_container_width=True,
+        )
+        st.download_button(
+            "📥 Descargar escenarios (CSV)",
+            data=df_barrido.to_csv(index=False),
+            file_name="sensibilidad.csv",
+            mime="text/csv",
+        )
+
+    st.divider()
+    st.subheader("🎯 Buscar objetivo")
+    st.caption(
+        "Encuentra el valor mínimo o máximo de una variable con el que un indicador queda por debajo "
+        "o por encima de un umbral (se supone que el indicador varía en un solo sentido dentro del rango)."
+    )
+    col_obj1, col_obj2, col_obj3 = st.columns(3)
+    with col_obj1:
+        obj_variable = st.selectbox("Variable", list(etiquetas), format_func=etiquetas.get, key="obj_variable")
+        obj_buscar = st.radio("Buscar", list(objetivos.SENTIDOS), format_func=objetivos.SENTIDOS.get, horizontal=True, key="obj_buscar")
+    with col_obj2:
+        obj_metrica = st.selectbox("Indicador", list(objetivos.METRICAS), format_func=objetivos.METRICAS.get, key="obj_metrica")
+        obj_condicion = st.radio("Condición", list(objetivos.CONDICIONES), format_func=objetivos.CONDICIONES.get, horizontal=True, key="obj_condicion")
+    with col_obj3:
+        obj_valor = st.number_input("Umbral (€)", value=0.0, step=10000.0, key="obj_valor")
+        obj_todos = st.checkbox("Todos los proyectos (versión más reciente)", key="obj_todos")
+
+    bajo, alto = objetivos.rango_busqueda(parametros_base, obj_variable)
+    entera = obj_variable in objetivos.VARIABLES_ENTERAS
+    col_rmin, col_rmax = st.columns(2)
+    with col_rmin:
+        obj_min = st.number_input("Rango · mínimo", value=int(bajo) if entera else float(bajo), key=f"obj_min_{obj_variable}")
+    with col_rmax:
+        obj_max = st.number_input("Rango · máximo", value=int(alto) if entera else float(alto), key=f"obj_max_{obj_variable}")
+
+    if st.button("🎯 Resolver", key="btn_objetivo"):
+        # Como en la sensibilidad, en sesión solo quedan las entradas
+        opciones = dict(condicion=obj_condicion, buscar=obj_buscar, minimo=obj_min, maximo=obj_max)
+        if obj_todos:
+            argumentos_objetivo = dict(
+                seleccion=catalogo.versiones_recientes(),
+                variable=obj_variable, metrica=obj_metrica, valor=obj_valor, opciones=opciones,
+            )
+        else:
+            argumentos_objetivo = dict(
+                parametros=parametros_base, df_viviendas=df_viviendas,
+                variable=obj_variable, metrica=obj_metrica, valor=obj_valor,
+                df_planificacion=df_planificacion, df_capitulos=df_capitulos, opciones=opciones,
+            )
+        try:
+            if obj_todos:
+                with st.spinner("Resolviendo para todos los proyectos..."):
+                    etapas.objetivo_proyectos(**argumentos_objetivo)
+            else:
+                etapas.objetivo(**argumentos_objetivo)
+            st.session_state["objetivo"] = {"todos": obj_todos, "argumentos": argumentos_objetivo}
+        except ValueError as e:
+            st.error(f"❌ {e}")
+
+    calculo_objetivo = st.session_state.get("objetivo")
+    solucion = None
+    if calculo_objetivo is not None:
+        resolver = etapas.objetivo_proyectos if calculo_objetivo["todos"] else etapas.objetivo
+        solucion = resolver(**calculo_objetivo["argumentos"])
+    if isinstance(solucion, objetivos.ResultadoObjetivo):
+        if solucion.valor is None:
+            st.warning("⚠️ Ningún valor del rango cumple el objetivo.")
+        else:
+            st.success(
+                f"✅ {etiquetas[solucion.variable]}: {solucion.valor:,.2f} "
+                f"→ {objetivos.METRICAS[solucion.metrica]}: {solucion.valor_metrica:,.2f} "
+                f"({solucion.evaluaciones} escenarios evaluados)"
+            )
+    elif solucion is not None:
+        st.dataframe(solucion, use_container_width=True, hide_index=True)
+        st.download_button(
+            "📥 Descargar soluciones (CSV)",
+            data=solucion.to_csv(index=False),
+            file_name="objetivos.csv",
+            mime="text/csv",
+        )
+
+
+@_seccion
+def _seccion_riesgo():
+    st.header("🎲 Simulación Monte Carlo")
+    st.caption(
+        "Sortea retrasos de venta y descuentos por vivienda y ampliaciones del plazo de obra, "
+        "y muestra las bandas P10/P50/P90 del flujo acumulado, la cuenta especial y las necesidades de financiación."
+    )
+
+    df_viviendas = st.session_state.get("df_viviendas")
+    if df_viviendas is None or df_viviendas.empty:
+        st.info("ℹ️ Carga primero la tabla de viviendas en 'Inputs Generales'.")
+        return
+
+    defecto = montecarlo.SupuestosMontecarlo()
+    col_mc1, col_mc2, col_mc3 = st.columns(3)
+    with col_mc1:
+        mc_escenarios = st.number_input("Nº de escenarios", min_value=100, max_value=200000, value=10000, step=1000, key="mc_escenarios")
+        mc_semilla = st.number_input("Semilla", min_value=0, value=0, step=1, key="mc_semilla")
+    with col_mc2:
+        mc_retraso = st.number_input("Retraso medio de cada venta (meses)", min_value=0.0, value=defecto.retraso_ventas_medio_meses, key="mc_retraso")
+        mc_plazo = st.number_input("Ampliación media del plazo de obra (meses)", min_value=0.0, value=defecto.ampliacion_plazo_media_meses, key="mc_plazo")
+    with col_mc3:
+        mc_descuento = st.number_input("Descuento medio (%)", min_value=0.0, max_value=100.0, value=defecto.descuento_medio_pct, key="mc_descuento")
+        mc_desviacion = st.number_input("Desviación del descuento (%)", min_value=0.0, max_value=100.0, value=defecto.descuento_desviacion_pct, key="mc_desviacion")
+
+    if st.button("🎲 Simular", key="btn_montecarlo"):
+        supuestos = montecarlo.SupuestosMontecarlo(
+            retraso_ventas_medio_meses=mc_retraso,
+            descuento_medio_pct=mc_descuento,
+            descuento_desviacion_pct=mc_desviacion,
+            ampliacion_plazo_media_meses=mc_plazo,
+        )
+        p = _parametros()
+        df_capitulos = _capitulos(p.coste_total_ejecucion)
+        # En sesión solo quedan las entradas; las bandas y los percentiles
+        # están en la caché de etapas
+        argumentos_montecarlo = dict(
+            parametros=p,
+            df_viviendas=df_viviendas,
+            num_escenarios=int(mc_escenarios),
+            semilla=int(mc_semilla),
+            supuestos=supuestos,
+            df_planificacion=_planificacion(df_capitulos, p.fecha_inicio_obra),
+            df_capitulos=df_capitulos,
+        )
+        with st.spinner(f"Simulando {int(mc_escenarios):,} escenarios..."):
+            inicio = time.perf_counter()
+            etapas.montecarlo(**argumentos_montecarlo)
+        st.session_state["montecarlo"] = {
+            "argumentos": argumentos_montecarlo,
+            "segundos": time.perf_counter() - inicio,
+        }
+
+    calculo_montecarlo = st.session_state.get("montecarlo")
+    if calculo_montecarlo is not None:
+        simulacion = etapas.montecarlo(**calculo_montecarlo["argumentos"])
+        st.success(
+            f"✅ {simulacion.num_escenarios:,} escenarios (semilla {simulacion.semilla}) "
+            f"simulados en {calculo_montecarlo['segundos']:.2f} s"
+        )
+        st.subheader("📋 Percentiles de los indicadores")
+        st.dataframe(
+            simulacion.indicadores.style.format({c: "{:,.2f}" for c in simulacion.indicadores.columns if c != "Indicador"}),
+            use_container_width=True,
+            hide_index=True,
+        )
+        for serie in montecarlo.SERIES.values():
+            st.plotly_chart(graficos.bandas(simulacion.bandas, serie, serie), use_container_width=True)
+        st.download_button(
+            "📥 Descargar bandas (CSV)",
+            data=simulacion.bandas.to_csv(index=False),
+            file_name="montecarlo_bandas.csv",
+            mime="text/csv",
+        )
+        if os.path.isdir(simulacion.carpeta):
+            st.caption(f"Trayectorias completas de cada escenario (.npy): {simulacion.carpeta}")
+        else:
+            st.caption("Las trayectorias completas de esta simulación ya se han borrado para liberar espacio.")
+
+
+SECCIONES = {
+    "Inputs Generales": _seccion_inputs,
+    "Ingresos y Comisiones": _seccion_ingresos,
+    "Costes": _seccion_costes,
+    "Flujo de Caja": _seccion_flujo,
+    "Resumen": _seccion_resumen,
+    "Sensibilidad": _seccion_sensibilidad,
+    "Riesgo": _seccion_riesgo,
+    "Cartera": _seccion_cartera,
+}
+seccion = st.radio("Sección", list(SECCIONES), horizontal=True, key="seccion", label_visibility="collapsed")
+SECCIONES[seccion]()
+
+# === Memoria de la sesión ===
+_informe_memoria = memoria.informe(st.session_state)
+if _contexto is not None:
+    memoria.registrar(_contexto.session_id, _informe_memoria["Bytes"].sum())
+with st.sidebar:
+    with st.expander("🧠 Memoria de la sesión", expanded=False):
+        st.metric("Estado de esta sesión", f"{_informe_memoria['Bytes'].sum() / 2**20:,.2f} MB")
+        st.dataframe(
+            _informe_memoria.assign(MB=_informe_memoria["Bytes"] / 2**20)[["Clave", "Tipo", "MB"]].head(20)
+                .style.format({"MB": "{:,.3f}"}),
+            use_container_width=True,
+            hide_index=True,
+        )
+        _servidor = memoria.resumen_servidor()
+        st.caption(
+            f"Servidor: {_servidor['sesiones']} sesiones activas · total {_servidor['total'] / 2**20:,.1f} MB · "
+            f"media {_servidor['media'] / 2**20:,.2f} MB · máximo {_servidor['maximo'] / 2**20:,.2f} MB · "
+            f"caché de lecturas en disco {cache_lecturas.tamaño() / 2**20:,.1f} MB"
+        )
+
+# === Informe de arranque ===
+_registrar_tiempo("Primera visualización completa (s)")
+with _informe_arranque.container():
+    with st.expander("⏱️ Informe de arranque", expanded=False):
+        tiempos = dict(st.session_state.tiempos_arranque)
+        tiempos["Ejecución actual (s)"] = time.perf_counter() - _inicio_ejecucion
+        st.dataframe(
+            pd.DataFrame({"Etapa": list(tiempos), "Segundos": list(tiempos.values())})
+                .style.format({"Segundos": "{:.3f}"}),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+# === Perfilado por etapas (oculto: solo con ?debug=1) ===
+if _perfilado:
+    _medidas = perfilado.cerrar(_id_sesion, time.perf_counter() - _inicio_ejecucion)
+    if _modo_depuracion:
+        with st.sidebar:
+            with st.expander("🐞 Perfilado por etapas", expanded=False):
+                st.caption("Esta ejecución (incluye los callbacks que la lanzaron)")
+                st.dataframe(
+                    perfilado.tabla(_medidas).style.format({"Segundos": "{:.4f}", "Pico MB": "{:,.2f}"}, na_rep="—"),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+                st.caption(f"Todas las sesiones: últimas {perfilado.ULTIMAS_EJECUCIONES:,} ejecuciones de {perfilado.RUTA_REGISTRO}")
+                st.dataframe(
+                    perfilado.resumen().style.format(precision=4, na_rep="—"),
+                    use_container_width=True,
+                    hide_index=True,
+                )
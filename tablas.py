@@ -0,0 +1,152 @@
+"""
+Serialización columnar de las entradas del modelo.
+
+Las tablas (viviendas, capítulos, planificación) se guardan columna a columna
+como arrays NumPy tipados y los parámetros escalares como JSON, todo dentro
+de un único archivo .npz que se lee sin pickle (np.load con
+allow_pickle=False).
+"""
+import json
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Versión del formato de archivo de versiones
+FORMATO = 1
+
+_CLAVE_META = "__meta__"
+
+
+def _es_columna_de_fechas(serie: pd.Series) -> bool:
+    valores = serie.dropna()
+    return len(valores) > 0 and all(isinstance(v, (date, datetime)) for v in valores)
+
+
+def columna_a_arrays(serie: pd.Series):
+    """
+    Convierte una columna en (tipo, valores, nulos). tipo es 'fecha' (columna
+    de objetos date), 'datetime', 'numero', 'booleano', 'categoria' (se guarda
+    como texto) o 'texto'; nulos es None o una máscara booleana cuando el tipo
+    no admite NaN/NaT.
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        _, valores, nulos = columna_a_arrays(serie.astype(object))
+        return "categoria", valores, nulos
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return "datetime", serie.to_numpy(dtype="datetime64[ns]"), None
+    if pd.api.types.is_bool_dtype(serie):
+        return "booleano", serie.to_numpy(dtype=bool), None
+    if pd.api.types.is_numeric_dtype(serie):
+        return "numero", serie.to_numpy(), None
+    nulos = serie.isna().to_numpy()
+    if _es_columna_de_fechas(serie):
+        return "fecha", pd.to_datetime(serie).to_numpy(dtype="datetime64[D]"), None
+    valores = np.array(["" if nulo else str(v) for v, nulo in zip(serie.tolist(), nulos)], dtype=np.str_)
+    return "texto", valores, nulos if nulos.any() else None
+
+
+def arrays_a_columna(tipo: str, valores: np.ndarray, nulos=None) -> pd.Series:
+    """
+    Inversa de columna_a_arrays.
+    """
+    if tipo == "fecha":
+        return pd.Series([None if pd.isna(v) else v.date() for v in pd.to_datetime(valores)], dtype=object)
+    if tipo in ("texto", "categoria"):
+        serie = pd.Series(valores.astype(object))
+        if nulos is not None:
+            serie[nulos] = None
+        return serie.astype("category") if tipo == "categoria" else serie
+    return pd.Series(valores)
+
+
+def tabla_a_arrays(df: pd.DataFrame, prefijo: str):
+    """
+    Devuelve (descripcion, arrays): la descripción (columnas y tipos) va al
+    JSON de metadatos y los arrays se guardan con claves '<prefijo>__<i>'.
+    """
+    descripcion = {"columnas": [], "tipos": []}
+    arrays = {}
+    for i, columna in enumerate(df.columns):
+        tipo, valores, nulos = columna_a_arrays(df[columna])
+        # Vista sin metadatos de dtype (np.save no los conserva y avisa)
+        valores = valores.view(np.dtype(valores.dtype.str))
+        descripcion["columnas"].append(str(columna))
+        descripcion["tipos"].append(tipo)
+        arrays[f"{prefijo}__{i}"] = valores
+        if nulos is not None:
+            arrays[f"{prefijo}__{i}__nulos"] = nulos
+    return descripcion, arrays
+
+
+def arrays_a_tabla(descripcion: dict, arrays, prefijo: str) -> pd.DataFrame:
+    """
+    Reconstruye una tabla a partir de su descripción y sus arrays.
+    """
+    columnas = {}
+    for i, (columna, tipo) in enumerate(zip(descripcion["columnas"], descripcion["tipos"])):
+        clave_nulos = f"{prefijo}__{i}__nulos"
+        nulos = arrays[clave_nulos] if clave_nulos in arrays else None
+        columnas[columna] = arrays_a_columna(tipo, arrays[f"{prefijo}__{i}"], nulos)
+    return pd.DataFrame(columnas, columns=descripcion["columnas"])
+
+
+def _a_json(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    return valor
+
+
+def parametros_a_json(parametros: dict) -> dict:
+    """
+    Parámetros escalares serializables en JSON (fechas como texto ISO).
+    """
+    return {clave: _a_json(valor) for clave, valor in parametros.items()}
+
+
+def guardar_entradas(ruta, parametros: dict, tablas: dict, metadatos: dict = None) -> None:
+    """
+    Escribe en 'ruta' (.npz) los parámetros escalares y las tablas indicadas
+    ({nombre: DataFrame}; las que sean None se omiten).
+    """
+    meta = dict(metadatos or {})
+    meta["formato"] = FORMATO
+    meta["parametros"] = parametros_a_json(parametros)
+    meta["tablas"] = {}
+    arrays = {}
+    for nombre, df in tablas.items():
+        if df is None:
+            continue
+        descripcion, arrays_tabla = tabla_a_arrays(df, nombre)
+        meta["tablas"][nombre] = descripcion
+        arrays.update(arrays_tabla)
+    arrays[_CLAVE_META] = np.array(json.dumps(meta, ensure_ascii=False))
+    with open(ruta, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def leer_metadatos(ruta) -> dict:
+    """
+    Lee solo el JSON de metadatos (fecha, parámetros y descripción de tablas).
+    """
+    with np.load(ruta, allow_pickle=False) as datos:
+        return json.loads(str(datos[_CLAVE_META]))
+
+
+def cargar_entradas(ruta):
+    """
+    Devuelve (metadatos, tablas) de un archivo escrito con guardar_entradas.
+    Los parámetros quedan en metadatos['parametros'] tal como están en el JSON
+    (las fechas como texto ISO).
+    """
+    with np.load(ruta, allow_pickle=False) as datos:
+        meta = json.loads(str(datos[_CLAVE_META]))
+        if meta.get("formato", 0) > FORMATO:
+            raise ValueError(f"Formato de versión {meta['formato']} no soportado.")
+        tablas = {
+            nombre: arrays_a_tabla(descripcion, datos, nombre)
+            for nombre, descripcion in meta["tablas"].items()
+        }
+    return meta, tablas
@@ -1,10 +1,15 @@
 import os
 import pickle
 import glob
-from datetime import datetime
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime
 import streamlit as st
 from streamlit.errors import StreamlitValueAssignmentNotAllowedError
 
+import bloqueos
+
 # Carpeta base donde se almacenan las versiones
 CARPETA_BASE = os.path.join(os.getcwd(), "versiones")
 
@@ -20,47 +25,320 @@ def ruta_proyecto(nombre_proyecto: str = "default") -> str:
     return proyecto_dir
 
 
+# Archivos de versión: manifiestos JSON que apuntan a las tablas y parámetros
+# guardados una sola vez en el almacén común (ver almacen.py). Los .npz
+# (entradas en un único archivo, ver tablas.py) y los .pkl (st.session_state
+# completo) son formatos anteriores y solo se leen.
+EXTENSION = ".json"
+EXTENSION_COLUMNAR = ".npz"
+EXTENSION_ANTIGUA = ".pkl"
+EXTENSIONES = (EXTENSION, EXTENSION_COLUMNAR, EXTENSION_ANTIGUA)
+
+# Almacén de blobs direccionado por contenido, compartido por todos los
+# proyectos de una carpeta base: <carpeta base>/.almacen
+CARPETA_ALMACEN = ".almacen"
+
+
+def _carpeta_almacen(ruta_archivo: str) -> str:
+    """
+    Almacén de la carpeta base a la que pertenece un archivo de versión
+    (<carpeta base>/<proyecto>/<versión>).
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(ruta_archivo))), CARPETA_ALMACEN)
+
+# Tablas de entrada que se guardan junto con los parámetros escalares
+TABLAS_ENTRADA = ("df_viviendas", "df_capitulos", "df_planificacion")
+
+# Resultados (o entradas de cálculos) de análisis que la app deja en sesión;
+# se descartan al cargar. Las tablas y gráficos derivados no se guardan en
+# sesión: salen de la caché de etapas.
+RESULTADOS_DERIVADOS = ("sensibilidad", "montecarlo", "objetivo")
+
+# Guardados en segundo plano (ver guardar_version_en_segundo_plano). Un solo
+# hilo escritor: los guardados del proceso se escriben en el orden en que se
+# piden; entre procesos los ordena el bloqueo del proyecto (bloqueos.py).
+GUARDADO_PENDIENTE = "pendiente"
+GUARDADO_COMPLETO = "completo"
+GUARDADO_ERROR = "error"
+
+_escritor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="guardado_versiones")
+# (future, proyecto, versión) de cada guardado pendiente, por su ficha (una
+# por llamada)
+_guardados = {}
+_bloqueo_guardados = threading.Lock()
+
+
+def claves_parametros() -> list:
+    """
+    Claves de st.session_state con los parámetros escalares del modelo (los
+    campos de motor.ParametrosProyecto).
+    """
+    from dataclasses import fields
+    from motor import ParametrosProyecto
+
+    return [f.name for f in fields(ParametrosProyecto)]
+
+
+def _parametros_desde_json(parametros: dict) -> dict:
+    """
+    Restaura los tipos (fechas, enteros) de los parámetros leídos del JSON.
+    """
+    from dataclasses import fields
+    from motor import ParametrosProyecto
+
+    tipos = {f.name: f.type for f in fields(ParametrosProyecto)}
+    restaurados = {}
+    for clave, valor in parametros.items():
+        tipo = tipos.get(clave)
+        if tipo is date and isinstance(valor, str):
+            valor = date.fromisoformat(valor)
+        elif tipo in (int, float) and valor is not None:
+            valor = tipo(valor)
+        restaurados[clave] = valor
+    return restaurados
+
+
+def entradas_de_sesion(session_data) -> tuple:
+    """
+    Extrae de un estado de sesión (st.session_state o el diccionario de un
+    .pkl antiguo) las entradas del modelo: (parametros, tablas).
+    """
+    parametros = {
+        clave: session_data[clave]
+        for clave in claves_parametros()
+        if clave in session_data
+    }
+    tablas = {nombre: session_data.get(nombre) for nombre in TABLAS_ENTRADA}
+    return parametros, tablas
+
+
+def _ruta_version(proyecto_dir: str, nombre_version: str) -> str:
+    """
+    Ruta del archivo de una versión: el formato más reciente que exista.
+    Devuelve la ruta en formato actual si no existe ninguno.
+    """
+    for extension in EXTENSIONES:
+        ruta = os.path.join(proyecto_dir, f"{nombre_version}{extension}")
+        if os.path.isfile(ruta):
+            return ruta
+    return os.path.join(proyecto_dir, f"{nombre_version}{EXTENSION}")
+
+
+def _leer_version(ruta_archivo: str) -> tuple:
+    """
+    Lee un archivo de versión (actual o anterior) y devuelve (fecha,
+    parametros, tablas) con solo las entradas del modelo.
+    """
+    if ruta_archivo.endswith(EXTENSION_ANTIGUA):
+        with open(ruta_archivo, "rb") as f:
+            datos = pickle.load(f)
+        parametros, tablas = entradas_de_sesion(datos.get("st_session", {}))
+        return datos.get("fecha"), parametros, tablas
+
+    if ruta_archivo.endswith(EXTENSION_COLUMNAR):
+        import tablas as formato
+
+        meta, tablas = formato.cargar_entradas(ruta_archivo)
+        parametros = meta.get("parametros", {})
+    else:
+        import almacen
+
+        meta, parametros, tablas = almacen.cargar_manifiesto(ruta_archivo, _carpeta_almacen(ruta_archivo))
+    fecha = datetime.fromisoformat(meta["fecha"]) if meta.get("fecha") else None
+    return fecha, _parametros_desde_json(parametros), tablas
+
+
+def _escribir_version(ruta_archivo: str, fecha: datetime, parametros: dict, tablas: dict) -> None:
+    """
+    Escribe el manifiesto de una versión; solo se añaden al almacén las tablas
+    y parámetros que no estaban ya.
+    """
+    import almacen
+
+    carpeta_almacen = _carpeta_almacen(ruta_archivo)
+    os.makedirs(carpeta_almacen, exist_ok=True)
+    # Compartido con otros guardados; limpiar_almacen lo toma en exclusiva para
+    # no borrar blobs escritos antes de que exista su manifiesto
+    with bloqueos.bloquear(carpeta_almacen, compartido=True):
+        almacen.guardar_manifiesto(ruta_archivo, carpeta_almacen, fecha.isoformat(), parametros, tablas)
+
+
+def _eliminar_formatos_anteriores(proyecto_dir: str, nombre_version: str) -> None:
+    for extension in (EXTENSION_COLUMNAR, EXTENSION_ANTIGUA):
+        ruta = os.path.join(proyecto_dir, f"{nombre_version}{extension}")
+        if os.path.isfile(ruta):
+            os.remove(ruta)
+
+
+def indicadores_entradas(parametros: dict, tablas: dict) -> dict:
+    """
+    Evalúa el modelo con unas entradas y devuelve sus indicadores principales
+    (ver motor.indicadores). Si las entradas no se pueden evaluar devuelve un
+    diccionario vacío: el catálogo guarda la versión sin indicadores.
+    """
+    import motor
+
+    try:
+        resultados = motor.evaluar_proyecto(
+            motor.ParametrosProyecto(**parametros),
+            tablas.get("df_viviendas"),
+            tablas.get("df_planificacion"),
+            tablas.get("df_capitulos"),
+        )
+        return motor.indicadores(resultados)
+    except Exception:
+        return {}
+
+
+def indicadores_version(nombre_version: str, nombre_proyecto: str = "default") -> dict:
+    """
+    Indicadores principales de una versión guardada.
+    """
+    try:
+        parametros, tablas = leer_entradas(nombre_version, nombre_proyecto)
+    except Exception:
+        return {}
+    return indicadores_entradas(parametros, tablas)
+
+
+def leer_entradas(nombre_version: str, nombre_proyecto: str = "default") -> tuple:
+    """
+    Entradas de una versión guardada sin pasar por st.session_state:
+    (parametros, tablas), para evaluarla desde scripts y procesos por lotes.
+    """
+    proyecto_dir = os.path.join(CARPETA_BASE, nombre_proyecto)
+    with bloqueos.bloquear(proyecto_dir, compartido=True):
+        ruta_archivo = _ruta_version(proyecto_dir, nombre_version)
+        if not os.path.isfile(ruta_archivo):
+            raise FileNotFoundError(f"La versión '{nombre_version}' del proyecto '{nombre_proyecto}' no existe.")
+        _, parametros, tablas = _leer_version(ruta_archivo)
+    return parametros, tablas
+
+
+def _registrar_en_catalogo(nombre_proyecto: str, nombre_version: str, fecha: datetime, kpis: dict) -> None:
+    import catalogo
+
+    catalogo.registrar_version(
+        nombre_proyecto,
+        nombre_version,
+        fecha,
+        kpis.get("margen"),
+        kpis.get("pico_financiacion"),
+    )
+
+
+def _guardar_entradas(nombre_version: str, nombre_proyecto: str, fecha: datetime, parametros: dict, tablas: dict) -> None:
+    """
+    Escribe una versión con el bloqueo exclusivo del proyecto y la registra
+    en el catálogo.
+    """
+    proyecto_dir = ruta_proyecto(nombre_proyecto)
+    ruta_archivo = os.path.join(proyecto_dir, f"{nombre_version}{EXTENSION}")
+    with bloqueos.bloquear(proyecto_dir):
+        _escribir_version(ruta_archivo, fecha, parametros, tablas)
+        # La versión nueva sustituye a una anterior con el mismo nombre
+        _eliminar_formatos_anteriores(proyecto_dir, nombre_version)
+    # Los indicadores evalúan el modelo: fuera del bloqueo
+    _registrar_en_catalogo(nombre_proyecto, nombre_version, fecha, indicadores_entradas(parametros, tablas))
+
+
 def guardar_version(nombre_version: str, nombre_proyecto: str = "default") -> None:
     """
-    Guarda el estado actual de st.session_state en un archivo pickle.
-    El nombre del archivo será '<nombre_version>.pkl' dentro de la carpeta del proyecto.
+    Guarda las entradas del modelo de st.session_state (parámetros escalares y
+    tablas de viviendas, capítulos y planificación) como '<nombre_version>.json'
+    dentro de la carpeta del proyecto. Los resultados derivados no se guardan:
+    se recalculan al cargar.
     """
     if not nombre_version or not nombre_version.strip():
         raise ValueError("Debe indicar un nombre válido para la versión.")
-    proyecto_dir = ruta_proyecto(nombre_proyecto)
-    ruta_archivo = os.path.join(proyecto_dir, f"{nombre_version}.pkl")
-    datos = {
-        "fecha": datetime.now(),
-        "st_session": dict(st.session_state)
-    }
-    with open(ruta_archivo, "wb") as f:
-        pickle.dump(datos, f)
+    parametros, tablas = entradas_de_sesion(st.session_state)
+    _guardar_entradas(nombre_version, nombre_proyecto, datetime.now(), parametros, tablas)
+
+
+def guardar_version_en_segundo_plano(nombre_version: str, nombre_proyecto: str = "default") -> str:
+    """
+    Como guardar_version, pero la escritura la hace el hilo escritor y la
+    función vuelve enseguida con la ficha del guardado, única para cada
+    llamada (ver estado_guardado). Las tablas se copian antes: la sesión
+    puede cambiar mientras se escriben.
+    """
+    if not nombre_version or not nombre_version.strip():
+        raise ValueError("Debe indicar un nombre válido para la versión.")
+    parametros, tablas = entradas_de_sesion(st.session_state)
+    tablas = {nombre: None if df is None else df.copy() for nombre, df in tablas.items()}
+    ficha = uuid.uuid4().hex
+    futuro = _escritor.submit(_guardar_entradas, nombre_version, nombre_proyecto, datetime.now(), parametros, tablas)
+    with _bloqueo_guardados:
+        _guardados[ficha] = (futuro, nombre_proyecto, nombre_version)
+    return ficha
+
+
+def estado_guardado(ficha: str) -> tuple:
+    """
+    Estado del guardado en segundo plano con esa ficha: (GUARDADO_PENDIENTE,
+    None), (GUARDADO_COMPLETO, None) o (GUARDADO_ERROR, excepción); (None,
+    None) si no hay ninguno en este proceso. Un guardado terminado se olvida
+    en cuanto se consulta.
+    """
+    with _bloqueo_guardados:
+        futuro, _, _ = _guardados.get(ficha, (None, None, None))
+        if futuro is None:
+            return None, None
+        if not futuro.done():
+            return GUARDADO_PENDIENTE, None
+        del _guardados[ficha]
+    error = futuro.exception()
+    return (GUARDADO_COMPLETO, None) if error is None else (GUARDADO_ERROR, error)
 
 
 def cargar_version(nombre_version: str, nombre_proyecto: str = "default") -> None:
     """
-    Carga una versión guardada restaurando valores en st.session_state.
-    Evita modificar valores bloqueados por Streamlit (botones, widgets, etc.).
+    Carga una versión guardada restaurando sus entradas en st.session_state;
+    la app recalcula los resultados en la siguiente ejecución. Acepta también
+    versiones en formatos anteriores (.npz y .pkl); de los .pkl solo se toman
+    las entradas.
     """
     if not nombre_version or not nombre_version.strip():
         raise ValueError("Debe indicar el nombre de la versión a cargar.")
     proyecto_dir = ruta_proyecto(nombre_proyecto)
-    ruta_archivo = os.path.join(proyecto_dir, f"{nombre_version}.pkl")
-    if not os.path.isfile(ruta_archivo):
-        raise FileNotFoundError(f"La versión '{nombre_version}' no existe.")
-    with open(ruta_archivo, "rb") as f:
-        datos = pickle.load(f)
-    session_data = datos.get("st_session", {})
-    for llave, valor in session_data.items():
-        # No sobreescribir flags booleanos de botones/widgets
-        if isinstance(valor, bool):
-            continue
+    with bloqueos.bloquear(proyecto_dir, compartido=True):
+        ruta_archivo = _ruta_version(proyecto_dir, nombre_version)
+        if not os.path.isfile(ruta_archivo):
+            raise FileNotFoundError(f"La versión '{nombre_version}' no existe.")
+        _, parametros, tablas = _leer_version(ruta_archivo)
+
+    for llave, valor in parametros.items():
         try:
             st.session_state[llave] = valor
         except StreamlitValueAssignmentNotAllowedError:
             continue
-        except Exception:
-            continue
+    for nombre in TABLAS_ENTRADA:
+        if tablas.get(nombre) is not None:
+            st.session_state[nombre] = tablas[nombre]
+        elif nombre in st.session_state:
+            del st.session_state[nombre]
+    # La planificación cargada pasa a ser la base del editor, que se reinicia
+    if tablas.get("df_planificacion") is not None:
+        st.session_state["df_planificacion_base"] = tablas["df_planificacion"]
+    elif "df_planificacion_base" in st.session_state:
+        del st.session_state["df_planificacion_base"]
+    st.session_state["version_planificacion"] = st.session_state.get("version_planificacion", 0) + 1
+    for llave in RESULTADOS_DERIVADOS:
+        if llave in st.session_state:
+            del st.session_state[llave]
+
+
+def listar_proyectos() -> list:
+    """
+    Nombres de los proyectos de la carpeta de versiones, por orden alfabético
+    (sin las carpetas ocultas, como la del almacén).
+    """
+    if not os.path.isdir(CARPETA_BASE):
+        return []
+    return sorted(
+        d for d in os.listdir(CARPETA_BASE)
+        if os.path.isdir(os.path.join(CARPETA_BASE, d)) and not d.startswith(".")
+    )
 
 
 def listar_versiones(nombre_proyecto: str = "default"):
@@ -68,43 +346,131 @@ def listar_versiones(nombre_proyecto: str = "default"):
     Devuelve lista de versiones con 'nombre' y 'fecha', ordenadas de más reciente a más antigua.
     """
     proyecto_dir = ruta_proyecto(nombre_proyecto)
-    patron = os.path.join(proyecto_dir, "*.pkl")
-    archivos = glob.glob(patron)
+    archivos = []
+    nombres = set()
+    for extension in EXTENSIONES:
+        for ruta_archivo in glob.glob(os.path.join(proyecto_dir, f"*{extension}")):
+            nombre = os.path.splitext(os.path.basename(ruta_archivo))[0]
+            if nombre not in nombres:
+                nombres.add(nombre)
+                archivos.append(ruta_archivo)
     versiones = []
-    archivos.sort(key=os.path.getmtime, reverse=True)
     for ruta_archivo in archivos:
         nombre = os.path.splitext(os.path.basename(ruta_archivo))[0]
         ts = os.path.getmtime(ruta_archivo)
         fecha = datetime.fromtimestamp(ts)
         versiones.append({"nombre": nombre, "fecha": fecha})
+    versiones.sort(key=lambda v: v["fecha"], reverse=True)
     return versiones
 
 
 def duplicar_version(origen: str, nuevo_nombre: str, nombre_proyecto: str = "default") -> None:
     """
-    Duplica una versión existente con un nuevo nombre.
+    Duplica una versión existente con un nuevo nombre (en el formato actual).
+    Si el origen ya es un manifiesto basta con copiarlo: las tablas y los
+    parámetros siguen en el almacén.
     """
     if not origen or not nuevo_nombre or not nuevo_nombre.strip():
         raise ValueError("Debe indicar un origen y un nuevo nombre válidos.")
     proyecto_dir = ruta_proyecto(nombre_proyecto)
-    ruta_origen = os.path.join(proyecto_dir, f"{origen}.pkl")
-    if not os.path.isfile(ruta_origen):
-        raise FileNotFoundError(f"La versión origen '{origen}' no existe.")
-    ruta_destino = os.path.join(proyecto_dir, f"{nuevo_nombre}.pkl")
-    with open(ruta_origen, "rb") as f:
-        datos = pickle.load(f)
-    datos["fecha"] = datetime.now()
-    with open(ruta_destino, "wb") as f:
-        pickle.dump(datos, f)
+    with bloqueos.bloquear(proyecto_dir):
+        ruta_origen = _ruta_version(proyecto_dir, origen)
+        if not os.path.isfile(ruta_origen):
+            raise FileNotFoundError(f"La versión origen '{origen}' no existe.")
+        ruta_destino = os.path.join(proyecto_dir, f"{nuevo_nombre}{EXTENSION}")
+        fecha = datetime.now()
+        parametros = tablas = None
+        if ruta_origen.endswith(EXTENSION):
+            import almacen
+
+            manifiesto = almacen.leer_manifiesto(ruta_origen)
+            manifiesto["fecha"] = fecha.isoformat()
+            almacen.escribir_manifiesto(ruta_destino, manifiesto)
+        else:
+            _, parametros, tablas = _leer_version(ruta_origen)
+            _escribir_version(ruta_destino, fecha, parametros, tablas)
+        _eliminar_formatos_anteriores(proyecto_dir, nuevo_nombre)
+
+    # Las entradas son las mismas: se reutilizan los indicadores del origen
+    import catalogo
+
+    kpis = catalogo.obtener_version(nombre_proyecto, origen)
+    if kpis is None:
+        kpis = indicadores_version(nuevo_nombre, nombre_proyecto)
+    _registrar_en_catalogo(nombre_proyecto, nuevo_nombre, fecha, kpis)
 
 
 def eliminar_version(nombre_version: str, nombre_proyecto: str = "default") -> None:
     """
-    Elimina una versión guardada.
+    Elimina una versión guardada. Antes espera a los guardados en segundo
+    plano de esa misma versión que sigan en cola en este proceso: si no,
+    uno que termine después la volvería a crear.
     """
     if not nombre_version or not nombre_version.strip():
         raise ValueError("Debe indicar el nombre de la versión a eliminar.")
+    with _bloqueo_guardados:
+        pendientes = [
+            futuro for futuro, proyecto, version in _guardados.values()
+            if proyecto == nombre_proyecto and version == nombre_version
+        ]
+    # Los errores de esos guardados los recoge estado_guardado
+    wait(pendientes)
     proyecto_dir = ruta_proyecto(nombre_proyecto)
-    ruta_archivo = os.path.join(proyecto_dir, f"{nombre_version}.pkl")
-    if os.path.isfile(ruta_archivo):
-        os.remove(ruta_archivo)
+    with bloqueos.bloquear(proyecto_dir):
+        for extension in EXTENSIONES:
+            ruta_archivo = os.path.join(proyecto_dir, f"{nombre_version}{extension}")
+            if os.path.isfile(ruta_archivo):
+                os.remove(ruta_archivo)
+
+    import catalogo
+
+    catalogo.eliminar_version(nombre_proyecto, nombre_version)
+
+
+def migrar_version_antigua(ruta_antigua: str, eliminar: bool = False) -> str:
+    """
+    Convierte un archivo de versión en un formato anterior (.pkl o .npz) al
+    formato actual, conservando su fecha. Devuelve la ruta del nuevo archivo.
+    """
+    with bloqueos.bloquear(os.path.dirname(ruta_antigua)):
+        fecha, parametros, tablas = _leer_version(ruta_antigua)
+        marca = os.path.getmtime(ruta_antigua)
+        ruta_destino = os.path.splitext(ruta_antigua)[0] + EXTENSION
+        _escribir_version(ruta_destino, fecha or datetime.fromtimestamp(marca), parametros, tablas)
+        os.utime(ruta_destino, (marca, marca))
+        if eliminar:
+            os.remove(ruta_antigua)
+    return ruta_destino
+
+
+def migrar_versiones(carpeta_base: str = CARPETA_BASE, eliminar: bool = False) -> list:
+    """
+    Migra todas las versiones en formatos anteriores de carpeta_base/*/ que
+    no tengan ya un manifiesto con el mismo nombre. Devuelve una lista de
+    (ruta_origen, ruta_destino o None, error o None).
+    """
+    resultados = []
+    for extension in (EXTENSION_COLUMNAR, EXTENSION_ANTIGUA):
+        for ruta_antigua in sorted(glob.glob(os.path.join(carpeta_base, "*", f"*{extension}"))):
+            if os.path.isfile(os.path.splitext(ruta_antigua)[0] + EXTENSION):
+                continue
+            try:
+                resultados.append((ruta_antigua, migrar_version_antigua(ruta_antigua, eliminar), None))
+            except Exception as e:
+                resultados.append((ruta_antigua, None, e))
+    return resultados
+
+
+def limpiar_almacen(carpeta_base: str = CARPETA_BASE) -> int:
+    """
+    Elimina del almacén las tablas y parámetros que ya no usa ninguna versión
+    (p. ej. tras eliminar versiones). Devuelve el número de blobs eliminados.
+    Toma el bloqueo exclusivo del almacén: los guardados en curso terminan
+    antes (con su manifiesto ya escrito) o esperan a que acabe.
+    """
+    import almacen
+
+    carpeta_almacen = os.path.join(carpeta_base, CARPETA_ALMACEN)
+    with bloqueos.bloquear(carpeta_almacen):
+        manifiestos = glob.glob(os.path.join(carpeta_base, "*", f"*{EXTENSION}"))
+        return almacen.limpiar(carpeta_almacen, manifiestos)